@@ -145,6 +145,12 @@ class Dcpu16Assembler(Tokenizer):
                 val = self.token.value
                 self.next_token()
                 return val
+            elif self.is_token(IdentToken):
+                # A register indexing from a label (like a table), the label is fixed up with the
+                # rest of the label uses
+                val = self.token.value
+                self.next_token()
+                return val, 0
             else:
                 assert False
         elif self.match_token('-'):
@@ -394,7 +400,10 @@ class Dcpu16Assembler(Tokenizer):
                         self.next_token()
                         self._emit_word(val)
                     elif self.is_token(IdentToken):
-                        assert False
+                        # The address of a label, like in a table of jump targets
+                        self._use_label(self.token.value)
+                        self.next_token()
+                        self._emit_word(0)
                     else:
                         self.report_error('invalid value for .dw')
                 elif self.match_keyword('fill'):
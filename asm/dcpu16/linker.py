@@ -44,11 +44,12 @@ class Dcpu16Linker:
         if args is None:
             args = {}
 
+        # the word already holds the offset from the symbol
         for name, pos in self._global_relocs:
             if name not in self._symbols:
                 self.report_error(f'undefined symbol `{name}` referenced')
             else:
-                self._buffer[pos] = self._symbols[name]
+                self._buffer[pos] = (self._buffer[pos] + self._symbols[name]) & 0xFFFF
 
     def get_words(self):
         return self._buffer
@@ -70,7 +70,15 @@ class Dcpu16PeepholeOptimizer:
         if groups['existing_operation'] is not None:
             existing_operation = groups['existing_operation']
             existing_constant = int(groups['existing_constant'])
-            constant = eval(f'{operation} {constant} {existing_operation} {existing_constant}')
+            if operation == '-':
+                constant = -constant
+            if existing_operation == '+':
+                constant += existing_constant
+            else:
+                constant -= existing_constant
+
+            operation = '+' if constant >= 0 else '-'
+            constant = abs(constant)
 
         if 'destination' in groups:
             return f'\tSET {groups["destination"]}, [{target_reg} {operation} {constant}]'
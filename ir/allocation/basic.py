@@ -344,7 +344,8 @@ class BasicRegisterAllocator(RegisterAllocator):
 
                 need_store = False
                 need_load = False
-                tmp_var = make_var_id(var_base(next(iter(lr))), 0, self._tmp_idx + 1)
+                xvars = self._cfg.get_vars()
+                tmp_var = xvars.make_var(xvars.get_base(next(iter(lr))), 0, self._tmp_idx + 1)
 
                 if inst.op.is_opcode_assign():
                     # append store after definition of variablse in the live range.
@@ -398,8 +399,7 @@ class BasicRegisterAllocator(RegisterAllocator):
                     insts.append(asem.get_instructions()[0])
                     asem.clear()
 
-            blk.clear_instructions()
-            blk.push_instructions_front(insts)
+            blk.splice_instructions(0, len(blk.get_instructions()), insts)
 
     def _contains_live_range_use(self, inst: IrInstruction, lr: LiveRange):
         """
@@ -10,17 +10,22 @@ class Assembler:
 
     class LabelUse:
 
-        def __init__(self, lbl: IrLabelId, pos: int):
+        def __init__(self, lbl: IrLabelId, pos: int, extra: int = None):
             self.lbl = lbl
             self.pos = pos
 
+            # The index of the label in the extra operands, None if it is the first operand
+            self.extra = extra
+
     def __init__(self):
         self._insts: List[IrInstruction] = []
         self._pos = 0
 
         self._next_lbl_id = 1
         self._lbl_fixes: Dict[IrLabelId, int] = {}
-        self._lbl_uses: List[Assembler.LabelUse] = []
+
+        # The uses of every label that were not fixed yet
+        self._lbl_uses: Dict[IrLabelId, List[Assembler.LabelUse]] = {}
 
     def get_instructions(self):
         return self._insts
@@ -63,16 +68,22 @@ class Assembler:
         """
         Updates label references where the label location is known.
         """
-        for use in self._lbl_uses[:]:
-            if use.lbl not in self._lbl_fixes:
-                continue
-
-            fix_pos = self._lbl_fixes[use.lbl]
-            inst = self._insts[use.pos]
-            delta = fix_pos - (use.pos + 1)
-            inst.oprs[0] = IrOffset(delta)
-
-            self._lbl_uses.remove(use)
+        fixed = [lbl for lbl in self._lbl_uses if lbl in self._lbl_fixes]
+        for lbl in fixed:
+            fix_pos = self._lbl_fixes[lbl]
+            for use in self._lbl_uses.pop(lbl):
+                inst = self._insts[use.pos]
+                delta = fix_pos - (use.pos + 1)
+                if use.extra is None:
+                    inst.oprs[0] = IrOffset(delta)
+                else:
+                    inst.extra[use.extra] = IrOffset(delta)
+
+    def _use_label(self, lbl: IrLabelId, extra: int = None):
+        """
+        Remembers that the instruction at the current position uses the label.
+        """
+        self._lbl_uses.setdefault(lbl, []).append(Assembler.LabelUse(lbl, self._pos, extra))
 
     #
     # Emit methods:
@@ -135,6 +146,20 @@ class Assembler:
     def emit_jge(self, opr: IrOperand, a: IrOperand, b: IrOperand):
         self._emit_basic3(IrOpcode.JGE, opr, a, b)
 
+    def emit_jmp_table(self, opr: IrOperand, targets: List[IrLabel]):
+        """
+        Jumps to targets[opr], the index must be in range.
+        """
+        for i, target in enumerate(targets):
+            self._use_label(target.get_id(), i)
+
+        inst = self._put_instruction()
+        inst.op = IrOpcode.JMP_TABLE
+        inst.oprs[0] = copy(opr)
+        for target in targets:
+            inst.push_extra(copy(target))
+        return inst
+
     def emit_ret(self, opr: IrOperand):
         self._emit_basic1(IrOpcode.RET, opr)
 
@@ -210,7 +235,7 @@ class Assembler:
         Emits a standard instruction in the form of: r = a <op> b or jcc <lbl>, <a>, <b>
         """
         if isinstance(r, IrLabel):
-            self._lbl_uses.append(Assembler.LabelUse(r.get_id(), self._pos))
+            self._use_label(r.get_id())
 
         inst = self._put_instruction()
         inst.op = op
@@ -232,7 +257,7 @@ class Assembler:
         Emits an instruction that takes a single operand.
         """
         if isinstance(opr, IrLabel):
-            self._lbl_uses.append(Assembler.LabelUse(opr.get_id(), self._pos))
+            self._use_label(opr.get_id())
 
         inst = self._put_instruction()
         inst.op = op
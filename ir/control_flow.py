@@ -52,8 +52,13 @@ class BasicBlock:
         """
         Inserts a range of instructions to the beginning of the block.
         """
-        for inst in reversed(insts):
-            self.push_instruction_front(inst)
+        self._insts[0:0] = insts
+
+    def splice_instructions(self, start: int, end: int, insts: List[IrInstruction]):
+        """
+        Replaces the instructions from start up to (not including) end with a range of instructions.
+        """
+        self._insts[start:end] = insts
 
     def add_prev(self, blk):
         """
@@ -82,9 +87,10 @@ class ControlFlowGraph:
     A control flow graph!
     """
 
-    def __init__(self, xtype: ControlFlowGraphType, root: BasicBlock):
+    def __init__(self, xtype: ControlFlowGraphType, root: BasicBlock, xvars: IrVarTable):
         self._type = xtype
         self._root = root
+        self._vars = xvars
         self._block_map: Dict[BasicBlockId, BasicBlock] = {}
         self._blocks: List[BasicBlock] = []
 
@@ -97,6 +103,9 @@ class ControlFlowGraph:
     def get_root(self):
         return self._root
 
+    def get_vars(self) -> IrVarTable:
+        return self._vars
+
     def get_blocks(self):
         return self._blocks
 
@@ -144,15 +153,15 @@ class ControlFlowAnalyzer:
     def __init__(self):
         self._next_blk_id = 1
 
-    def build_graph(self, insts: List[IrInstruction]) -> ControlFlowGraph:
+    def build_graph(self, insts: List[IrInstruction], xvars: IrVarTable) -> ControlFlowGraph:
         """
-        Builds a control flow graph.
+        Builds a control flow graph, xvars are the variables of the procedure.
         """
 
         if len(insts) == 0:
             root = BasicBlock(self._next_blk_id)
             self._next_blk_id += 1
-            cfg = ControlFlowGraph(ControlFlowGraphType.NORMAL, root)
+            cfg = ControlFlowGraph(ControlFlowGraphType.NORMAL, root, xvars)
             cfg.map_block(root.get_id(), root)
             return cfg
 
@@ -169,6 +178,14 @@ class ControlFlowAnalyzer:
                 assert isinstance(inst.oprs[0], IrOffset), "branch instruction operand is not an offset"
                 leaders[i + 1 + inst.oprs[0].get_offset()] = True
 
+            elif inst.op == IrOpcode.JMP_TABLE:
+                # Mark next instruction and all the targets as leaders
+                if i != len(insts) - 1:
+                    leaders[i + 1] = True
+                for target in inst.extra:
+                    assert isinstance(target, IrOffset), "jump table target is not an offset"
+                    leaders[i + 1 + target.get_offset()] = True
+
             elif _is_end_instruction(inst):
                 # Mark next instruction as leader
                 if i != len(insts) - 1:
@@ -205,23 +222,52 @@ class ControlFlowAnalyzer:
 
                     last.oprs[0] = IrBlockRef(target.get_id())
 
-            if last.op != IrOpcode.JMP and not _is_end_instruction(last):
+            elif last.op == IrOpcode.JMP_TABLE:
+                # Targets that repeat are still a single edge
+                for j in range(len(last.extra)):
+                    target = blocks[p + len(blk.get_instructions()) + last.extra[j].get_offset()]
+                    if target not in blk.get_next():
+                        target.add_prev(blk)
+                        blk.add_next(target)
+
+                    last.extra[j] = IrBlockRef(target.get_id())
+
+            if last.op != IrOpcode.JMP and last.op != IrOpcode.JMP_TABLE and not _is_end_instruction(last):
                 next_idx = p + len(blk.get_instructions())
                 if next_idx in blocks:
                     next_blk = blocks[next_idx]
                     next_blk.add_prev(blk)
                     blk.add_next(next_blk)
 
-        cfg = ControlFlowGraph(ControlFlowGraphType.NORMAL, blocks[0])
+        # drop the blocks that can't be reached (like the code after an endless loop or the cases of a
+        # switch on a constant), the analysis after this expects every block to have a path from the root
+        reachable = {blocks[0].get_id()}
+        to_visit = [blocks[0]]
+        while len(to_visit) != 0:
+            blk = to_visit.pop()
+            for next_blk in blk.get_next():
+                if next_blk.get_id() not in reachable:
+                    reachable.add(next_blk.get_id())
+                    to_visit.append(next_blk)
+
+        cfg = ControlFlowGraph(ControlFlowGraphType.NORMAL, blocks[0], xvars)
         for p in blocks:
-            cfg.map_block(blocks[p].get_id(), blocks[p])
-            blocks[p].set_base(p)
+            blk = blocks[p]
+            if blk.get_id() not in reachable:
+                continue
+
+            prev = blk.get_prev()
+            if any(b.get_id() not in reachable for b in prev):
+                prev[:] = [b for b in prev if b.get_id() in reachable]
+
+            cfg.map_block(blk.get_id(), blk)
+            blk.set_base(p)
         return cfg
 
 
-def make_cfg(insts: List[IrInstruction]) -> ControlFlowGraph:
+def make_cfg(insts: List[IrInstruction], xvars: IrVarTable) -> ControlFlowGraph:
     """
     Static method for convenience.
     """
     an = ControlFlowAnalyzer()
-    return an.build_graph(insts)
+    return an.build_graph(insts, xvars)
@@ -77,26 +77,35 @@ class DomAnalysis:
     Dominance analysis results.
     """
 
-    def __init__(self):
-        self._block_map: Dict[BasicBlockId, Set[BasicBlockId]] = {}
+    def __init__(self, root: BasicBlockId):
+        self._root = root
         self._idom_map: Dict[BasicBlockId, BasicBlockId] = {}
+        self._children_map: Dict[BasicBlockId, List[BasicBlockId]] = {}
         self._df_map: Dict[BasicBlockId, Set[BasicBlockId]] = {}
 
-    def add_block(self, xid: BasicBlockId, doms: Set[BasicBlockId]):
-        self._block_map[xid] = doms
+    def get_root(self) -> BasicBlockId:
+        return self._root
 
     def get_block(self, xid: BasicBlockId) -> Set[BasicBlockId]:
         """
         Returns the set of blocks dominating the specified block.
         """
-        assert xid in self._block_map, "invalid id"
-        return self._block_map[xid]
+        assert xid == self._root or xid in self._idom_map, "invalid id"
+        doms = {xid}
+        while xid in self._idom_map:
+            xid = self._idom_map[xid]
+            doms.add(xid)
+        return doms
 
     def set_idom(self, xid: BasicBlockId, idom: BasicBlockId):
         """
-        Sets a block's immediate dominator.
+        Sets a block's immediate dominator, the block is added as a child of
+        the dominator in the dominator tree.
         """
         self._idom_map[xid] = idom
+        if idom not in self._children_map:
+            self._children_map[idom] = []
+        self._children_map[idom].append(xid)
 
     def get_idom(self, xid: BasicBlockId) -> BasicBlockId:
         """
@@ -105,6 +114,15 @@ class DomAnalysis:
         assert xid in self._idom_map, "invalid id"
         return self._idom_map[xid]
 
+    def get_children(self, xid: BasicBlockId) -> List[BasicBlockId]:
+        """
+        Returns the blocks immediately dominated by the specified block (its
+        children in the dominator tree), in the order of the CFG.
+        """
+        if xid not in self._children_map:
+            return []
+        return self._children_map[xid]
+
     def add_df(self, xid: BasicBlockId, df: BasicBlockId):
         """
         Inserts a block into a specified block's dominance frontier set.
@@ -122,18 +140,26 @@ class DomAnalysis:
         return self._df_map[xid]
 
 
-class DomAnalyzer(IterativeAnalyzer):
+class DomAnalyzer:
     """
     Dominance analyzer.
-    """
-
-    class MyFragment:
 
-        def __init__(self):
-            self.doms: Set[BasicBlockId] = set()
+    Uses the algorithm of Cooper, Harvey and Kennedy ("A Simple, Fast
+    Dominance Algorithm"). The blocks are numbered in reverse postorder and
+    the immediate dominators are iterated to a fixed point, the dominator
+    sets are never built, two blocks are intersected by walking up their
+    immediate dominators instead.
+    """
 
     def __init__(self):
-        super(DomAnalyzer, self).__init__()
+        self._cfg: ControlFlowGraph = None
+
+        # The blocks in reverse postorder, and the predecessors and immediate
+        # dominator of every block by its index in that order
+        self._order: List[BasicBlock] = []
+        self._index: Dict[BasicBlock, int] = {}
+        self._preds: List[List[int]] = []
+        self._idoms: List[int] = []
 
     def analyze(self, cfg: ControlFlowGraph) -> DomAnalysis:
         """
@@ -142,85 +168,93 @@ class DomAnalyzer(IterativeAnalyzer):
         :param cfg: The control flow graph to analyze.
         :return: The results of the analysis.
         """
+        self._cfg = cfg
+        self._number_blocks()
 
-        self.set_active_cfg(cfg)
-        self._solve(cfg)
+        # compute immediate dominators
+        self._compute_idoms()
 
-        result = DomAnalysis()
+        result = DomAnalysis(cfg.get_root().get_id())
         for blk in cfg.get_blocks():
-            frag: DomAnalyzer.MyFragment = self._get_fragment(blk)
-            result.add_block(blk.get_id(), frag.doms)
-
-        # compute immediate dominators
-        self._compute_idoms(result)
+            i = self._index.get(blk, 0)
+            if i != 0:
+                result.set_idom(blk.get_id(), self._order[self._idoms[i]].get_id())
 
         # compute dominance frontiers
         self._compute_dfs(result)
 
         return result
 
-    def _compute_idoms(self, result: DomAnalysis):
+    def _number_blocks(self):
+        """
+        Orders the blocks reachable from the root in reverse postorder.
+        """
+        root = self._cfg.get_root()
+        postorder: List[BasicBlock] = []
+        visited = {root}
+        stack = [(root, iter(root.get_next()))]
+        while len(stack) != 0:
+            blk, nexts = stack[-1]
+            for nxt in nexts:
+                if nxt not in visited:
+                    visited.add(nxt)
+                    stack.append((nxt, iter(nxt.get_next())))
+                    break
+            else:
+                stack.pop()
+                postorder.append(blk)
+
+        postorder.reverse()
+        index = {blk: i for i, blk in enumerate(postorder)}
+        self._order = postorder
+        self._index = index
+        self._preds = [[index[prev] for prev in blk.get_prev() if prev in index] for blk in postorder]
+
+    def _compute_idoms(self):
         """
         Finds all immediate dominators.
         """
-        for blk in self._cfg.get_blocks():
-            doms = result.get_block(blk.get_id())
-            for dom in doms:
-                if dom == blk.get_id():
-                    continue
-
-                found = False
-                for other_dom in doms:
-                    if other_dom != blk.get_id() and other_dom != dom:
-                        other_dom_doms = result.get_block(other_dom)
-                        if dom in other_dom_doms:
-                            found = True
-                            break
-
-                if not found:
-                    result.set_idom(blk.get_id(), dom)
+        idoms = [-1] * len(self._order)
+        idoms[0] = 0
+
+        changed = True
+        while changed:
+            changed = False
+            for i in range(1, len(self._order)):
+                new_idom = -1
+                for pred in self._preds[i]:
+                    if idoms[pred] == -1:
+                        continue
+
+                    if new_idom == -1:
+                        new_idom = pred
+                        continue
+
+                    # intersect, a dominator always comes first in reverse postorder
+                    while pred != new_idom:
+                        while pred > new_idom:
+                            pred = idoms[pred]
+                        while new_idom > pred:
+                            new_idom = idoms[new_idom]
+
+                if idoms[i] != new_idom:
+                    idoms[i] = new_idom
+                    changed = True
+
+        self._idoms = idoms
 
     def _compute_dfs(self, result: DomAnalysis):
         """
         Computes dominance frontiers.
         """
-        for blk in self._cfg.get_blocks():
-            prevs = blk.get_prev()
-            if len(prevs) > 1:
-                blk_idom = result.get_idom(blk.get_id())
-                for curr in prevs:
-                    while curr.get_id() != blk_idom:
-                        result.add_df(curr.get_id(), blk.get_id())
-                        curr = self._cfg.find_block(result.get_idom(curr.get_id()))
-
-    def _compute_fragment(self, frag: MyFragment, blk: BasicBlock) -> bool:
-        ndoms = set()
-
-        prevs = blk.get_prev()
-        if len(prevs) != 0:
-            ndoms = set(self._get_fragment(prevs[0]).doms)
-
-            for prev in prevs[1:]:
-                prev_frag = self._get_fragment(prev)
-                ndoms = set(filter(lambda x: x in prev_frag.doms, ndoms))
-
-        ndoms.add(blk.get_id())
-
-        modified = frag.doms != ndoms
-        if modified:
-            frag.doms = ndoms
-        return modified
-
-    def _compute_init_fragment(self, blk: BasicBlock) -> MyFragment:
-        frag = DomAnalyzer.MyFragment()
-
-        if self._cfg.get_root().get_id() == blk.get_id():
-            frag.doms.add(blk.get_id())
-        else:
-            for b in self._cfg.get_blocks():
-                frag.doms.add(b.get_id())
-
-        return frag
+        idoms = self._idoms
+        for i, preds in enumerate(self._preds):
+            if len(preds) > 1:
+                blk_id = self._order[i].get_id()
+                for runner in preds:
+                    while runner != idoms[i]:
+                        result.add_df(self._order[runner].get_id(), blk_id)
+                        runner = idoms[runner]
 
 
 # ----------------------------------------------------------------------------------------------------------------------
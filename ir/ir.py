@@ -1,5 +1,5 @@
 from enum import Enum, auto
-from typing import List
+from typing import List, Dict, Tuple
 
 
 BasicBlockId = int
@@ -36,6 +36,9 @@ class IrOpcodeClass(Enum):
     # call a (extra...)
     CALL = auto()
 
+    # op a (targets...)
+    TABLE = auto()
+
 
 class IrOpcode(Enum):
     """
@@ -88,6 +91,9 @@ class IrOpcode(Enum):
     JG = auto()
     JGE = auto()
 
+    # jumps to the target at index a of its extra operands
+    JMP_TABLE = auto()
+
     # special instructions
     ASSIGN_PHI = auto()
     LOAD = auto()
@@ -98,133 +104,181 @@ class IrOpcode(Enum):
         """
         Returns true if the opcode described an instruction of the form: X = Y.
         """
-        return self in [
-            IrOpcode.ASSIGN,
-
-            IrOpcode.ASSIGN_ADD,
-            IrOpcode.ASSIGN_SUB,
-            IrOpcode.ASSIGN_MUL,
-            IrOpcode.ASSIGN_DIV,
-            IrOpcode.ASSIGN_MOD,
-
-            IrOpcode.ASSIGN_SIGNED_ADD,
-            IrOpcode.ASSIGN_SIGNED_SUB,
-            IrOpcode.ASSIGN_SIGNED_MUL,
-            IrOpcode.ASSIGN_SIGNED_DIV,
-            IrOpcode.ASSIGN_SIGNED_MOD,
-
-            IrOpcode.ASSIGN_OR,
-            IrOpcode.ASSIGN_AND,
-            IrOpcode.ASSIGN_XOR,
-
-            IrOpcode.ASSIGN_READ,
-            IrOpcode.ASSIGN_ADDROF,
-
-            IrOpcode.ASSIGN_CALL,
-            IrOpcode.ASSIGN_PHI,
-        ]
+        return self._assign
 
     def get_opcode_class(self) -> IrOpcodeClass:
         """
         Returns the class of the specified opcode.
         """
-        return {
-            IrOpcode.UNDEF: IrOpcodeClass.NONE,
-            IrOpcode.RETN: IrOpcodeClass.NONE,
-
-            # intentionally done so that these instructions don't get handled the
-            # usual way.
-            IrOpcode.LOAD: IrOpcodeClass.NONE,
-            IrOpcode.STORE: IrOpcodeClass.NONE,
-            IrOpcode.UNLOAD: IrOpcodeClass.NONE,
-
-            IrOpcode.ASSIGN: IrOpcodeClass.ASSIGN2,
-
-            IrOpcode.ASSIGN_READ: IrOpcodeClass.ASSIGN2,
-            IrOpcode.ASSIGN_ADDROF: IrOpcodeClass.ASSIGN2,
-
-            IrOpcode.ASSIGN_ADD: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_SUB: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_MUL: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_DIV: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_MOD: IrOpcodeClass.ASSIGN3,
-
-            IrOpcode.ASSIGN_SIGNED_ADD: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_SIGNED_SUB: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_SIGNED_MUL: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_SIGNED_DIV: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_SIGNED_MOD: IrOpcodeClass.ASSIGN3,
-
-            IrOpcode.ASSIGN_OR: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_AND: IrOpcodeClass.ASSIGN3,
-            IrOpcode.ASSIGN_XOR: IrOpcodeClass.ASSIGN3,
-
-            IrOpcode.RET: IrOpcodeClass.USE1,
-            IrOpcode.JMP: IrOpcodeClass.USE1,
-            IrOpcode.JE: IrOpcodeClass.USE3,
-            IrOpcode.JNE: IrOpcodeClass.USE3,
-            IrOpcode.JL: IrOpcodeClass.USE3,
-            IrOpcode.JLE: IrOpcodeClass.USE3,
-            IrOpcode.JG: IrOpcodeClass.USE3,
-            IrOpcode.JGE: IrOpcodeClass.USE3,
-
-            IrOpcode.WRITE: IrOpcodeClass.USE2,
-
-            IrOpcode.ASSIGN_CALL: IrOpcodeClass.ASSIGN_CALL,
-
-            IrOpcode.ASSIGN_PHI: IrOpcodeClass.ASSIGN_FIXED_CALL,
-
-            IrOpcode.CALL: IrOpcodeClass.CALL,
-        }[self]
+        return self._class
 
     def get_operand_count(self) -> int:
         """
         Returns the number of operands used by the specified opcode.
         """
-        return {
-            IrOpcodeClass.ASSIGN_CALL: 2,
-            IrOpcodeClass.ASSIGN_FIXED_CALL: 1,
-            IrOpcodeClass.NONE: 0,
-            IrOpcodeClass.USE1: 1,
-            IrOpcodeClass.USE2: 2,
-            IrOpcodeClass.USE3: 3,
-            IrOpcodeClass.ASSIGN2: 2,
-            IrOpcodeClass.ASSIGN3: 3,
-            IrOpcodeClass.CALL: 1,
-        }[self.get_opcode_class()]
+        return self._operand_count
 
     def has_extra_operands(self) -> bool:
         """
         Checks whether the specified opcode requires extra operands.
         """
-        return self.get_opcode_class() in [
-            IrOpcodeClass.ASSIGN_CALL,
-            IrOpcodeClass.ASSIGN_FIXED_CALL,
-            IrOpcodeClass.CALL,
-        ]
+        return self._extra
+
+
+#
+# The properties of the opcodes are asked for every instruction by every pass, so they are
+# computed once and kept on the opcodes themselves.
+#
+
+_ASSIGN_OPCODES = frozenset([
+    IrOpcode.ASSIGN,
+
+    IrOpcode.ASSIGN_ADD,
+    IrOpcode.ASSIGN_SUB,
+    IrOpcode.ASSIGN_MUL,
+    IrOpcode.ASSIGN_DIV,
+    IrOpcode.ASSIGN_MOD,
+
+    IrOpcode.ASSIGN_SIGNED_ADD,
+    IrOpcode.ASSIGN_SIGNED_SUB,
+    IrOpcode.ASSIGN_SIGNED_MUL,
+    IrOpcode.ASSIGN_SIGNED_DIV,
+    IrOpcode.ASSIGN_SIGNED_MOD,
+
+    IrOpcode.ASSIGN_OR,
+    IrOpcode.ASSIGN_AND,
+    IrOpcode.ASSIGN_XOR,
+
+    IrOpcode.ASSIGN_READ,
+    IrOpcode.ASSIGN_ADDROF,
+
+    IrOpcode.ASSIGN_CALL,
+    IrOpcode.ASSIGN_CALL_PTR,
+    IrOpcode.ASSIGN_PHI,
+])
+
+_OPCODE_CLASSES = {
+    IrOpcode.UNDEF: IrOpcodeClass.NONE,
+    IrOpcode.RETN: IrOpcodeClass.NONE,
+
+    # intentionally done so that these instructions don't get handled the
+    # usual way.
+    IrOpcode.LOAD: IrOpcodeClass.NONE,
+    IrOpcode.STORE: IrOpcodeClass.NONE,
+    IrOpcode.UNLOAD: IrOpcodeClass.NONE,
+
+    IrOpcode.ASSIGN: IrOpcodeClass.ASSIGN2,
+
+    IrOpcode.ASSIGN_READ: IrOpcodeClass.ASSIGN2,
+    IrOpcode.ASSIGN_ADDROF: IrOpcodeClass.ASSIGN2,
+
+    IrOpcode.ASSIGN_ADD: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_SUB: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_MUL: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_DIV: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_MOD: IrOpcodeClass.ASSIGN3,
+
+    IrOpcode.ASSIGN_SIGNED_ADD: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_SIGNED_SUB: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_SIGNED_MUL: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_SIGNED_DIV: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_SIGNED_MOD: IrOpcodeClass.ASSIGN3,
+
+    IrOpcode.ASSIGN_OR: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_AND: IrOpcodeClass.ASSIGN3,
+    IrOpcode.ASSIGN_XOR: IrOpcodeClass.ASSIGN3,
+
+    IrOpcode.RET: IrOpcodeClass.USE1,
+    IrOpcode.JMP: IrOpcodeClass.USE1,
+    IrOpcode.JE: IrOpcodeClass.USE3,
+    IrOpcode.JNE: IrOpcodeClass.USE3,
+    IrOpcode.JL: IrOpcodeClass.USE3,
+    IrOpcode.JLE: IrOpcodeClass.USE3,
+    IrOpcode.JG: IrOpcodeClass.USE3,
+    IrOpcode.JGE: IrOpcodeClass.USE3,
+
+    IrOpcode.WRITE: IrOpcodeClass.USE2,
+
+    IrOpcode.ASSIGN_CALL: IrOpcodeClass.ASSIGN_CALL,
+    IrOpcode.ASSIGN_CALL_PTR: IrOpcodeClass.ASSIGN_CALL,
+
+    IrOpcode.ASSIGN_PHI: IrOpcodeClass.ASSIGN_FIXED_CALL,
+
+    IrOpcode.CALL: IrOpcodeClass.CALL,
+    IrOpcode.CALL_PTR: IrOpcodeClass.CALL,
+
+    IrOpcode.JMP_TABLE: IrOpcodeClass.TABLE,
+}
+
+_OPERAND_COUNTS = {
+    IrOpcodeClass.ASSIGN_CALL: 2,
+    IrOpcodeClass.ASSIGN_FIXED_CALL: 1,
+    IrOpcodeClass.NONE: 0,
+    IrOpcodeClass.USE1: 1,
+    IrOpcodeClass.USE2: 2,
+    IrOpcodeClass.USE3: 3,
+    IrOpcodeClass.ASSIGN2: 2,
+    IrOpcodeClass.ASSIGN3: 3,
+    IrOpcodeClass.CALL: 1,
+    IrOpcodeClass.TABLE: 1,
+}
+
+_EXTRA_OPERAND_CLASSES = frozenset([
+    IrOpcodeClass.ASSIGN_CALL,
+    IrOpcodeClass.ASSIGN_FIXED_CALL,
+    IrOpcodeClass.CALL,
+    IrOpcodeClass.TABLE,
+])
+
+for _op in IrOpcode:
+    _op._assign = _op in _ASSIGN_OPCODES
+    _op._class = _OPCODE_CLASSES[_op]
+    _op._operand_count = _OPERAND_COUNTS[_op._class]
+    _op._extra = _op._class in _EXTRA_OPERAND_CLASSES
 
 
 class IrOperand:
     """
     Base class for IR operands.
     """
-    pass
+
+    __slots__ = ()
 
 
 class IrConst(IrOperand):
     """
     Constant operand.
+
+    Constants are never changed, so the small ones are shared instead of being created (and copied)
+    for every use.
     """
 
-    def __init__(self, val: int = 0):
-        self._val = val
+    __slots__ = ('_val',)
+
+    # Constants up to this value are shared
+    INTERN_LIMIT = 256
+
+    _interned = {}  # type: Dict[int, IrConst]
+
+    def __new__(cls, val: int = 0):
+        if 0 <= val < IrConst.INTERN_LIMIT:
+            const = IrConst._interned.get(val)
+            if const is None:
+                const = super(IrConst, cls).__new__(cls)
+                const._val = val
+                IrConst._interned[val] = const
+            return const
+
+        const = super(IrConst, cls).__new__(cls)
+        const._val = val
+        return const
+
+    def __copy__(self):
+        return self
 
     def get_value(self) -> int:
         return self._val
 
-    def set_value(self, value: int):
-        self._val = value
-
     def __eq__(self, other):
         if isinstance(other, IrConst):
             return self._val == other._val
@@ -239,24 +293,67 @@ class IrConst(IrOperand):
 
 IrVarId = int
 """
-Variable identifier.
+Variable identifier, dense inside a procedure (see IrVarTable).
 """
 
 
-def make_var_id(base: int, subscript: int = 0, special: int = 0):
-    return base | (subscript << 16) | (special << 32)
+class IrVarTable:
+    """
+    The variables of a procedure.
+
+    The first ids are the base variables the procedure was translated with, every variable derived
+    from a base (an SSA name, the subscript, or a spill temporary, the special index) takes the next
+    free id the first time it is made. Ids stay dense no matter how big the procedure is, so they can
+    index lists directly, the base, subscript and special index of every id are kept on the side.
+    """
+
+    __slots__ = ('_bases', '_subscripts', '_specials', '_derived')
+
+    def __init__(self):
+        self._bases: List[IrVarId] = []
+        self._subscripts: List[int] = []
+        self._specials: List[int] = []
+        self._derived: Dict[Tuple[IrVarId, int, int], IrVarId] = {}
+
+    def __len__(self):
+        return len(self._bases)
 
+    def add_bases(self, count: int):
+        """
+        Makes every id below count a base variable, has to be done before deriving anything.
+        """
+        assert len(self._derived) == 0, "base variables added after deriving variables"
+        for xid in range(len(self._bases), count):
+            self._bases.append(xid)
+            self._subscripts.append(0)
+            self._specials.append(0)
 
-def var_base(xid: IrVarId):
-    return xid & 0xFFFF
+    def make_var(self, base: IrVarId, subscript: int = 0, special: int = 0) -> IrVarId:
+        """
+        Returns the id of the variable derived from the base, a new one if it was not made before.
+        """
+        assert self._bases[base] == base, "can only derive from a base variable"
+        if subscript == 0 and special == 0:
+            return base
 
+        key = (base, subscript, special)
+        xid = self._derived.get(key)
+        if xid is None:
+            xid = len(self._bases)
+            self._bases.append(base)
+            self._subscripts.append(subscript)
+            self._specials.append(special)
+            self._derived[key] = xid
+        return xid
 
-def var_subscript(xid: IrVarId):
-    return (xid >> 16) & 0xFFFF
+    def get_base(self, xid: IrVarId) -> IrVarId:
+        return self._bases[xid]
 
+    def get_subscript(self, xid: IrVarId) -> int:
+        return self._subscripts[xid]
 
-def var_special(xid: IrVarId):
-    return xid >> 32
+    def get_special(self, xid: IrVarId) -> int:
+        return self._specials[xid]
 
 
 class IrVar(IrOperand):
@@ -264,9 +361,14 @@ class IrVar(IrOperand):
     Variable operand.
     """
 
+    __slots__ = ('_id',)
+
     def __init__(self, xid: IrVarId = 0):
         self._id = xid
 
+    def __copy__(self):
+        return IrVar(self._id)
+
     def get_id(self) -> IrVarId:
         return self._id
 
@@ -282,13 +384,7 @@ class IrVar(IrOperand):
         return not (self == other)
 
     def __repr__(self):
-        # TODO: use make_var
-        s = f'{var_base(self._id)}'
-        if var_special(self._id) != 0:
-            s += f'<{var_special(self._id)}>'
-        if var_subscript(self._id) != 0:
-            s += f'_{var_subscript(self._id)}'
-        return f'IrVar({s})'
+        return f'IrVar({self._id})'
 
 
 IrLabelId = int
@@ -302,9 +398,14 @@ class IrLabel(IrOperand):
     Label operand (used in branch instructions).
     """
 
+    __slots__ = ('_id',)
+
     def __init__(self, xid: IrLabelId = 0):
         self._id = xid
 
+    def __copy__(self):
+        return IrLabel(self._id)
+
     def get_id(self) -> IrLabelId:
         return self._id
 
@@ -328,9 +429,14 @@ class IrOffset(IrOperand):
     Constant displacement operand.
     """
 
+    __slots__ = ('_off',)
+
     def __init__(self, off: int = 0):
         self._off = off
 
+    def __copy__(self):
+        return IrOffset(self._off)
+
     def get_offset(self) -> int:
         return self._off
 
@@ -354,9 +460,14 @@ class IrName(IrOperand):
     Known name operand.
     """
 
+    __slots__ = ('_name',)
+
     def __init__(self, name: str = 0):
         self._name = name
 
+    def __copy__(self):
+        return IrName(self._name)
+
     def get_name(self) -> str:
         return self._name
 
@@ -385,9 +496,14 @@ class IrBlockRef(IrOperand):
     encode their destination with a basic block operand.
     """
 
+    __slots__ = ('_id',)
+
     def __init__(self, xid: BasicBlockId = 0):
         self._id = xid
 
+    def __copy__(self):
+        return IrBlockRef(self._id)
+
     def get_id(self) -> BasicBlockId:
         return self._id
 
@@ -411,6 +527,8 @@ class IrInstruction:
     Stores a single IR instruction.
     """
 
+    __slots__ = ('op', 'oprs', 'extra')
+
     def __init__(self):
         self.op: IrOpcode = IrOpcode.UNDEF
         self.oprs: List[IrOperand or None] = [None, None, None]
@@ -10,11 +10,14 @@ class Printer:
     IR pretty printer.
     """
 
-    def __init__(self):
+    def __init__(self, xvars: IrVarTable = None):
         self._base = 0
         self._inst_idx = 0
         self._names: Dict[IrVarId, str] = {}
 
+        # Without the variables of the procedure every variable is printed as a base variable
+        self._vars = xvars
+
     def add_name(self, xid: IrVarId, name: str):
         self._names[xid] = name
 
@@ -55,6 +58,7 @@ class Printer:
             IrOpcode.JLE: 'jle',
             IrOpcode.JG: 'jg',
             IrOpcode.JGE: 'jge',
+            IrOpcode.JMP_TABLE: 'jmp',
 
             IrOpcode.ASSIGN_CALL: 'call',
 
@@ -114,6 +118,9 @@ class Printer:
         ]:
             return f'{self.print_mnemonic(ins.op)} {self.print_operand(ins.oprs[0])}, {self.print_operand(ins.oprs[1])}, {self.print_operand(ins.oprs[2])}'
 
+        elif ins.op == IrOpcode.JMP_TABLE:
+            return f'{self.print_mnemonic(ins.op)} [{", ".join(map(self.print_operand, ins.extra))}][{self.print_operand(ins.oprs[0])}]'
+
         elif ins.op == IrOpcode.ASSIGN_PHI:
             return f'{self.print_operand(ins.oprs[0])} = phi({", ".join(map(self.print_operand, ins.extra))})'
 
@@ -183,17 +190,20 @@ class Printer:
 
             if var in self._names:
                 s = self._names[var]
+            elif self._vars is None:
+                s = f't{var}'
             else:
-                if var_base(var) in self._names:
-                    s = self._names[var_base(var)]
+                base = self._vars.get_base(var)
+                if base in self._names:
+                    s = self._names[base]
                 else:
-                    s = f't{var_base(var)}'
+                    s = f't{base}'
 
-                if var_special(var) != 0:
-                    s += f'<{var_special(var)}>'
+                if self._vars.get_special(var) != 0:
+                    s += f'<{self._vars.get_special(var)}>'
 
-                if var_subscript(var) != 0:
-                    s += f'_{var_subscript(var)}'
+                if self._vars.get_subscript(var) != 0:
+                    s += f'_{self._vars.get_subscript(var)}'
 
             return s
 
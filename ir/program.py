@@ -9,6 +9,7 @@ class Procedure:
     def __init__(self, name: str):
         self._name = name
         self._params: List[IrVarId] = []
+        self._vars = IrVarTable()
         self._body: List[IrInstruction] = []
         self._export = False
 
@@ -24,6 +25,9 @@ class Procedure:
     def get_params(self):
         return self._params
 
+    def get_vars(self) -> IrVarTable:
+        return self._vars
+
     def get_body(self):
         return self._body
 
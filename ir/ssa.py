@@ -21,6 +21,7 @@ class SsaBuilder:
 
     def __init__(self):
         self._cfg: ControlFlowGraph = None
+        self._vars: IrVarTable = None
 
         self._globals: Set[IrVarId] = set()
         self._def_blocks: Dict[IrVarId, Set[BasicBlockId]] = {}
@@ -30,6 +31,10 @@ class SsaBuilder:
         self._counters: Dict[IrVarId, int] = {}
         self._stacks: Dict[IrVarId, List[int]] = {}
 
+        # The index of every block in the predecessors of its successors, the
+        # phi-function operand it fills
+        self._pred_indices: Dict[BasicBlockId, Dict[BasicBlockId, int]] = {}
+
     def transform(self, cfg: ControlFlowGraph):
         """
         Transforms the specified CFG into SSA form.
@@ -37,6 +42,7 @@ class SsaBuilder:
         :param cfg: The control flow graph to transform.
         """
         self._cfg = cfg
+        self._vars = cfg.get_vars()
 
         da = DomAnalyzer()
         self._dom_results = da.analyze(self._cfg)
@@ -137,8 +143,30 @@ class SsaBuilder:
     def _rename(self):
         """
         Renames variables so that each definition is unique.
+
+        The dominator tree is walked in preorder with an explicit stack, so deep
+        trees don't hit the recursion limit. The names a block defined are
+        popped once all the blocks it dominates are renamed.
         """
-        self._rename_block(self._cfg.get_root())
+        self._pred_indices = {}
+        for blk in self._cfg.get_blocks():
+            indices: Dict[BasicBlockId, int] = {}
+            for i, prev in enumerate(blk.get_prev()):
+                if prev.get_id() not in indices:
+                    indices[prev.get_id()] = i
+            self._pred_indices[blk.get_id()] = indices
+
+        work = [(self._cfg.get_root(), False)]
+        while len(work) != 0:
+            blk, renamed = work.pop()
+            if renamed:
+                self._pop_names(blk)
+                continue
+
+            self._rename_block(blk)
+            work.append((blk, True))
+            for child in reversed(self._dom_results.get_children(blk.get_id())):
+                work.append((self._cfg.find_block(child), False))
 
     def _rename_block(self, blk: BasicBlock):
         insts = blk.get_instructions()
@@ -155,7 +183,7 @@ class SsaBuilder:
                         var = opr.get_id()
                         stk = self._stacks[var]
                         assert len(stk) != 0, "variable used before being defined"
-                        opr.set_id(make_var_id(var, stk[-1]))
+                        opr.set_id(self._vars.make_var(var, stk[-1]))
 
                 if inst.op.has_extra_operands():
                     for opr in inst.extra:
@@ -163,7 +191,7 @@ class SsaBuilder:
                             var = opr.get_id()
                             stk = self._stacks[var]
                             assert len(stk) != 0, "variable used before being defined"
-                            opr.set_id(make_var_id(var, stk[-1]))
+                            opr.set_id(self._vars.make_var(var, stk[-1]))
 
                 # rename name being assigned
                 if inst.op.is_opcode_assign() and isinstance(inst.oprs[0], IrVar):
@@ -171,35 +199,26 @@ class SsaBuilder:
 
         # fill phi-function parameters
         for next in blk.get_next():
-            idx = 0
-
-            for i in range(len(next.get_prev())):
-                if next.get_prev()[i].get_id() == blk.get_id():
-                    idx = i
-                    break
+            idx = self._pred_indices[next.get_id()].get(blk.get_id(), 0)
 
             for inst in next.get_instructions():
                 if inst.op != IrOpcode.ASSIGN_PHI:
                     break
 
                 var = inst.extra[idx].get_id()
-                stk = self._stacks[var_base(var)]
+                base = self._vars.get_base(var)
+                stk = self._stacks[base]
                 assert len(stk) != 0, "bad"
-                inst.extra[idx].set_id(make_var_id(var_base(var), stk[-1]))
+                inst.extra[idx].set_id(self._vars.make_var(base, stk[-1]))
 
-        # recurse
-        for b in self._cfg.get_blocks():
-            if b.get_id() == blk.get_id() or b.get_id() == self._cfg.get_root().get_id():
-                continue
-
-            idom = self._dom_results.get_idom(b.get_id())
-            if blk.get_id() == idom:
-                self._rename_block(b)
-
-        for inst in insts:
+    def _pop_names(self, blk: BasicBlock):
+        """
+        Pops the names defined in the block off the stacks.
+        """
+        for inst in blk.get_instructions():
             if inst.op.is_opcode_assign() and isinstance(inst.oprs[0], IrVar):
                 var = inst.oprs[0].get_id()
-                stk = self._stacks[var_base(var)]
+                stk = self._stacks[self._vars.get_base(var)]
                 if len(stk) != 0:
                     stk.pop()
 
@@ -214,7 +233,7 @@ class SsaBuilder:
         i = self._counters[base]
         self._stacks[base].append(i)
 
-        return make_var_id(base, i)
+        return self._vars.make_var(base, i)
 
     def _enum_vars(self) -> Set[IrVarId]:
         """
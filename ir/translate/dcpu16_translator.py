@@ -57,7 +57,7 @@ class Dcpu16Translator:
             self._append(f'.global {self._proc.get_name()}')
 
         # build control flow graph
-        self._cfg = make_cfg(proc.get_body())
+        self._cfg = make_cfg(proc.get_body(), proc.get_vars())
 
         # transform into SSA form
         ssab = SsaBuilder()
@@ -272,6 +272,14 @@ class Dcpu16Translator:
                     self._append(f'\tIFL {self._translate_operand(inst.oprs[1], True)}, {self._translate_operand(inst.oprs[2], True)}')
                     self._append(f'\t\tSET PC, {dest}')
 
+                elif inst.op == IrOpcode.JMP_TABLE:
+                    # The table of block addresses follows the jump, only a register can index it
+                    assert isinstance(dest, str) and dest in self._register_mapping, f"Jump table index {dest} is not in a register"
+                    self._append(f'\tSET PC, [{dest} + _tbl{blk.get_id()}]')
+                    self._append(f'_tbl{blk.get_id()}:')
+                    for target in inst.extra:
+                        self._append(f'\t.dw {self._translate_operand(target, False)}')
+
                 elif inst.op == IrOpcode.CALL or inst.op == IrOpcode.CALL_PTR:
 
                     # save registers that we need to
@@ -354,12 +362,13 @@ class Dcpu16Translator:
                     else:
                         opr = inst.oprs[1]
                         if isinstance(opr, IrVar):
-                            if var_base(opr.get_id()) in self._proc.get_params():
+                            base = self._proc.get_vars().get_base(opr.get_id())
+                            if base in self._proc.get_params():
                                 if self._need_prologue:
                                     self._append(f'\tSET {dest}, J')
                                 else:
                                     self._append(f'\tSET {dest}, SP')
-                                self._append(f'\tADD {dest}, {self._proc.get_params().index(var_base(opr.get_id())) + 2}')
+                                self._append(f'\tADD {dest}, {self._proc.get_params().index(base) + 2}')
                             else:
                                 assert False, "Tried to addrof a variable which is not on the stack"
                         elif isinstance(opr, IrName):
@@ -450,8 +459,9 @@ class Dcpu16Translator:
         elif isinstance(opr, IrBlockRef):
             return f'_blk{opr.get_id()}'
         elif isinstance(opr, IrVar):
-            if var_base(opr.get_id()) in self._proc.get_params():
-                index = self._proc.get_params().index(var_base(opr.get_id()))
+            base = self._proc.get_vars().get_base(opr.get_id())
+            if base in self._proc.get_params():
+                index = self._proc.get_params().index(base)
                 if index in self._copied_params:
                     return self._copied_params[index]
                 else:
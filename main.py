@@ -30,6 +30,7 @@ def main():
     parser.add_argument('-c', dest='assemble_only', action='store_const', const=True, default=False, help="Compile and assemble, but do not link.")
     parser.add_argument('-D', dest='defines', metavar='macro[=val]', nargs=1, action='append', help='Predefine name as a macro [with value]')
     parser.add_argument('-I', dest='includes', metavar='path', nargs=1, action='append', help="Path to search for unfound #include's")
+    parser.add_argument('-finline-limit', dest='inline_limit', metavar='n', type=int, default=Optimizer.INLINE_LIMIT, help="Inline functions of up to <n> nodes, 0 disables inlining")
 
     parser.add_argument('--dump-ir', dest='dump_ir', action='store_const', const=True, default=False, help="Dump the IR into a file")
     parser.add_argument('--dump-ast', dest='dump_ast', action='store_const', const=True, default=False, help="Dump the AST into a file")
@@ -92,7 +93,7 @@ def main():
         assert not parser.got_errors
 
         # Optimize the AST
-        opt = Optimizer(parser)
+        opt = Optimizer(parser, args.inline_limit)
         opt.optimize()
 
         if args.dump_ast:
@@ -131,7 +132,9 @@ def main():
 
         # Add global vars definitions
         for var in parser.global_vars:
-            if var.storage == StorageClass.EXTERN:
+            if not var.used:
+                continue
+            elif var.storage == StorageClass.EXTERN:
                 asm += f'\n.extern {var.ident.name}\n'
             else:
                 if var.storage != StorageClass.STATIC:
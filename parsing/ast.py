@@ -7,6 +7,8 @@ from .types import *
 
 class Identifier:
 
+    __slots__ = ('name', 'index')
+
     def __init__(self, name, index):
         self.name = name
         self.index = index
@@ -14,24 +16,32 @@ class Identifier:
 
 class FunctionIdentifier(Identifier):
 
+    __slots__ = ()
+
     def __init__(self, name, index):
         super(FunctionIdentifier, self).__init__(name, index)
 
 
 class ParameterIdentifier(Identifier):
 
+    __slots__ = ()
+
     def __init__(self, name, index):
         super(ParameterIdentifier, self).__init__(name, index)
 
 
 class VariableIdentifier(Identifier):
 
+    __slots__ = ()
+
     def __init__(self, name, index):
         super(VariableIdentifier, self).__init__(name, index)
 
 
 class GlobalIdentifier(Identifier):
 
+    __slots__ = ()
+
     def __init__(self, name, index):
         super(GlobalIdentifier, self).__init__(name, index)
 
@@ -42,13 +52,55 @@ class GlobalIdentifier(Identifier):
 
 class Expr:
 
+    # The cached slots hold the results of resolve_type, is_pure and is_constant, computed
+    # on first use and kept on the node until invalidate() is called
+    __slots__ = ('pos', '_type', '_constant', '_pure', '_pure_epoch')
+
+    # Function purity can change while optimizing, bumping this makes every cached is_pure stale
+    purity_epoch = 0
+
+    def __init__(self, pos=None):
+        self.pos = pos
+        self._type = None
+        self._constant = None
+        self._pure = None
+        self._pure_epoch = -1
+
     def is_pure(self, parser):
-        raise NotImplementedError()
+        if self._pure_epoch != Expr.purity_epoch:
+            self._pure = self._is_pure(parser)
+            self._pure_epoch = Expr.purity_epoch
+        return self._pure
 
     def is_constant(self, parser):
-        raise NotImplementedError()
+        if self._constant is None:
+            self._constant = self._is_constant(parser)
+        return self._constant
 
     def resolve_type(self, ast) -> CType:
+        if self._type is None:
+            self._type = self._resolve_type(ast)
+        return self._type
+
+    def invalidate(self):
+        """
+        Drop the cached attributes, must be called after changing the children of the node
+        """
+        self._type = None
+        self._constant = None
+        self._pure_epoch = -1
+
+    @staticmethod
+    def invalidate_purity():
+        Expr.purity_epoch += 1
+
+    def _is_pure(self, parser):
+        raise NotImplementedError()
+
+    def _is_constant(self, parser):
+        raise NotImplementedError()
+
+    def _resolve_type(self, ast) -> CType:
         raise NotImplementedError()
 
     def __ne__(self, other):
@@ -57,13 +109,15 @@ class Expr:
 
 class ExprNop(Expr):
 
+    __slots__ = ()
+
     def __init__(self):
-        self.pos = None
+        super(ExprNop, self).__init__()
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return True
 
     def __str__(self, ident=''):
@@ -75,17 +129,19 @@ class ExprNop(Expr):
 
 class ExprString(Expr):
 
+    __slots__ = ('value',)
+
     def __init__(self, value: str, pos=None):
-        self.pos = pos
+        super(ExprString, self).__init__(pos)
         self.value = value
 
-    def resolve_type(self, ast) -> CType:
+    def _resolve_type(self, ast) -> CType:
         return CArray(CInteger(16, True), len(self.value))
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return True
 
     def __str__(self, ident=''):
@@ -99,18 +155,20 @@ class ExprString(Expr):
 
 class ExprNumber(Expr):
 
+    __slots__ = ('value', 'typ')
+
     def __init__(self, value: int, typ: CInteger=CInteger(16, True), pos=None):
-        self.pos = pos
+        super(ExprNumber, self).__init__(pos)
         self.value = value
         self.typ = typ
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         return self.typ
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return True
 
     def __str__(self, ident=''):
@@ -124,11 +182,13 @@ class ExprNumber(Expr):
 
 class ExprIdent(Expr):
 
+    __slots__ = ('ident',)
+
     def __init__(self, ident: Identifier, pos=None):
-        self.pos = pos
+        super(ExprIdent, self).__init__(pos)
         self.ident = ident
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         if isinstance(self.ident, VariableIdentifier):
             return ast.func.vars[self.ident.index].typ
         elif isinstance(self.ident, FunctionIdentifier):
@@ -140,10 +200,10 @@ class ExprIdent(Expr):
         else:
             assert False
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         if isinstance(self.ident, VariableIdentifier):
             return False
         elif isinstance(self.ident, FunctionIdentifier):
@@ -166,14 +226,16 @@ class ExprIdent(Expr):
 
 class ExprBinary(Expr):
 
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left: Expr, op: str, right: Expr, pos=None):
-        self.pos = pos
+        super(ExprBinary, self).__init__(pos)
 
         self.left = left
         self.op = op
         self.right = right
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         ltyp = self.left.resolve_type(ast)
         rtyp = self.right.resolve_type(ast)
 
@@ -184,7 +246,7 @@ class ExprBinary(Expr):
                 return rtyp
             else:
                 return ltyp
-        elif self.op in ['==', '||', '&&', '<=', '>=', '<', '>', '!']:
+        elif self.op in ['==', '!=', '||', '&&', '<=', '>=', '<', '>', '!']:
             # Logical operations always return an int
             # TODO: Make it return a boolean instead
             return CInteger(16, False)
@@ -197,10 +259,10 @@ class ExprBinary(Expr):
         else:
             assert False, self.op
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return self.left.is_pure(parser) and self.right.is_pure(parser)
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return self.left.is_constant(parser) and self.right.is_constant(parser)
 
     def __str__(self, ident=''):
@@ -209,18 +271,20 @@ class ExprBinary(Expr):
 
 class ExprCast(Expr):
 
+    __slots__ = ('expr', 'typ')
+
     def __init__(self, expr: Expr, typ: CType, pos=None):
-        self.pos = pos
+        super(ExprCast, self).__init__(pos)
         self.expr = expr
         self.typ = typ
 
-    def resolve_type(self, ast) -> CType:
+    def _resolve_type(self, ast) -> CType:
         return self.typ
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return self.expr.is_pure(parser)
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return self.expr.is_constant(parser)
 
     def __str__(self):
@@ -229,30 +293,100 @@ class ExprCast(Expr):
 
 class ExprLoop(Expr):
 
+    __slots__ = ('cond', 'body')
+
     def __init__(self, cond: Expr, body: Expr, pos=None):
-        self.pos = pos
+        super(ExprLoop, self).__init__(pos)
         self.cond = cond
         self.body = body
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
         return ident + f'(loop {self.cond} {self.body})'
 
 
+class ExprIf(Expr):
+
+    __slots__ = ('cond', 'then', 'otherwise')
+
+    def __init__(self, cond: Expr, then: Expr, otherwise: Expr = None, pos=None):
+        super(ExprIf, self).__init__(pos)
+        self.cond = cond
+        self.then = then
+        self.otherwise = otherwise if otherwise is not None else ExprNop()
+
+    def _is_pure(self, parser):
+        return self.cond.is_pure(parser) and self.then.is_pure(parser) and self.otherwise.is_pure(parser)
+
+    def _is_constant(self, parser):
+        return False
+
+    def __str__(self, ident=''):
+        if isinstance(self.otherwise, ExprNop):
+            return ident + f'(if {self.cond} {self.then})'
+        return ident + f'(if {self.cond} {self.then} {self.otherwise})'
+
+
+class ExprSwitch(Expr):
+
+    __slots__ = ('expr', 'body')
+
+    def __init__(self, expr: Expr, body: Expr, pos=None):
+        super(ExprSwitch, self).__init__(pos)
+        self.expr = expr
+        self.body = body
+
+    def _is_pure(self, parser):
+        return False
+
+    def _is_constant(self, parser):
+        return False
+
+    def __str__(self, ident=''):
+        return ident + f'(switch {self.expr} {self.body})'
+
+
+class ExprCase(Expr):
+    """
+    A case label in the body of a switch, the value is already converted to the type of the switch
+    and is None for the default label. The labels are always statements of the body itself and
+    never nested inside other statements.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: int = None, pos=None):
+        super(ExprCase, self).__init__(pos)
+        self.value = value
+
+    def _is_pure(self, parser):
+        return False
+
+    def _is_constant(self, parser):
+        return False
+
+    def __str__(self, ident=''):
+        if self.value is None:
+            return ident + '(default)'
+        return ident + f'(case {self.value})'
+
+
 class ExprBreak(Expr):
 
+    __slots__ = ()
+
     def __init__(self, pos=None):
-        self.pos = pos
+        super(ExprBreak, self).__init__(pos)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
@@ -261,13 +395,15 @@ class ExprBreak(Expr):
 
 class ExprContinue(Expr):
 
+    __slots__ = ()
+
     def __init__(self, pos=None):
-        self.pos = pos
+        super(ExprContinue, self).__init__(pos)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
@@ -276,11 +412,13 @@ class ExprContinue(Expr):
 
 class ExprAddrof(Expr):
 
+    __slots__ = ('expr',)
+
     def __init__(self, expr: ExprIdent, pos=None):
-        self.pos = pos
+        super(ExprAddrof, self).__init__(pos)
         self.expr = expr
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         typ = self.expr.resolve_type(ast)
         if isinstance(typ, CFunction):
             return typ
@@ -289,10 +427,10 @@ class ExprAddrof(Expr):
         else:
             return CPointer(typ)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return True
 
     def __str__(self, ident=''):
@@ -301,11 +439,13 @@ class ExprAddrof(Expr):
 
 class ExprDeref(Expr):
 
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr, pos=None):
-        self.pos = pos
+        super(ExprDeref, self).__init__(pos)
         self.expr = expr
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         t = self.expr.resolve_type(ast)
         # *func == func
         if isinstance(t, CFunction):
@@ -314,11 +454,11 @@ class ExprDeref(Expr):
             assert isinstance(t, CPointer) or isinstance(t, CArray)
             return t.type
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         # return True
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
@@ -332,23 +472,25 @@ class ExprDeref(Expr):
 
 class ExprCall(Expr):
 
+    __slots__ = ('func', 'args')
+
     def __init__(self, func: Expr, args: List[Expr], pos=None):
-        self.pos = pos
+        super(ExprCall, self).__init__(pos)
         self.func = func
         self.args = args
 
-    def resolve_type(self, ast):
+    def _resolve_type(self, ast):
         func = self.func.resolve_type(ast)
         assert isinstance(func, CFunction), f'{type(func)}'
         return func.ret_type
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         if isinstance(self.func, ExprIdent) and isinstance(self.func.ident, FunctionIdentifier):
             called_function = parser.func_list[self.func.ident.index]
             return called_function.pure_known and called_function.pure and len([x for x in self.args if x.is_pure(parser)]) == 0
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
@@ -362,18 +504,20 @@ class ExprCall(Expr):
 
 class ExprCopy(Expr):
 
+    __slots__ = ('source', 'destination')
+
     def __init__(self, source: Expr, destination: Expr, pos=None):
-        self.pos = pos
+        super(ExprCopy, self).__init__(pos)
         self.source = source
         self.destination = destination
 
-    def resolve_type(self, ast) -> CType:
+    def _resolve_type(self, ast) -> CType:
         return self.destination.resolve_type(ast)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
@@ -382,8 +526,10 @@ class ExprCopy(Expr):
 
 class ExprComma(Expr):
 
+    __slots__ = ('exprs',)
+
     def __init__(self, pos=None):
-        self.pos = pos
+        super(ExprComma, self).__init__(pos)
         self.exprs = []  # type: List[Expr]
 
     def add(self, expr):
@@ -398,6 +544,8 @@ class ExprComma(Expr):
         else:
             self.exprs.append(expr)
 
+        self.invalidate()
+
         # Expand the position
         if self.pos is not None and expr.pos is not None:
             self.pos.end_line = expr.pos.end_line
@@ -405,16 +553,16 @@ class ExprComma(Expr):
 
         return self
 
-    def resolve_type(self, ast) -> CType:
+    def _resolve_type(self, ast) -> CType:
         return self.exprs[-1].resolve_type(ast)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         for expr in self.exprs:
             if not expr.is_pure(parser):
                 return False
         return True
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         for expr in self.exprs:
             if not expr.is_constant(parser):
                 return False
@@ -432,23 +580,110 @@ class ExprComma(Expr):
 
 class ExprReturn(Expr):
 
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr, pos=None):
-        self.pos = pos
+        super(ExprReturn, self).__init__(pos)
         self.expr = expr
 
-    def resolve_type(self, ast) -> CType:
+    def _resolve_type(self, ast) -> CType:
         return self.expr.resolve_type(ast)
 
-    def is_pure(self, parser):
+    def _is_pure(self, parser):
         return False
 
-    def is_constant(self, parser):
+    def _is_constant(self, parser):
         return False
 
     def __str__(self, ident=''):
         return ident + f'(return {self.expr})'
 
 
+class ExprTable:
+    """
+    Hash-consing for the expressions that only read (numbers, identifiers, arithmetic, derefs, addrof
+    and casts). Interning an expression makes every structurally equal subtree that went through
+    the same table the same object, so they can be compared with `is` and repeats can be found by
+    identity. The key of a node uses the identity of its children, which are interned first.
+
+    Interning never changes the expression it is given, when a child is replaced with its shared
+    equal node the parent is copied. Shared nodes must not be changed since that would change
+    every place that uses them.
+    """
+
+    def __init__(self):
+        self._exprs = {}  # type: Dict[tuple, Expr]
+
+        # The ids of the interned nodes, they are kept alive by the table
+        self._interned = set()  # type: Set[int]
+
+        # How many times an operation (anything but a number, string or identifier) was interned
+        # while an equal one already was
+        self.shared = 0
+
+    def clear(self):
+        self._exprs.clear()
+        self._interned.clear()
+        self.shared = 0
+
+    def intern(self, expr: Expr) -> Expr:
+        """
+        Returns the shared node for the expression, expressions that write or call are returned as
+        they are (and so is anything containing them)
+        """
+        interned = self._interned
+        if id(expr) in interned:
+            return expr
+
+        cls = expr.__class__
+        if cls is ExprNumber:
+            key = (ExprNumber, expr.value, expr.typ)
+
+        elif cls is ExprIdent:
+            key = (ExprIdent, expr.ident)
+
+        elif cls is ExprString:
+            key = (ExprString, expr.value)
+
+        else:
+            if cls is ExprBinary:
+                left = self.intern(expr.left)
+                right = self.intern(expr.right)
+                if id(left) not in interned or id(right) not in interned:
+                    return expr
+                key = (ExprBinary, expr.op, id(left), id(right))
+
+            elif cls is ExprDeref or cls is ExprAddrof or cls is ExprCast:
+                inner = self.intern(expr.expr)
+                if id(inner) not in interned:
+                    return expr
+                key = (cls, id(inner), expr.typ if cls is ExprCast else None)
+
+            else:
+                return expr
+
+            existing = self._exprs.get(key)
+            if existing is not None:
+                self.shared += 1
+                return existing
+
+            # Point the new shared node at the shared children without touching the original
+            if cls is ExprBinary:
+                if left is not expr.left or right is not expr.right:
+                    expr = ExprBinary(left, expr.op, right, expr.pos)
+            elif inner is not expr.expr:
+                if cls is ExprCast:
+                    expr = ExprCast(inner, expr.typ, expr.pos)
+                else:
+                    expr = cls(inner, expr.pos)
+
+        existing = self._exprs.get(key)
+        if existing is None:
+            self._exprs[key] = existing = expr
+            interned.add(id(expr))
+        return existing
+
+
 ########################################################################################################################
 # Function
 ########################################################################################################################
@@ -456,15 +691,23 @@ class ExprReturn(Expr):
 
 class Variable:
 
+    __slots__ = ('ident', 'typ', 'storage', 'value', 'used')
+
     def __init__(self, ident: Identifier, typ: CType, storage: StorageClass):
         self.ident = ident
         self.typ = typ
         self.storage = storage
         self.value = None
 
+        # Cleared by the optimizer for statics that are never used, those are not emitted
+        self.used = True
+
 
 class Function:
 
+    __slots__ = ('name', 'code', 'num_params', 'vars', 'storage_decl', 'inline', 'prototype', 'type', 'pure', 'pure_known',
+                 'used')
+
     def __init__(self, name: str):
         self.name = name
         self.code = None
@@ -472,11 +715,15 @@ class Function:
         self.vars = []  # type: List[Variable]
 
         self.storage_decl = StorageClass.AUTO
+        self.inline = False
         self.prototype = False
         self.type = CFunction()
 
         self.pure = False
         self.pure_known = False
 
+        # Cleared by the optimizer for static functions that are never used, those are not translated
+        self.used = True
+
     def __str__(self):
         return f'(func {self.name}\n {self.code.__str__(" ")})'
@@ -0,0 +1,339 @@
+from .visitor import visitor
+from .ast import *
+
+
+class CallGraph:
+    """
+    The direct calls between the functions of the program, functions are referred to by their
+    index in the parser's function list (same as FunctionIdentifier.index). The globals used by
+    every function are tracked as well, by their index in the global list.
+
+    Every function body is scanned once, after a pass changed the code of a function call
+    update() on it to rescan only that function. The strongly connected components (functions
+    that are mutually recursive) are computed when first needed after a change.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+
+        # The callees map to the number of places they are called from
+        self._callees = []  # type: List[Dict[int, int]]
+        self._callers = []  # type: List[Set[int]]
+
+        # Functions whose address is taken instead of being called
+        self._references = []  # type: List[Set[int]]
+        self._referrers = []  # type: List[Set[int]]
+        self._global_references = set()  # type: Set[int]
+
+        # Globals used by every function
+        self._uses = []  # type: List[Set[int]]
+
+        # Functions and globals used by the initializer of every global
+        self._initializer_references = []  # type: List[Set[int]]
+        self._initializer_uses = []  # type: List[Set[int]]
+
+        # Side effects of the function itself, not counting the functions it calls
+        self._side_effects = []  # type: List[bool]
+
+        # The components, callees always come before their callers
+        self._components = None  # type: List[List[int]]
+        self._component_of = None  # type: List[int]
+
+        # Scanning state
+        self._scan_calls = None  # type: Dict[int, int]
+        self._scan_references = None  # type: Set[int]
+        self._scan_uses = None  # type: Set[int]
+        self._scan_side_effects = False
+
+        for i in range(len(parser.func_list)):
+            self._callees.append({})
+            self._callers.append(set())
+            self._references.append(set())
+            self._referrers.append(set())
+            self._uses.append(set())
+            self._side_effects.append(False)
+
+        for i in range(len(parser.func_list)):
+            self.update(i)
+
+        # Initializers of globals can only take the address of functions
+        for var in parser.global_vars:
+            self._scan_calls = {}
+            self._scan_references = set()
+            self._scan_uses = set()
+            if isinstance(var.value, Expr):
+                self._scan(var.value)
+            self._initializer_references.append(self._scan_references)
+            self._initializer_uses.append(self._scan_uses)
+            self._global_references.update(self._scan_references)
+
+    def update(self, index: int):
+        """
+        Rescan the body of a function
+        """
+        for callee in self._callees[index]:
+            self._callers[callee].discard(index)
+        for referenced in self._references[index]:
+            self._referrers[referenced].discard(index)
+
+        self._scan_calls = {}
+        self._scan_references = set()
+        self._scan_uses = set()
+        self._scan_side_effects = False
+        code = self.parser.func_list[index].code
+        if code is not None:
+            self._scan(code)
+
+        self._callees[index] = self._scan_calls
+        self._references[index] = self._scan_references
+        self._uses[index] = self._scan_uses
+        self._side_effects[index] = self._scan_side_effects
+        for callee in self._scan_calls:
+            self._callers[callee].add(index)
+        for referenced in self._scan_references:
+            self._referrers[referenced].add(index)
+
+        self._components = None
+        self._component_of = None
+
+    def callees(self, index: int) -> Dict[int, int]:
+        return self._callees[index]
+
+    def callers(self, index: int) -> Set[int]:
+        return self._callers[index]
+
+    def has_side_effects(self, index: int) -> bool:
+        """
+        Does the function itself have side effects, not counting the functions it calls
+        """
+        return self._side_effects[index]
+
+    def call_sites(self, index: int) -> int:
+        """
+        The number of places the function is called from
+        """
+        return sum(self._callees[caller][index] for caller in self._callers[index])
+
+    def is_address_taken(self, index: int) -> bool:
+        """
+        Can the function be called through a pointer
+        """
+        return len(self._referrers[index]) != 0 or index in self._global_references
+
+    def components(self) -> List[List[int]]:
+        """
+        The strongly connected components, callees come before their callers
+        """
+        if self._components is None:
+            self._find_components()
+        return self._components
+
+    def component_of(self, index: int) -> int:
+        if self._component_of is None:
+            self._find_components()
+        return self._component_of[index]
+
+    def is_recursive(self, index: int) -> bool:
+        """
+        Can the function end up calling itself
+        """
+        return index in self._callees[index] or len(self.components()[self.component_of(index)]) > 1
+
+    def find_pure_functions(self):
+        """
+        Set the purity of all the functions, a function is pure if it has no side effects of its own
+        and all the functions it calls are pure. Components are settled as a whole, callees first.
+        """
+        func_list = self.parser.func_list
+        components = self.components()
+        component_of = self._component_of
+
+        for i, component in enumerate(components):
+            pure = True
+            for f in component:
+                if self._side_effects[f]:
+                    pure = False
+                    break
+
+                for callee in self._callees[f]:
+                    if component_of[callee] != i and not func_list[callee].pure:
+                        pure = False
+                        break
+
+                if not pure:
+                    break
+
+            for f in component:
+                func_list[f].pure_known = True
+                func_list[f].pure = pure
+
+    def find_used(self):
+        """
+        Set which functions and globals are used, anything that is not static can be used from other
+        files, from there everything they call or reference is used as well. Static locals are used
+        as long as their function is.
+        """
+        func_list = self.parser.func_list
+        global_vars = self.parser.global_vars
+
+        for f in func_list:
+            f.used = False
+        for var in global_vars:
+            var.used = False
+
+        funcs = [i for i, f in enumerate(func_list) if f.storage_decl != StorageClass.STATIC]
+        uses = [i for i, var in enumerate(global_vars) if var.storage != StorageClass.STATIC]
+
+        while len(funcs) != 0 or len(uses) != 0:
+            if len(funcs) != 0:
+                i = funcs.pop()
+                func = func_list[i]
+                if func.used:
+                    continue
+                func.used = True
+
+                for var in func.vars:
+                    if var.storage == StorageClass.STATIC:
+                        var.used = True
+
+                funcs.extend(self._callees[i])
+                funcs.extend(self._references[i])
+                uses.extend(self._uses[i])
+
+            else:
+                i = uses.pop()
+                var = global_vars[i]
+                if var.used:
+                    continue
+                var.used = True
+
+                funcs.extend(self._initializer_references[i])
+                uses.extend(self._initializer_uses[i])
+
+    def _find_components(self):
+        # Tarjan's algorithm, done with an explicit stack so long call chains don't hit the
+        # recursion limit
+        count = len(self._callees)
+        order = [-1] * count
+        low = [0] * count
+        on_stack = [False] * count
+        stack = []
+        components = []
+        component_of = [-1] * count
+        counter = 0
+
+        for root in range(count):
+            if order[root] != -1:
+                continue
+
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(self._callees[root]))]
+
+            while len(work) != 0:
+                node, callees = work[-1]
+
+                descended = False
+                for callee in callees:
+                    if order[callee] == -1:
+                        order[callee] = low[callee] = counter
+                        counter += 1
+                        stack.append(callee)
+                        on_stack[callee] = True
+                        work.append((callee, iter(self._callees[callee])))
+                        descended = True
+                        break
+
+                    elif on_stack[callee]:
+                        low[node] = min(low[node], order[callee])
+
+                if descended:
+                    continue
+
+                work.pop()
+                if len(work) != 0:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+                # This is the root of a component
+                if low[node] == order[node]:
+                    component = []
+                    while True:
+                        f = stack.pop()
+                        on_stack[f] = False
+                        component_of[f] = len(components)
+                        component.append(f)
+                        if f == node:
+                            break
+                    components.append(component)
+
+        self._components = components
+        self._component_of = component_of
+
+    @visitor
+    def _scan(self, expr, lvalue=False):
+        pass
+
+    @_scan.register(ExprComma)
+    def _scan_comma(self, expr, lvalue=False):
+        for e in expr.exprs:
+            self._scan(e)
+
+    @_scan.register(ExprCopy)
+    def _scan_copy(self, expr, lvalue=False):
+        self._scan(expr.destination, True)
+        self._scan(expr.source)
+
+    @_scan.register(ExprBinary)
+    def _scan_binary(self, expr, lvalue=False):
+        self._scan(expr.left)
+        self._scan(expr.right)
+
+    @_scan.register(ExprLoop)
+    def _scan_loop(self, expr, lvalue=False):
+        self._scan(expr.cond)
+        self._scan(expr.body)
+
+    @_scan.register(ExprIf)
+    def _scan_if(self, expr, lvalue=False):
+        self._scan(expr.cond)
+        self._scan(expr.then)
+        self._scan(expr.otherwise)
+
+    @_scan.register(ExprSwitch)
+    def _scan_switch(self, expr, lvalue=False):
+        self._scan(expr.expr)
+        self._scan(expr.body)
+
+    @_scan.register(ExprIdent)
+    def _scan_ident(self, expr, lvalue=False):
+        if isinstance(expr.ident, FunctionIdentifier):
+            self._scan_references.add(expr.ident.index)
+        elif isinstance(expr.ident, GlobalIdentifier):
+            self._scan_uses.add(expr.ident.index)
+
+    @_scan.register(ExprAddrof, ExprReturn, ExprCast)
+    def _scan_unary(self, expr, lvalue=False):
+        self._scan(expr.expr)
+
+    @_scan.register(ExprDeref)
+    def _scan_deref(self, expr, lvalue=False):
+        # if this is an lvalue and we have a deref we assume side effects
+        if lvalue:
+            self._scan_side_effects = True
+        self._scan(expr.expr)
+
+    @_scan.register(ExprCall)
+    def _scan_call(self, expr, lvalue=False):
+        for arg in expr.args:
+            self._scan(arg)
+
+        # assume indirect function calls have side effects
+        if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, FunctionIdentifier):
+            index = expr.func.ident.index
+            self._scan_calls[index] = self._scan_calls.get(index, 0) + 1
+        else:
+            self._scan(expr.func)
+            self._scan_side_effects = True
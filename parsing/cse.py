@@ -0,0 +1,275 @@
+from .visitor import visitor
+from .ast import *
+
+
+# The operators that can be computed into a temporary, the rest only work as conditions
+_VALUE_OPS = {'+', '-', '*', '/', '%', '&', '|', '^'}
+
+
+class CommonSubexpressions:
+    """
+    Computes an expression that is repeated inside a statement only once, into a temporary that is
+    assigned right before the statement.
+
+    The operands of a statement are interned first, so a repeat is simply the same node showing up
+    twice (see ExprTable).
+    Only statements that don't write anything until their very end (an assignment, a return, the
+    condition of an if or the arguments of a call) are looked at, so moving the computation in
+    front of the statement never reads a different value.
+    Only repeats that the statement always computes are moved, the right side of a `&&` or `||`
+    may be guarded by the left one (`p && *p`, `d && 100 / d`) so it is never counted.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._exprs = ExprTable()
+
+        # Counting state, node id to how many times it was seen and when it was first finished
+        self._counts = {}  # type: Dict[int, int]
+        self._finished = {}  # type: Dict[int, int]
+        self._repeats = []  # type: List[Expr]
+        self._writes = False
+
+        # How many `&&`/`||` right sides the counting is in, and the nodes already checked in them
+        self._guarded = 0
+        self._guarded_seen = set()  # type: Set[int]
+
+        # Node id to the temporary holding it
+        self._temps = {}  # type: Dict[int, ExprIdent]
+
+    def eliminate(self, func: Function) -> bool:
+        """
+        Returns if anything was changed
+        """
+        self.parser.func = func
+        code = self._statement(func.code)
+        self.parser.func = None
+
+        if code is func.code:
+            return False
+        func.code = code
+        return True
+
+    def _hoist(self, exprs: List[Expr]):
+        """
+        Find the repeats in the operands of a statement, returns the assignments to the temporaries
+        and the operands using them, or None if there is nothing to do
+        """
+        self._counts = {}
+        self._finished = {}
+        self._repeats = []
+        self._writes = False
+        self._guarded_seen = set()
+
+        # Interning finds if anything is repeated at all, which is rare, and only then are the
+        # repeats counted
+        self._exprs.clear()
+        exprs = [self._exprs.intern(expr) for expr in exprs]
+        if self._exprs.shared == 0:
+            return None
+
+        for expr in exprs:
+            self._count(expr)
+
+        if self._writes:
+            return None
+
+        # Only a single word can be kept in a temporary
+        repeats = [expr for expr in self._repeats if isinstance(expr.resolve_type(self.parser), (CInteger, CPointer))]
+        if len(repeats) == 0:
+            return None
+
+        # Inner repeats are computed first so the outer ones can use them
+        repeats.sort(key=lambda e: self._finished[id(e)])
+
+        self._temps = {}
+        hoisted = []
+        for expr in repeats:
+            typ = expr.resolve_type(self.parser)
+            value = self._replace_children(expr)
+            temp = self.parser._temp(typ)
+            hoisted.append(ExprCopy(value, temp, expr.pos))
+            self._temps[id(expr)] = temp
+
+        exprs = [self._replace(expr) for expr in exprs]
+        self._temps = {}
+        return hoisted, exprs
+
+    ####################################################################################################################
+    # Statements
+    ####################################################################################################################
+
+    @visitor
+    def _statement(self, expr):
+        return expr
+
+    @_statement.register(ExprComma)
+    def _statement_comma(self, expr):
+        exprs = [self._statement(e) for e in expr.exprs]
+        if all(a is b for a, b in zip(exprs, expr.exprs)):
+            return expr
+
+        # Merge the statements that got temporaries in front of them
+        comma = ExprComma()
+        for e in exprs:
+            comma.add(e)
+        return comma
+
+    @_statement.register(ExprLoop)
+    def _statement_loop(self, expr):
+        # The condition runs on every iteration, there is nowhere to put its temporaries
+        expr.body = self._statement(expr.body)
+        return expr
+
+    @_statement.register(ExprIf)
+    def _statement_if(self, expr):
+        expr.then = self._statement(expr.then)
+        expr.otherwise = self._statement(expr.otherwise)
+
+        result = self._hoist([expr.cond])
+        if result is None:
+            return expr
+
+        hoisted, (expr.cond,) = result
+        return ExprComma().add(hoisted).add(expr)
+
+    @_statement.register(ExprSwitch)
+    def _statement_switch(self, expr):
+        expr.body = self._statement(expr.body)
+
+        result = self._hoist([expr.expr])
+        if result is None:
+            return expr
+
+        hoisted, (expr.expr,) = result
+        return ExprComma().add(hoisted).add(expr)
+
+    @_statement.register(ExprCopy)
+    def _statement_copy(self, expr):
+        # The address written to is calculated as part of the statement, the write itself is last
+        operands = [expr.source]
+        if isinstance(expr.destination, ExprDeref):
+            operands.append(expr.destination.expr)
+
+        result = self._hoist(operands)
+        if result is None:
+            return expr
+
+        hoisted, operands = result
+        if isinstance(expr.destination, ExprDeref):
+            destination = ExprDeref(operands[1], expr.destination.pos)
+        else:
+            destination = expr.destination
+        return ExprComma().add(hoisted).add(ExprCopy(operands[0], destination, expr.pos))
+
+    @_statement.register(ExprReturn)
+    def _statement_return(self, expr):
+        result = self._hoist([expr.expr])
+        if result is None:
+            return expr
+
+        hoisted, (value,) = result
+        return ExprComma().add(hoisted).add(ExprReturn(value, expr.pos))
+
+    @_statement.register(ExprCall)
+    def _statement_call(self, expr):
+        result = self._hoist(expr.args)
+        if result is None:
+            return expr
+
+        hoisted, args = result
+        return ExprComma().add(hoisted).add(ExprCall(expr.func, args, expr.pos))
+
+    ####################################################################################################################
+    # Finding repeats
+    ####################################################################################################################
+
+    @visitor
+    def _count(self, expr):
+        # Anything else either writes or changes what runs
+        self._writes = True
+
+    @_count.register(ExprNumber, ExprString, ExprIdent, ExprAddrof)
+    def _count_leaf(self, expr):
+        pass
+
+    @_count.register(ExprCast)
+    def _count_cast(self, expr):
+        self._count(expr.expr)
+
+    @_count.register(ExprBinary)
+    def _count_binary(self, expr):
+        if self._seen(expr):
+            return
+        self._count(expr.left)
+        if expr.op == '&&' or expr.op == '||':
+            # The right side might not run, it is only checked for writes
+            self._guarded += 1
+            self._count(expr.right)
+            self._guarded -= 1
+        else:
+            self._count(expr.right)
+        self._finish(expr)
+
+    @_count.register(ExprDeref)
+    def _count_deref(self, expr):
+        if self._seen(expr):
+            return
+        self._count(expr.expr)
+        self._finish(expr)
+
+    def _seen(self, expr) -> bool:
+        """
+        Count the node, returns True if it was seen before so its operands were already counted
+        """
+        key = id(expr)
+        if self._guarded:
+            if key in self._guarded_seen:
+                return True
+            self._guarded_seen.add(key)
+            return False
+
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        if count == 2 and (isinstance(expr, ExprDeref) or expr.op in _VALUE_OPS):
+            self._repeats.append(expr)
+        return count != 1
+
+    def _finish(self, expr):
+        self._finished[id(expr)] = len(self._finished)
+
+    ####################################################################################################################
+    # Using the temporaries
+    ####################################################################################################################
+
+    def _replace(self, expr):
+        temp = self._temps.get(id(expr))
+        if temp is not None:
+            return ExprIdent(temp.ident, expr.pos)
+        return self._replace_children(expr)
+
+    @visitor
+    def _replace_children(self, expr):
+        return expr
+
+    @_replace_children.register(ExprBinary)
+    def _replace_binary(self, expr):
+        left = self._replace(expr.left)
+        right = self._replace(expr.right)
+        if left is expr.left and right is expr.right:
+            return expr
+        return ExprBinary(left, expr.op, right, expr.pos)
+
+    @_replace_children.register(ExprDeref)
+    def _replace_deref(self, expr):
+        inner = self._replace(expr.expr)
+        if inner is expr.expr:
+            return expr
+        return ExprDeref(inner, expr.pos)
+
+    @_replace_children.register(ExprCast)
+    def _replace_cast(self, expr):
+        inner = self._replace(expr.expr)
+        if inner is expr.expr:
+            return expr
+        return ExprCast(inner, expr.typ, expr.pos)
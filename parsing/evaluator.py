@@ -0,0 +1,350 @@
+from .visitor import visitor
+from .ast import *
+
+
+def _div(a, b):
+    # C division truncates towards zero
+    if b == 0:
+        return None
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def _mod(a, b):
+    if b == 0:
+        return None
+    return a - _div(a, b) * b
+
+
+# How to fold every binary operator on two known values, None means it can't be folded
+_BINARY_FOLDS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': _div,
+    '%': _mod,
+    '&': lambda a, b: a & b,
+    '|': lambda a, b: a | b,
+    '^': lambda a, b: a ^ b,
+    '<<': lambda a, b: a << b,
+    '>>': lambda a, b: a >> b,
+    '==': lambda a, b: int(a == b),
+    '!=': lambda a, b: int(a != b),
+    '<': lambda a, b: int(a < b),
+    '>': lambda a, b: int(a > b),
+    '<=': lambda a, b: int(a <= b),
+    '>=': lambda a, b: int(a >= b),
+}
+
+
+# The operators that give a truth value instead of a value of the operands' type
+_COMPARE_OPS = {'==', '!=', '<', '>', '<=', '>='}
+
+
+def _promote(typ: CInteger) -> CInteger:
+    # Anything smaller than an int is computed as an int
+    if typ.bits < NATIVE_INTEGER_SIZE:
+        return CInteger(NATIVE_INTEGER_SIZE, True)
+    return typ
+
+
+def convert_number(number: ExprNumber, typ: CInteger) -> ExprNumber:
+    """
+    Convert a number to another integer type the way the target would, a negative value of a
+    signed type is sign extended
+    """
+    return ExprNumber(typ.wrap(number.typ.value_of(number.value)), typ)
+
+
+def fold_binary(expr: ExprBinary, ast):
+    """
+    Calculate a binary operation on two numbers the way the target would, in the width and
+    signedness of the promoted operands, returns None if it can't be folded (division by zero,
+    shift by more than the width). The result is not narrowed back to the operands' type, that
+    only happens when it is stored.
+    """
+    ltyp = _promote(expr.left.typ)
+    rtyp = _promote(expr.right.typ)
+
+    a = expr.left.typ.value_of(expr.left.value)
+    b = expr.right.typ.value_of(expr.right.value)
+
+    if expr.op in ('<<', '>>'):
+        # The result has the type of the promoted left operand
+        typ = ltyp
+        a = typ.value_of(a)
+        if b < 0 or b >= typ.bits:
+            return None
+    else:
+        # The operands are converted to a common type, unsigned wins
+        typ = CInteger(max(ltyp.bits, rtyp.bits), ltyp.signed and rtyp.signed)
+        a = typ.value_of(a)
+        b = typ.value_of(b)
+
+    value = _BINARY_FOLDS[expr.op](a, b)
+    if value is None:
+        return None
+
+    if expr.op in _COMPARE_OPS:
+        typ = expr.resolve_type(ast)
+    return ExprNumber(typ.wrap(value), typ)
+
+
+class _CannotEvaluate(Exception):
+    pass
+
+
+class _Return(Exception):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Frame:
+
+    __slots__ = ('func', 'params', 'vars')
+
+    def __init__(self, func: Function, params: List[ExprNumber]):
+        self.func = func
+        self.params = params
+        self.vars = [None] * len(func.vars)  # type: List[ExprNumber]
+
+
+class Evaluator:
+    """
+    Runs calls to pure functions at compile time.
+
+    Only integers are supported, anything touching memory, globals or function pointers can't be
+    evaluated. Every evaluation has a budget of steps and a limit on how deep the calls can go, so
+    functions that never return (or take too long) are simply left to run at runtime.
+    """
+
+    MAX_STEPS = 10000
+    MAX_DEPTH = 32
+
+    def __init__(self, parser):
+        self.parser = parser
+
+        # (function index, argument values) to result, None if it could not be evaluated
+        self._results = {}  # type: Dict[Tuple[int, Tuple[int]], ExprNumber]
+
+        # Evaluation state
+        self._frame = None  # type: _Frame
+        self._steps = 0
+        self._depth = 0
+        self._exhausted = False
+
+    def call(self, index: int, args: List[ExprNumber]):
+        """
+        Evaluate a call with the given arguments, returns the result as an ExprNumber or None
+        if it can't be done at compile time
+        """
+        self._steps = 0
+        self._depth = 0
+        self._exhausted = False
+        try:
+            return self._call(index, args)
+        except _CannotEvaluate:
+            return None
+
+    def constant(self, expr: Expr):
+        """
+        Evaluate an integer constant expression (like a case label), returns the value as an
+        ExprNumber or None if it is not one
+        """
+        self._steps = 0
+        self._depth = 0
+        self._exhausted = False
+        try:
+            return self._eval(expr)
+        except _CannotEvaluate:
+            return None
+
+    def forget_failures(self):
+        """
+        Calls that failed because a function was not pure might work once it is
+        """
+        self._results = {key: result for key, result in self._results.items() if result is not None}
+
+    def _call(self, index: int, args: List[ExprNumber]):
+        func = self.parser.func_list[index]
+        if func.prototype or func.code is None or not func.pure or len(args) != func.num_params:
+            raise _CannotEvaluate()
+
+        if not isinstance(func.type.ret_type, CInteger):
+            raise _CannotEvaluate()
+
+        params = []
+        for typ, arg in zip(func.type.param_types, args):
+            if not isinstance(typ, CInteger):
+                raise _CannotEvaluate()
+            params.append(convert_number(arg, typ))
+
+        key = (index, tuple(param.value for param in params))
+        if key in self._results:
+            result = self._results[key]
+            if result is None:
+                raise _CannotEvaluate()
+            return result
+
+        if self._depth == Evaluator.MAX_DEPTH:
+            self._exhausted = True
+            raise _CannotEvaluate()
+
+        frame = self._frame
+        self._frame = _Frame(func, params)
+        self._depth += 1
+        try:
+            self._eval(func.code)
+            # Falling off the end of the function
+            raise _CannotEvaluate()
+
+        except _Return as ret:
+            typ = func.type.ret_type
+            result = convert_number(ret.value, typ)
+            self._results[key] = result
+            return result
+
+        except _CannotEvaluate:
+            # Running out of steps or depth says nothing about the call itself
+            if not self._exhausted:
+                self._results[key] = None
+            raise
+
+        finally:
+            self._frame = frame
+            self._depth -= 1
+
+    def _step(self):
+        self._steps += 1
+        if self._steps > Evaluator.MAX_STEPS:
+            self._exhausted = True
+            raise _CannotEvaluate()
+
+    def _value(self, expr) -> ExprNumber:
+        """
+        Evaluate an expression that must have a value
+        """
+        value = self._eval(expr)
+        if value is None:
+            raise _CannotEvaluate()
+        return value
+
+    def _variable(self, ident: Identifier):
+        """
+        The type and the list holding the value of a local variable or a parameter
+        """
+        # Constant expressions are evaluated outside of any call
+        if self._frame is None:
+            raise _CannotEvaluate()
+
+        if isinstance(ident, ParameterIdentifier):
+            return self._frame.func.type.param_types[ident.index], self._frame.params
+
+        elif isinstance(ident, VariableIdentifier):
+            var = self._frame.func.vars[ident.index]
+            # Static variables live on between calls
+            if var.storage == StorageClass.STATIC or not isinstance(var.typ, CInteger):
+                raise _CannotEvaluate()
+            return var.typ, self._frame.vars
+
+        raise _CannotEvaluate()
+
+    @visitor
+    def _eval(self, expr) -> ExprNumber:
+        raise _CannotEvaluate()
+
+    @_eval.register(ExprNumber)
+    def _eval_number(self, expr: ExprNumber) -> ExprNumber:
+        return expr
+
+    @_eval.register(ExprNop)
+    def _eval_nop(self, expr: ExprNop) -> ExprNumber:
+        return None
+
+    @_eval.register(ExprIdent)
+    def _eval_ident(self, expr: ExprIdent) -> ExprNumber:
+        typ, values = self._variable(expr.ident)
+        value = values[expr.ident.index]
+
+        # Read before it was ever set
+        if value is None:
+            raise _CannotEvaluate()
+
+        return value
+
+    @_eval.register(ExprCopy)
+    def _eval_copy(self, expr: ExprCopy) -> ExprNumber:
+        self._step()
+        if not isinstance(expr.destination, ExprIdent):
+            raise _CannotEvaluate()
+
+        value = self._value(expr.source)
+        typ, values = self._variable(expr.destination.ident)
+        value = convert_number(value, typ)
+        values[expr.destination.ident.index] = value
+        return value
+
+    @_eval.register(ExprCast)
+    def _eval_cast(self, expr: ExprCast) -> ExprNumber:
+        value = self._value(expr.expr)
+        if not isinstance(expr.typ, CInteger):
+            raise _CannotEvaluate()
+        return convert_number(value, expr.typ)
+
+    @_eval.register(ExprBinary)
+    def _eval_binary(self, expr: ExprBinary) -> ExprNumber:
+        self._step()
+        left = self._value(expr.left)
+
+        if expr.op == '&&':
+            if left.value == 0:
+                return ExprNumber(0, CInteger(16, False))
+            return ExprNumber(int(self._value(expr.right).value != 0), CInteger(16, False))
+
+        elif expr.op == '||':
+            if left.value != 0:
+                return ExprNumber(1, CInteger(16, False))
+            return ExprNumber(int(self._value(expr.right).value != 0), CInteger(16, False))
+
+        value = fold_binary(ExprBinary(left, expr.op, self._value(expr.right)), self.parser)
+        if value is None:
+            raise _CannotEvaluate()
+        return value
+
+    @_eval.register(ExprComma)
+    def _eval_comma(self, expr: ExprComma) -> ExprNumber:
+        value = None
+        for e in expr.exprs:
+            value = self._eval(e)
+        return value
+
+    @_eval.register(ExprIf)
+    def _eval_if(self, expr: ExprIf) -> ExprNumber:
+        self._step()
+        if self._value(expr.cond).value != 0:
+            self._eval(expr.then)
+        else:
+            self._eval(expr.otherwise)
+        return None
+
+    @_eval.register(ExprLoop)
+    def _eval_loop(self, expr: ExprLoop) -> ExprNumber:
+        while True:
+            self._step()
+            if self._value(expr.cond).value == 0:
+                return None
+            self._eval(expr.body)
+
+    @_eval.register(ExprReturn)
+    def _eval_return(self, expr: ExprReturn) -> ExprNumber:
+        raise _Return(self._value(expr.expr))
+
+    @_eval.register(ExprCall)
+    def _eval_call(self, expr: ExprCall) -> ExprNumber:
+        self._step()
+        if not isinstance(expr.func, ExprIdent) or not isinstance(expr.func.ident, FunctionIdentifier):
+            raise _CannotEvaluate()
+
+        args = [self._value(arg) for arg in expr.args]
+        return self._call(expr.func.ident.index, args)
@@ -0,0 +1,433 @@
+from .call_graph import CallGraph
+from .visitor import visitor
+from .ast import *
+
+
+class _Callee:
+    """
+    What the inliner knows about a function that can be inlined
+    """
+
+    __slots__ = ('size', 'uses', 'written')
+
+    def __init__(self, num_params: int):
+        # Number of nodes in the body
+        self.size = 0
+
+        # How many times every parameter is read, and if it is ever assigned or has its address taken
+        self.uses = [0] * num_params
+        self.written = [False] * num_params
+
+
+class Inliner:
+    """
+    Replaces calls to small functions with a copy of their body.
+
+    The parameters of the inlined function become temporaries of the caller that are assigned the
+    arguments, unless the argument can be used in place of the parameter, and its locals become
+    temporaries of the caller as well. Only functions made of statements followed by a single
+    return can be inlined, so the copy is simply a comma expression ending with the return value.
+
+    A function is inlined if its body is no bigger than the limit, functions declared `inline` are
+    allowed to be bigger and static functions that are only called once are always inlined since
+    they are not needed after that.
+    """
+
+    # How much bigger than the limit a function declared `inline` may be
+    INLINE_FACTOR = 4
+
+    def __init__(self, parser, call_graph: CallGraph, limit: int):
+        self.parser = parser
+        self.call_graph = call_graph
+        self.limit = limit
+
+        # Recursive functions can't be inlined, inlining only removes calls so this doesn't change
+        self._recursive = None  # type: List[bool]
+
+        # Callee info per function, None if it can't be inlined
+        self._callees = {}  # type: Dict[int, _Callee]
+
+        # Inlining state
+        self._caller = None  # type: Function
+        self._changed = False
+        self._measured = None  # type: _Callee
+        self._returns = 0
+        self._params = None  # type: List[Expr]
+        self._locals = None  # type: List[ExprIdent]
+
+    def inline(self) -> List[int]:
+        """
+        Inline calls in all the functions, returns the functions that were changed. Callees are
+        done before their callers, so a function is only inlined after the calls in it were.
+        """
+        func_list = self.parser.func_list
+        self._recursive = [self.call_graph.is_recursive(i) for i in range(len(func_list))]
+        self._callees = {}
+
+        changed = []
+        for component in self.call_graph.components():
+            for i in component:
+                func = func_list[i]
+                if func.code is None:
+                    continue
+
+                self._caller = func
+                self._changed = False
+                func.code = self._inline(func.code)
+                if self._changed:
+                    self.call_graph.update(i)
+                    changed.append(i)
+
+        self._caller = None
+        return sorted(changed)
+
+    def _callee(self, index: int) -> _Callee:
+        """
+        Find if a function can be inlined at all and measure it
+        """
+        if index in self._callees:
+            return self._callees[index]
+
+        self._callees[index] = None
+        func = self.parser.func_list[index]
+        if func.prototype or func.code is None or self._recursive[index]:
+            return None
+
+        if func.type.callconv == CallConv.INTERRUPT:
+            return None
+
+        # Static variables are shared between all the calls
+        for var in func.vars:
+            if var.storage == StorageClass.STATIC:
+                return None
+
+        # The function must end with its only return
+        last = func.code.exprs[-1] if isinstance(func.code, ExprComma) else func.code
+        if not isinstance(last, ExprReturn):
+            return None
+
+        self._measured = _Callee(func.num_params)
+        self._returns = 0
+        self._measure(func.code)
+        callee = self._measured
+        self._measured = None
+        if self._returns != 1:
+            return None
+
+        self._callees[index] = callee
+        return callee
+
+    def _should_inline(self, index: int) -> bool:
+        callee = self._callee(index)
+        if callee is None:
+            return False
+
+        func = self.parser.func_list[index]
+        if func.storage_decl == StorageClass.STATIC:
+            if self.call_graph.call_sites(index) == 1 and not self.call_graph.is_address_taken(index):
+                return True
+
+        limit = self.limit
+        if func.inline:
+            limit *= Inliner.INLINE_FACTOR
+        return callee.size <= limit
+
+    def _expand(self, expr: ExprCall) -> Expr:
+        """
+        Turn a call into a copy of the called function
+        """
+        index = expr.func.ident.index
+        func = self.parser.func_list[index]
+        callee = self._callees[index]
+
+        # Nothing in a callee without side effects or calls can change a local of the caller, so
+        # as long as the other arguments don't either a local can be read in place of the parameter
+        no_effects = not self.call_graph.has_side_effects(index) and len(self.call_graph.callees(index)) == 0
+        others_pure = all(arg.is_pure(self.parser) for arg in expr.args)
+
+        code = ExprComma()
+
+        # The new variables are made in the caller
+        self.parser.func = self._caller
+
+        params = []
+        for i, (typ, arg) in enumerate(zip(func.type.param_types, expr.args)):
+            if callee.uses[i] == 0 and not callee.written[i]:
+                # Still has to run for its side effects
+                code.add(arg)
+                params.append(None)
+
+            elif not callee.written[i] and self._can_substitute(arg, no_effects and others_pure):
+                params.append(arg)
+
+            else:
+                temp = self.parser._temp(typ)
+                code.add(ExprCopy(arg, temp, arg.pos))
+                params.append(temp)
+
+        self._params = params
+        self._locals = [self.parser._temp(var.typ) for var in func.vars]
+        self.parser.func = None
+
+        code.add(self._clone(func.code))
+        self._params = None
+        self._locals = None
+
+        # The return turns into the value of the expression
+        ret = code.exprs.pop()
+        code.add(ret.expr)
+        code.pos = expr.pos
+        return code
+
+    def _can_substitute(self, arg: Expr, locals_safe: bool) -> bool:
+        if isinstance(arg, ExprNumber):
+            return True
+
+        if isinstance(arg, ExprIdent) and locals_safe:
+            if isinstance(arg.ident, ParameterIdentifier):
+                return True
+            if isinstance(arg.ident, VariableIdentifier):
+                # Arrays are turned into pointers when passed
+                return not isinstance(self._caller.vars[arg.ident.index].typ, CArray)
+
+        return False
+
+    ####################################################################################################################
+    # Finding the calls
+    ####################################################################################################################
+
+    @visitor
+    def _inline(self, expr):
+        return expr
+
+    @_inline.register(ExprComma)
+    def _inline_comma(self, expr):
+        expr.exprs = [self._inline(e) for e in expr.exprs]
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprBinary)
+    def _inline_binary(self, expr):
+        expr.left = self._inline(expr.left)
+        expr.right = self._inline(expr.right)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprCopy)
+    def _inline_copy(self, expr):
+        expr.source = self._inline(expr.source)
+        expr.destination = self._inline(expr.destination)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprLoop)
+    def _inline_loop(self, expr):
+        expr.cond = self._inline(expr.cond)
+        expr.body = self._inline(expr.body)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprIf)
+    def _inline_if(self, expr):
+        expr.cond = self._inline(expr.cond)
+        expr.then = self._inline(expr.then)
+        expr.otherwise = self._inline(expr.otherwise)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprSwitch)
+    def _inline_switch(self, expr):
+        expr.expr = self._inline(expr.expr)
+        expr.body = self._inline(expr.body)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprAddrof, ExprDeref, ExprReturn, ExprCast)
+    def _inline_unary(self, expr):
+        expr.expr = self._inline(expr.expr)
+        expr.invalidate()
+        return expr
+
+    @_inline.register(ExprCall)
+    def _inline_call(self, expr):
+        expr.args = [self._inline(arg) for arg in expr.args]
+        expr.invalidate()
+
+        if not isinstance(expr.func, ExprIdent) or not isinstance(expr.func.ident, FunctionIdentifier):
+            return expr
+
+        if not self._should_inline(expr.func.ident.index):
+            return expr
+
+        # The copy is not searched for calls again, whatever is left in it can't be inlined
+        self._changed = True
+        return self._expand(expr)
+
+    ####################################################################################################################
+    # Measuring a callee
+    ####################################################################################################################
+
+    @visitor
+    def _measure(self, expr):
+        self._measured.size += 1
+
+    @_measure.register(ExprIdent)
+    def _measure_ident(self, expr):
+        self._measured.size += 1
+        if isinstance(expr.ident, ParameterIdentifier):
+            self._measured.uses[expr.ident.index] += 1
+
+    @_measure.register(ExprComma)
+    def _measure_comma(self, expr):
+        self._measured.size += 1
+        for e in expr.exprs:
+            self._measure(e)
+
+    @_measure.register(ExprBinary)
+    def _measure_binary(self, expr):
+        self._measured.size += 1
+        self._measure(expr.left)
+        self._measure(expr.right)
+
+    @_measure.register(ExprCopy)
+    def _measure_copy(self, expr):
+        self._measured.size += 1
+        if isinstance(expr.destination, ExprIdent) and isinstance(expr.destination.ident, ParameterIdentifier):
+            self._measured.written[expr.destination.ident.index] = True
+        self._measure(expr.source)
+        self._measure(expr.destination)
+
+    @_measure.register(ExprLoop)
+    def _measure_loop(self, expr):
+        self._measured.size += 1
+        self._measure(expr.cond)
+        self._measure(expr.body)
+
+    @_measure.register(ExprIf)
+    def _measure_if(self, expr):
+        self._measured.size += 1
+        self._measure(expr.cond)
+        self._measure(expr.then)
+        self._measure(expr.otherwise)
+
+    @_measure.register(ExprSwitch)
+    def _measure_switch(self, expr):
+        self._measured.size += 1
+        self._measure(expr.expr)
+        self._measure(expr.body)
+
+    @_measure.register(ExprAddrof)
+    def _measure_addrof(self, expr):
+        self._measured.size += 1
+        if isinstance(expr.expr, ExprIdent) and isinstance(expr.expr.ident, ParameterIdentifier):
+            self._measured.written[expr.expr.ident.index] = True
+        self._measure(expr.expr)
+
+    @_measure.register(ExprReturn)
+    def _measure_return(self, expr):
+        self._returns += 1
+        self._measure(expr.expr)
+
+    @_measure.register(ExprDeref, ExprCast)
+    def _measure_unary(self, expr):
+        self._measured.size += 1
+        self._measure(expr.expr)
+
+    @_measure.register(ExprCall)
+    def _measure_call(self, expr):
+        self._measured.size += 1
+        self._measure(expr.func)
+        for arg in expr.args:
+            self._measure(arg)
+
+    ####################################################################################################################
+    # Copying a callee
+    ####################################################################################################################
+
+    @visitor
+    def _clone(self, expr):
+        assert False, f'{expr} - [{type(expr)}]'
+
+    @_clone.register(ExprNop)
+    def _clone_nop(self, expr):
+        return ExprNop()
+
+    @_clone.register(ExprNumber)
+    def _clone_number(self, expr):
+        return ExprNumber(expr.value, expr.typ, expr.pos)
+
+    @_clone.register(ExprString)
+    def _clone_string(self, expr):
+        return ExprString(expr.value, expr.pos)
+
+    @_clone.register(ExprIdent)
+    def _clone_ident(self, expr):
+        if isinstance(expr.ident, ParameterIdentifier):
+            # Either a temporary, a number or a local of the caller
+            param = self._params[expr.ident.index]
+            if isinstance(param, ExprNumber):
+                return ExprNumber(param.value, param.typ, expr.pos)
+            return ExprIdent(param.ident, expr.pos)
+        elif isinstance(expr.ident, VariableIdentifier):
+            return ExprIdent(self._locals[expr.ident.index].ident, expr.pos)
+        else:
+            return ExprIdent(expr.ident, expr.pos)
+
+    @_clone.register(ExprComma)
+    def _clone_comma(self, expr):
+        comma = ExprComma()
+        comma.add([self._clone(e) for e in expr.exprs])
+        comma.pos = expr.pos
+        return comma
+
+    @_clone.register(ExprBinary)
+    def _clone_binary(self, expr):
+        return ExprBinary(self._clone(expr.left), expr.op, self._clone(expr.right), expr.pos)
+
+    @_clone.register(ExprCast)
+    def _clone_cast(self, expr):
+        return ExprCast(self._clone(expr.expr), expr.typ, expr.pos)
+
+    @_clone.register(ExprCopy)
+    def _clone_copy(self, expr):
+        return ExprCopy(self._clone(expr.source), self._clone(expr.destination), expr.pos)
+
+    @_clone.register(ExprLoop)
+    def _clone_loop(self, expr):
+        return ExprLoop(self._clone(expr.cond), self._clone(expr.body), expr.pos)
+
+    @_clone.register(ExprIf)
+    def _clone_if(self, expr):
+        return ExprIf(self._clone(expr.cond), self._clone(expr.then), self._clone(expr.otherwise), expr.pos)
+
+    @_clone.register(ExprSwitch)
+    def _clone_switch(self, expr):
+        return ExprSwitch(self._clone(expr.expr), self._clone(expr.body), expr.pos)
+
+    @_clone.register(ExprCase)
+    def _clone_case(self, expr):
+        return ExprCase(expr.value, expr.pos)
+
+    @_clone.register(ExprBreak)
+    def _clone_break(self, expr):
+        return ExprBreak(expr.pos)
+
+    @_clone.register(ExprContinue)
+    def _clone_continue(self, expr):
+        return ExprContinue(expr.pos)
+
+    @_clone.register(ExprAddrof)
+    def _clone_addrof(self, expr):
+        return ExprAddrof(self._clone(expr.expr), expr.pos)
+
+    @_clone.register(ExprDeref)
+    def _clone_deref(self, expr):
+        return ExprDeref(self._clone(expr.expr), expr.pos)
+
+    @_clone.register(ExprReturn)
+    def _clone_return(self, expr):
+        return ExprReturn(self._clone(expr.expr), expr.pos)
+
+    @_clone.register(ExprCall)
+    def _clone_call(self, expr):
+        return ExprCall(self._clone(expr.func), [self._clone(arg) for arg in expr.args], expr.pos)
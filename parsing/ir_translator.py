@@ -1,14 +1,27 @@
 from ir.assembler import *
 from ir.program import *
 from .parser import Parser
+from .visitor import visitor
 from .ast import *
 
 
+# The case values of a switch are compared as words
+_WORD_MASK = (1 << NATIVE_INTEGER_SIZE) - 1
+
+
 class IrTranslator:
     """
     Will translate the AST into IR code
     """
 
+    # A switch with at least this many cases is dispatched with a jump table, as long as the table
+    # is no more than SWITCH_TABLE_SPREAD times bigger than the number of cases
+    SWITCH_TABLE_CASES = 4
+    SWITCH_TABLE_SPREAD = 3
+
+    # Up to this many cases are compared one by one, more than that are binary searched
+    SWITCH_LINEAR_CASES = 3
+
     def __init__(self, ast: Parser):
         self._ast = ast
         self._asm = Assembler()
@@ -18,6 +31,13 @@ class IrTranslator:
         self._func: Function = None
         self._temp = 0
 
+        # Where break and continue jump to, innermost last
+        self._breaks: List[IrLabelId] = []
+        self._continues: List[IrLabelId] = []
+
+        # The labels of the cases of the switches being translated
+        self._cases: Dict[int, IrLabelId] = {}
+
         # Compilation output
         self.proc_list: List[Procedure] = []
 
@@ -28,7 +48,7 @@ class IrTranslator:
 
     def translate(self):
         for func in self._ast.func_list:
-            if not func.prototype:
+            if not func.prototype and func.used:
                 self._func = func
                 self._translate_function()
 
@@ -47,6 +67,7 @@ class IrTranslator:
         self._asm.clear()
         self._translate_expr(self._func.code, None)
         self._asm.fix_labels()
+        self._proc.get_vars().add_bases(self._temp)
 
         self._proc.insert_instructions(self._asm.get_instructions())
 
@@ -70,150 +91,344 @@ class IrTranslator:
             self._translate_expr(expr, a)
             return a
 
-    def _translate_expr(self, expr: Expr, dest):
-        if isinstance(expr, ExprNumber):
-            assert dest is not None
-            self._asm.emit_assign(dest, IrConst(expr.value))
+    def _translate_branch(self, cond: Expr, label: IrLabelId, when: bool):
+        """
+        Jump to the label if the condition is true (when is True) or false (when is False), otherwise
+        fall through. Comparisons and logical operators turn straight into conditional jumps instead
+        of having their 0/1 result calculated and then compared.
+        """
+        if isinstance(cond, ExprNumber):
+            if (cond.value != 0) == when:
+                self._asm.emit_jmp(IrLabel(label))
+
+        elif isinstance(cond, ExprBinary) and cond.op == '==':
+            # x == 0 is the same as branching on x the other way
+            if isinstance(cond.right, ExprNumber) and cond.right.value == 0:
+                self._translate_branch(cond.left, label, not when)
+            else:
+                opr1 = self._translate_to_operand(cond.left)
+                opr2 = self._translate_to_operand(cond.right)
+                if when:
+                    self._asm.emit_je(IrLabel(label), opr1, opr2)
+                else:
+                    self._asm.emit_jne(IrLabel(label), opr1, opr2)
+
+        elif isinstance(cond, ExprBinary) and cond.op == '&&':
+            if when:
+                skip = self._asm.make_label()
+                self._translate_branch(cond.left, skip, False)
+                self._translate_branch(cond.right, label, True)
+                self._asm.mark_label(skip)
+            else:
+                self._translate_branch(cond.left, label, False)
+                self._translate_branch(cond.right, label, False)
 
-        elif isinstance(expr, ExprBinary):
+        elif isinstance(cond, ExprBinary) and cond.op == '||':
+            if when:
+                self._translate_branch(cond.left, label, True)
+                self._translate_branch(cond.right, label, True)
+            else:
+                skip = self._asm.make_label()
+                self._translate_branch(cond.left, skip, True)
+                self._translate_branch(cond.right, label, False)
+                self._asm.mark_label(skip)
 
-            if dest is not None:
-                if expr.op in '+-/*%|&^' or expr.op in ['==']:
-                    opr1 = self._translate_to_operand(expr.left)
-                    opr2 = self._translate_to_operand(expr.right)
+        elif isinstance(cond, ExprComma):
+            for ex in cond.exprs[:-1]:
+                self._translate_expr(ex, None)
+            self._translate_branch(cond.exprs[-1], label, when)
 
-                    if expr.op == '+':
-                        self._asm.emit_assign_add(dest, opr1, opr2)
+        else:
+            opr = self._translate_to_operand(cond)
+            if when:
+                self._asm.emit_jne(IrLabel(label), opr, IrConst(0))
+            else:
+                self._asm.emit_je(IrLabel(label), opr, IrConst(0))
 
-                    elif expr.op == '-':
-                        self._asm.emit_assign_sub(dest, opr1, opr2)
+    @visitor
+    def _translate_expr(self, expr: Expr, dest):
+        assert False, f'{expr} - [{type(expr)}]'
+
+    @_translate_expr.register(ExprNumber)
+    def _translate_number(self, expr: ExprNumber, dest):
+        assert dest is not None
+        self._asm.emit_assign(dest, IrConst(expr.value))
+
+    @_translate_expr.register(ExprIdent)
+    def _translate_ident(self, expr: ExprIdent, dest):
+        assert dest is not None
+        self._asm.emit_assign(dest, self._translate_to_operand(expr))
+
+    @_translate_expr.register(ExprCast)
+    def _translate_cast(self, expr: ExprCast, dest):
+        # Every integer and pointer is a single word, a cast only changes the type
+        self._translate_expr(expr.expr, dest)
+
+    @_translate_expr.register(ExprBinary)
+    def _translate_binary(self, expr: ExprBinary, dest):
+        if dest is not None:
+            if expr.op in '+-/*%|&^' or expr.op in ['==']:
+                opr1 = self._translate_to_operand(expr.left)
+                opr2 = self._translate_to_operand(expr.right)
 
-                    elif expr.op == '/':
-                        self._asm.emit_assign_div(dest, opr1, opr2)
+                if expr.op == '+':
+                    self._asm.emit_assign_add(dest, opr1, opr2)
 
-                    elif expr.op == '*':
-                        self._asm.emit_assign_mul(dest, opr1, opr2)
+                elif expr.op == '-':
+                    self._asm.emit_assign_sub(dest, opr1, opr2)
 
-                    elif expr.op == '%':
-                        self._asm.emit_assign_mod(dest, opr1, opr2)
+                elif expr.op == '/':
+                    self._asm.emit_assign_div(dest, opr1, opr2)
 
-                    elif expr.op == '|':
-                        self._asm.emit_assign_or(dest, opr1, opr2)
+                elif expr.op == '*':
+                    self._asm.emit_assign_mul(dest, opr1, opr2)
 
-                    elif expr.op == '&':
-                        self._asm.emit_assign_and(dest, opr1, opr2)
+                elif expr.op == '%':
+                    self._asm.emit_assign_mod(dest, opr1, opr2)
 
-                    elif expr.op == '^':
-                        self._asm.emit_assign_xor(dest, opr1, opr2)
+                elif expr.op == '|':
+                    self._asm.emit_assign_or(dest, opr1, opr2)
 
-                    elif expr.op == '==':
-                        end = self._asm.make_label()
-                        self._asm.emit_assign(dest, IrConst(0))
-                        self._asm.emit_jne(IrLabel(end), opr1, opr2)
-                        self._asm.emit_assign(dest, IrConst(1))
-                        self._asm.mark_label(end)
+                elif expr.op == '&':
+                    self._asm.emit_assign_and(dest, opr1, opr2)
 
-                    # TODO: more comparison implementations
+                elif expr.op == '^':
+                    self._asm.emit_assign_xor(dest, opr1, opr2)
 
-                elif expr.op == '&&':
-                    setfalse = self._asm.make_label()
+                elif expr.op == '==':
                     end = self._asm.make_label()
-                    self._asm.emit_je(IrLabel(setfalse), self._translate_to_operand(expr.left), IrConst(0))
-                    self._asm.emit_je(IrLabel(setfalse), self._translate_to_operand(expr.right), IrConst(0))
-                    self._asm.emit_assign(dest, IrConst(1))
-                    self._asm.emit_jmp(IrLabel(end))
-                    self._asm.mark_label(setfalse)
                     self._asm.emit_assign(dest, IrConst(0))
+                    self._asm.emit_jne(IrLabel(end), opr1, opr2)
+                    self._asm.emit_assign(dest, IrConst(1))
                     self._asm.mark_label(end)
 
-                else:
-                    assert False, f"{expr} [{expr.op}] - {type(expr)} | {dest}"
-            else:
-                opr1 = self._translate_to_operand(expr.left)
-                if expr.op == '||':
-                    end = self._asm.make_label()
-                    self._asm.emit_jne(IrLabel(end), opr1, IrConst(0))
-                    self._translate_expr(expr.right, None)
-                    self._asm.mark_label(end)
-
-                elif expr.op == '&&':
-                    end = self._asm.make_label()
-                    self._asm.emit_je(IrLabel(end), opr1, IrConst(0))
-                    self._translate_expr(expr.right, None)
-                    self._asm.mark_label(end)
-                else:
-                    assert False, dest
+                # TODO: more comparison implementations
 
-        elif isinstance(expr, ExprCall):
-            # handle arguments
-            operands = []
-            for arg in expr.args:
-                operands.append(self._translate_to_operand(arg))
+            elif expr.op == '&&':
+                setfalse = self._asm.make_label()
+                end = self._asm.make_label()
+                self._asm.emit_je(IrLabel(setfalse), self._translate_to_operand(expr.left), IrConst(0))
+                self._asm.emit_je(IrLabel(setfalse), self._translate_to_operand(expr.right), IrConst(0))
+                self._asm.emit_assign(dest, IrConst(1))
+                self._asm.emit_jmp(IrLabel(end))
+                self._asm.mark_label(setfalse)
+                self._asm.emit_assign(dest, IrConst(0))
+                self._asm.mark_label(end)
 
-            if dest is None:
-                if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, GlobalIdentifier):
-                    call = self._asm.emit_call_ptr(self._translate_to_operand(expr.func))
-                else:
-                    call = self._asm.emit_call(self._translate_to_operand(expr.func))
-                for opr in operands:
-                    call.push_extra(opr)
             else:
-                if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, GlobalIdentifier):
-                    call = self._asm.emit_assign_call_ptr(dest, self._translate_to_operand(expr.func))
-                else:
-                    call = self._asm.emit_assign_call(dest, self._translate_to_operand(expr.func))
-                for opr in operands:
-                    call.push_extra(opr)
-
-        elif isinstance(expr, ExprComma):
-            for ex in expr.exprs[:-1]:
-                self._translate_expr(ex, None)
-            self._translate_expr(expr.exprs[-1], dest)
-
-        elif isinstance(expr, ExprCopy):
-            src = self._translate_to_operand(expr.source)
-
-            if isinstance(expr.destination, ExprDeref):
-                opr = self._translate_to_operand(expr.destination.expr)
-                self._asm.emit_write(opr, src)
-            elif isinstance(expr.destination, ExprIdent):
-                self._asm.emit_assign(self._translate_to_operand(expr.destination), src)
+                assert False, f"{expr} [{expr.op}] - {type(expr)} | {dest}"
+        else:
+            opr1 = self._translate_to_operand(expr.left)
+            if expr.op == '||':
+                end = self._asm.make_label()
+                self._asm.emit_jne(IrLabel(end), opr1, IrConst(0))
+                self._translate_expr(expr.right, None)
+                self._asm.mark_label(end)
+
+            elif expr.op == '&&':
+                end = self._asm.make_label()
+                self._asm.emit_je(IrLabel(end), opr1, IrConst(0))
+                self._translate_expr(expr.right, None)
+                self._asm.mark_label(end)
+            else:
+                assert False, dest
+
+    @_translate_expr.register(ExprCall)
+    def _translate_call(self, expr: ExprCall, dest):
+        # handle arguments
+        operands = []
+        for arg in expr.args:
+            operands.append(self._translate_to_operand(arg))
+
+        if dest is None:
+            if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, GlobalIdentifier):
+                call = self._asm.emit_call_ptr(self._translate_to_operand(expr.func))
             else:
-                assert False, f'{expr} - [{type(expr)}]'
+                call = self._asm.emit_call(self._translate_to_operand(expr.func))
+            for opr in operands:
+                call.push_extra(opr)
+        else:
+            if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, GlobalIdentifier):
+                call = self._asm.emit_assign_call_ptr(dest, self._translate_to_operand(expr.func))
+            else:
+                call = self._asm.emit_assign_call(dest, self._translate_to_operand(expr.func))
+            for opr in operands:
+                call.push_extra(opr)
+
+    @_translate_expr.register(ExprComma)
+    def _translate_comma(self, expr: ExprComma, dest):
+        for ex in expr.exprs[:-1]:
+            self._translate_expr(ex, None)
+        self._translate_expr(expr.exprs[-1], dest)
+
+    @_translate_expr.register(ExprCopy)
+    def _translate_copy(self, expr: ExprCopy, dest):
+        src = self._translate_to_operand(expr.source)
+
+        if isinstance(expr.destination, ExprDeref):
+            opr = self._translate_to_operand(expr.destination.expr)
+            self._asm.emit_write(opr, src)
+        elif isinstance(expr.destination, ExprIdent):
+            self._asm.emit_assign(self._translate_to_operand(expr.destination), src)
+        else:
+            assert False, f'{expr} - [{type(expr)}]'
 
-            if dest is not None:
-                self._asm.emit_assign(dest, src)
+        if dest is not None:
+            self._asm.emit_assign(dest, src)
 
-        elif isinstance(expr, ExprReturn):
-            assert dest is None
+    @_translate_expr.register(ExprReturn)
+    def _translate_return(self, expr: ExprReturn, dest):
+        assert dest is None
 
-            if not isinstance(expr.expr, ExprNop):
-                opr1 = self._translate_to_operand(expr.expr)
-                self._asm.emit_ret(opr1)
+        if not isinstance(expr.expr, ExprNop):
+            opr1 = self._translate_to_operand(expr.expr)
+            self._asm.emit_ret(opr1)
 
+        else:
+            self._asm.emit_retn()
+
+    @_translate_expr.register(ExprAddrof)
+    def _translate_addrof(self, expr: ExprAddrof, dest):
+        assert dest is not None
+        self._asm.emit_assign_addrof(dest, self._translate_to_operand(expr.expr))
+
+    @_translate_expr.register(ExprDeref)
+    def _translate_deref(self, expr: ExprDeref, dest):
+        assert dest is not None
+        self._asm.emit_assign_read(dest, self._translate_to_operand(expr.expr))
+
+    @_translate_expr.register(ExprLoop)
+    def _translate_loop(self, expr: ExprLoop, dest):
+        assert dest is None
+        end = self._asm.make_label()
+        start = self._asm.make_and_mark_label()
+        self._translate_branch(expr.cond, end, False)
+
+        self._breaks.append(end)
+        self._continues.append(start)
+        self._translate_expr(expr.body, None)
+        self._breaks.pop()
+        self._continues.pop()
+
+        self._asm.emit_jmp(IrLabel(start))
+        self._asm.mark_label(end)
+
+    @_translate_expr.register(ExprBreak)
+    def _translate_break(self, expr: ExprBreak, dest):
+        assert dest is None
+        self._asm.emit_jmp(IrLabel(self._breaks[-1]))
+
+    @_translate_expr.register(ExprContinue)
+    def _translate_continue(self, expr: ExprContinue, dest):
+        assert dest is None
+        self._asm.emit_jmp(IrLabel(self._continues[-1]))
+
+    @_translate_expr.register(ExprSwitch)
+    def _translate_switch(self, expr: ExprSwitch, dest):
+        assert dest is None
+        cases = []
+        self._collect_cases(expr.body, cases)
+
+        end = self._asm.make_label()
+        default = end
+        targets = []
+        for case in cases:
+            label = self._asm.make_label()
+            self._cases[id(case)] = label
+            if case.value is None:
+                default = label
             else:
-                self._asm.emit_retn()
+                targets.append((case.value, label))
+        targets.sort()
+
+        if isinstance(expr.expr, ExprNumber):
+            # Only one case can run
+            label = default
+            for value, target in targets:
+                if (value - expr.expr.value) & _WORD_MASK == 0:
+                    label = target
+            self._asm.emit_jmp(IrLabel(label))
+
+        elif len(targets) <= IrTranslator.SWITCH_LINEAR_CASES:
+            opr = self._translate_to_operand(expr.expr)
+            for value, target in targets:
+                self._asm.emit_je(IrLabel(target), opr, IrConst(value & _WORD_MASK))
+            self._asm.emit_jmp(IrLabel(default))
 
-        elif isinstance(expr, ExprAddrof):
-            assert dest is not None
-            self._asm.emit_assign_addrof(dest, self._translate_to_operand(expr.expr))
+        else:
+            # The cases are looked up by their distance from the lowest one, as an unsigned number anything
+            # below the lowest case is above the highest one
+            low = targets[0][0]
+            index = self._get_temp()
+            if low == 0:
+                self._asm.emit_assign(index, self._translate_to_operand(expr.expr))
+            else:
+                self._asm.emit_assign_sub(index, self._translate_to_operand(expr.expr), IrConst(low & _WORD_MASK))
+            targets = [(value - low, target) for value, target in targets]
+
+            spread = targets[-1][0] + 1
+            if len(targets) >= IrTranslator.SWITCH_TABLE_CASES and spread <= len(targets) * IrTranslator.SWITCH_TABLE_SPREAD:
+                table = [IrLabel(default)] * spread
+                for offset, target in targets:
+                    table[offset] = IrLabel(target)
+                self._asm.emit_jg(IrLabel(default), index, IrConst(spread - 1))
+                self._asm.emit_jmp_table(index, table)
+            else:
+                self._translate_case_search(index, targets, default)
 
-        elif isinstance(expr, ExprDeref):
-            assert dest is not None
-            self._asm.emit_assign_read(dest, self._translate_to_operand(expr.expr))
+        self._breaks.append(end)
+        self._translate_expr(expr.body, None)
+        self._breaks.pop()
+        self._asm.mark_label(end)
 
-        elif isinstance(expr, ExprLoop):
-            assert dest is None
+    def _collect_cases(self, expr: Expr, cases: List[ExprCase]):
+        if isinstance(expr, ExprCase):
+            cases.append(expr)
+        elif isinstance(expr, ExprComma):
+            for e in expr.exprs:
+                self._collect_cases(e, cases)
+
+    def _translate_case_search(self, index: IrVar, targets, default: IrLabelId):
+        """
+        Binary search for the index in the sorted (index, label) pairs of the cases and jump to the
+        matching one, or to the default if there is none
+        """
+        if len(targets) <= IrTranslator.SWITCH_LINEAR_CASES:
+            for offset, target in targets:
+                self._asm.emit_je(IrLabel(target), index, IrConst(offset))
+            self._asm.emit_jmp(IrLabel(default))
+            return
+
+        middle = len(targets) // 2
+        offset, target = targets[middle]
+        lower = self._asm.make_label()
+        self._asm.emit_je(IrLabel(target), index, IrConst(offset))
+        self._asm.emit_jl(IrLabel(lower), index, IrConst(offset))
+        self._translate_case_search(index, targets[middle + 1:], default)
+        self._asm.mark_label(lower)
+        self._translate_case_search(index, targets[:middle], default)
+
+    @_translate_expr.register(ExprCase)
+    def _translate_case(self, expr: ExprCase, dest):
+        assert dest is None
+        self._asm.mark_label(self._cases.pop(id(expr)))
+
+    @_translate_expr.register(ExprIf)
+    def _translate_if(self, expr: ExprIf, dest):
+        assert dest is None
+        otherwise = self._asm.make_label()
+        self._translate_branch(expr.cond, otherwise, False)
+        self._translate_expr(expr.then, None)
+
+        if isinstance(expr.otherwise, ExprNop):
+            self._asm.mark_label(otherwise)
+        else:
             end = self._asm.make_label()
-            start = self._asm.make_and_mark_label()
-            # TODO: it is a waste to use == 0 again
-            self._asm.emit_je(IrLabel(end), self._translate_to_operand(expr.cond), IrConst(0))
-            self._translate_expr(expr.body, None)
-            self._asm.emit_jmp(IrLabel(start))
+            self._asm.emit_jmp(IrLabel(end))
+            self._asm.mark_label(otherwise)
+            self._translate_expr(expr.otherwise, None)
             self._asm.mark_label(end)
 
-        elif isinstance(expr, ExprNop):
-            assert dest is None
-
-        else:
-            assert False, f'{expr} - [{type(expr)}]'
+    @_translate_expr.register(ExprNop)
+    def _translate_nop(self, expr: ExprNop, dest):
+        assert dest is None
@@ -1,279 +1,506 @@
 from .parser import Parser
+from .call_graph import CallGraph
+from .evaluator import Evaluator, convert_number, fold_binary
+from .inliner import Inliner
+from .cse import CommonSubexpressions
+from .visitor import visitor
 from .ast import *
 
 
+# Operators that are both associative and commutative, constants in chains of these can be gathered
+# into one, along with the constant that leaves the other operand as is
+_REASSOCIATE = {
+    '+': 0,
+    '*': 1,
+    '&': None,
+    '|': 0,
+    '^': 0,
+}
+
+
 class Optimizer:
 
-    def __init__(self, parser):
+    # Default size (in nodes) of the functions that are inlined, see Inliner
+    INLINE_LIMIT = 16
+
+    def __init__(self, parser, inline_limit: int = INLINE_LIMIT):
         self.parser = parser
 
+        # Functions are not inlined at all with a limit of 0
+        self.inline_limit = inline_limit
+
+        # Runs calls to pure functions with constant arguments
+        self.evaluator = Evaluator(parser)
+
+        # Built when optimizing starts and updated when folding removes side effects, calls to
+        # pure functions that were folded away may still be listed in it
+        self.call_graph: CallGraph = None
+
+        # Set when constant folding might have removed side effects or calls
+        self._lost_effects = False
+
     def _find_pure_functions(self):
-        for f in self.parser.func_list:
-            f.pure_known = False
-            f.pure = False
-
-        def check_function(f):
-
-            if f.pure_known:
-                return False
-
-            unknown_functions = [False]
-            side_effects = False
-
-            def check_side_effects(expr, lvalue=False):
-                # Iterate all the expressions
-                if isinstance(expr, ExprComma):
-                    for e in expr.exprs:
-                        if check_side_effects(e):
-                            return True
-                    return False
-                elif isinstance(expr, ExprCopy):
-                    return check_side_effects(expr.destination, True) or check_side_effects(expr.source)
-                elif isinstance(expr, ExprBinary):
-                    return check_side_effects(expr.right) or check_side_effects(expr.left)
-                elif isinstance(expr, ExprLoop):
-                    return check_side_effects(expr.cond) or check_side_effects(expr.body)
-                elif isinstance(expr, ExprAddrof):
-                    return check_side_effects(expr.expr)
-
-                # if this is an lvalue and we have a deref we assume side effects
-                elif isinstance(expr, ExprDeref):
-                    if lvalue:
-                        return True
-                    else:
-                        return check_side_effects(expr.expr)
-
-                elif isinstance(expr, ExprCall):
-                    if check_side_effects(expr.func):
-                        return True
-
-                    for arg in expr.args:
-                        if check_side_effects(arg):
-                            return True
-
-                    # assume indirect function calls have side effects
-                    if not isinstance(expr.func, ExprIdent) or not isinstance(expr.func.ident, FunctionIdentifier):
-                        return True
-                    func = self.parser.func_list[expr.func.ident.index]
-
-                    # This function has side effects
-                    if func.pure_known and not func.pure:
-                        return True
-
-                    if not func.pure_known and func.name != f.name:
-                        unknown_functions[0] = True
+        self.call_graph.find_pure_functions()
+
+        # Calls may have changed their purity
+        Expr.invalidate_purity()
+
+    def _fold(self, expr, stmt):
+        """
+        Constant fold the expression, remembering if side effects might have been folded away
+        """
+        new_expr = self._constant_fold(expr, stmt)
+        if new_expr is not expr and not self._lost_effects:
+            # Anything with side effects or calls to non-pure functions is not pure, so if that
+            # was dropped it was in an expression that folded from non-pure to pure
+            if new_expr.is_pure(self.parser) and not expr.is_pure(self.parser):
+                self._lost_effects = True
+        return new_expr
+
+    def _fold_function(self, f: Function) -> bool:
+        """
+        Constant fold the function, returns if it might have lost side effects or calls
+        """
+        self._lost_effects = False
+        f.code = self._fold(f.code, True)
+        return self._lost_effects
+
+    @visitor
+    def _constant_fold(self, expr, stmt):
+        # TODO: on assign expressions we can probably do some kind of fold inside binary operation
+        #       so (5 + (a = 5)) can turn into (a = 5, 10)
+
+        # Nothing to fold in the rest of the nodes
+        return expr
+
+    @_constant_fold.register(ExprComma)
+    def _constant_fold_comma(self, expr, stmt):
+        new_exprs = []
+        unreachable = False
+        for i, e in enumerate(expr.exprs):
+            # Nothing after a jump runs, until a case label that can be jumped to
+            if unreachable and not isinstance(e, ExprCase):
+                continue
+            unreachable = False
+
+            e = self._fold(e, stmt)
+
+            # A comma the element folded into is merged into this one, its statements were already
+            # folded so only its value is left to look at
+            if isinstance(e, ExprComma):
+                new_exprs.extend(e.exprs[:-1])
+                e = e.exprs[-1]
+
+            if isinstance(e, (ExprReturn, ExprBreak, ExprContinue)):
+                new_exprs.append(e)
+                unreachable = True
+
+            # elif isinstance(e, ExprLoop):
+            #
+            #     # Break on loops that never exit
+            #     # if isinstance(e.cond, ExprNumber) and e.cond.value != 0:
+            #     #     new_exprs.append(e.body)
+            #     #     break
+            #     #
+            #     # else:
+            #     new_exprs.append(e)
+
+            # Ignore nops
+            elif isinstance(e, ExprNop):
+                continue
+
+            # only add if has side effects
+            else:
+                # inside statements we only append non-pure nodes
+                if stmt:
+                    if not e.is_pure(self.parser):
+                        new_exprs.append(e)
 
+                # Outside of that only add non-pure and the last element
                 else:
-                    return False
+                    if not e.is_pure(self.parser) or i == len(expr.exprs) - 1:
+                        new_exprs.append(e)
 
-            side_effects = check_side_effects(f.code)
+        if len(new_exprs) == 0:
+            return ExprNop()
 
-            if side_effects or not unknown_functions[0]:
-                f.pure_known = True
-                f.pure = not side_effects
-                return True
+        if len(new_exprs) == 1:
+            return new_exprs[0]
 
-            return False
+        # Nothing was removed or replaced
+        if len(new_exprs) == len(expr.exprs) and all(a is b for a, b in zip(new_exprs, expr.exprs)):
+            return expr
 
-        # Iterate until no improvements are found
-        count = 0
+        expr = ExprComma().add(new_exprs)
+        return expr
 
-        for f in self.parser.func_list:
-            if check_function(f):
-                count += 1
+    @_constant_fold.register(ExprReturn)
+    def _constant_fold_return(self, expr, stmt):
+        expr.expr = self._fold(expr.expr, False)
+        expr.invalidate()
 
-        while count != 0:
-            count = 0
-            for f in self.parser.func_list:
-                if check_function(f):
-                    count += 1
+        if isinstance(expr.expr, ExprComma):
+            return self._lift(expr.expr, lambda value: ExprReturn(value, expr.pos))
 
-    def _constant_fold(self, expr, stmt):
-        # TODO: on assign expressions we can probably do some kind of fold inside binary operation
-        #       so (5 + (a = 5)) can turn into (a = 5, 10)
+        return expr
 
-        if isinstance(expr, ExprComma):
-            new_exprs = []
-            for i, e in enumerate(expr.exprs):
-                e = self._constant_fold(e, stmt)
-
-                # If we got to a return just don't continue
-                if isinstance(e, ExprReturn):
-                    new_exprs.append(e)
-                    break
-
-                # elif isinstance(e, ExprLoop):
-                #
-                #     # Break on loops that never exit
-                #     # if isinstance(e.cond, ExprNumber) and e.cond.value != 0:
-                #     #     new_exprs.append(e.body)
-                #     #     break
-                #     #
-                #     # else:
-                #     new_exprs.append(e)
-
-                # Ignore nops
-                elif isinstance(e, ExprNop):
-                    continue
-
-                # only add if has side effects
+    def _lift(self, comma: ExprComma, make):
+        """
+        Move the statements of a comma used as an operand out in front of the expression using it,
+        which only keeps the order when nothing else in the expression runs before the operand.
+        The statements end up on the statement level where the rest of the passes look at them.
+        """
+        lifted = ExprComma()
+        lifted.add(comma.exprs[:-1])
+        lifted.add(make(comma.exprs[-1]))
+        return lifted
+
+    @_constant_fold.register(ExprBinary)
+    def _constant_fold_binary(self, expr, stmt):
+        expr.left = self._fold(expr.left, False)
+        expr.right = self._fold(expr.right, False)
+        expr.invalidate()
+
+        # The left side runs first so its statements can run before the whole operation
+        if isinstance(expr.left, ExprComma):
+            return self._lift(expr.left, lambda value: self._fold(ExprBinary(value, expr.op, expr.right, expr.pos), False))
+
+        if expr.op in _REASSOCIATE:
+            expr = self._reassociate(expr)
+            if not isinstance(expr, ExprBinary):
+                return expr
+
+        if expr.op == '&&':
+            # We know both
+            if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
+                return ExprNumber(1) if expr.left.value != 0 and expr.right.value != 0 else ExprNumber(0)
+
+            # If we first have 0 we can just return 0
+            if isinstance(expr.left, ExprNumber):
+                if expr.left.value == 0:
+                    return ExprNumber(0)
                 else:
-                    # inside statements we only append non-pure nodes
-                    if stmt:
-                        if not e.is_pure(self.parser):
-                            new_exprs.append(e)
+                    return expr.right
 
-                    # Outside of that only add non-pure and the last element
-                    else:
-                        if not e.is_pure(self.parser) or i == len(expr.exprs) - 1:
-                            new_exprs.append(e)
+            # if the second is a 0 we can just replace this with a comma operator
+            if isinstance(expr.right, ExprNumber) and expr.left.value == 0:
+                return ExprComma().add(expr.left).add(ExprNumber(0))
 
-            if len(new_exprs) == 0:
-                return ExprNop()
+        elif expr.op == '||':
+            # We know both
+            if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
+                return ExprNumber(1) if expr.left.value != 0 or expr.right.value != 0 else ExprNumber(0)
 
-            if len(new_exprs) == 1:
-                return new_exprs[0]
+            # Left is constant
+            if isinstance(expr.left, ExprNumber):
+                # if the left is a 0, then we can simply remove it and
+                # return the right expression
+                if expr.left.value == 0:
+                    return expr.right
+
+                # if left is 1, we can ommit the right expression
+                else:
+                    return ExprNumber(1)
+
+            # Right is a const
+            if isinstance(expr.right, ExprNumber):
+                # If the const is 0 then the left will be the one
+                # who says what will happen
+                if expr.right.value == 0:
+                    return expr.left
+
+                # If the const is a 1, then it will always be 1
+                # and we can always run the left
+                else:
+                    return ExprComma().add(expr.left).add(ExprNumber(1))
+
+        else:
+            # The numbers are know and we can calculate them
+            if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
+                folded = fold_binary(expr, self.parser)
+                if folded is not None:
+                    return folded
+
+            # One of the sides is 0
+            if (isinstance(expr.left, ExprNumber) and expr.left.value == 0) or (
+                    isinstance(expr.right, ExprNumber) and expr.right.value == 0):
+                if expr.op == '*':
+                    return ExprNumber(0)
+                elif expr.op == '+':
+                    return expr.right if isinstance(expr.left, ExprNumber) else expr.left
+
+            # Left is 0
+            if isinstance(expr.left, ExprNumber) and expr.left.value == 0:
+                if expr.op == '/':
+                    return ExprNumber(0)
+
+            # right is 0
+            elif isinstance(expr.right, ExprNumber) and expr.right.value == 0:
+                if expr.op == '-':
+                    return expr.left
+
+            # Left is 1
+            if isinstance(expr.left, ExprNumber) and expr.left.value == 1:
+                if expr.op == '*':
+                    return expr.right
+
+            # Right is 1
+            if isinstance(expr.right, ExprNumber) and expr.right.value == 1:
+                if expr.op == '*':
+                    return expr.left
+
+                elif expr.op == '/':
+                    return expr.left
+
+                elif expr.op == '%':
+                    return ExprNumber(0)
+
+        return expr
+
+    def _split_constant(self, expr, op):
+        """
+        Split an operand of a chain of `op` into the non-constant part and the constant part, either
+        can be None. Chains that were already folded keep their constant at the top.
+        """
+        if isinstance(expr, ExprNumber):
+            return None, expr
+        if isinstance(expr, ExprBinary) and expr.op == op:
+            if isinstance(expr.right, ExprNumber):
+                return expr.left, expr.right
+            if isinstance(expr.left, ExprNumber):
+                return expr.right, expr.left
+        return expr, None
+
+    def _reassociate(self, expr: ExprBinary):
+        """
+        Gather the constants of a chain of the same associative operator into a single one at the top
+        of the chain, (a + 1) + (b + 2) turns into (a + b) + 3. Since the children are folded first
+        every chain below already has its constant at the top, so this only looks one level down.
+        """
+        op = expr.op
+        left, left_const = self._split_constant(expr.left, op)
+        right, right_const = self._split_constant(expr.right, op)
+
+        if left_const is None and right_const is None:
+            return expr
 
-            expr = ExprComma().add(new_exprs)
+        # A single constant that is a direct operand already is where it should be
+        if left_const is None and right is None or right_const is None and left is None:
             return expr
 
-        elif isinstance(expr, ExprReturn):
-            expr.expr = self._constant_fold(expr.expr, False)
-
-        elif isinstance(expr, ExprBinary):
-            # TODO: support for multiple expressions in the binary expressions, that will allow
-            #       for better constant folding
-
-            expr.left = self._constant_fold(expr.left, False)
-            expr.right = self._constant_fold(expr.right, False)
-
-            if expr.op == '&&':
-                # We know both
-                if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
-                    return 1 if expr.left.value != 0 and expr.right.value != 0 else 0
-
-                # If we first have 0 we can just return 0
-                if isinstance(expr.left, ExprNumber):
-                    if expr.left.value == 0:
-                        return ExprNumber(0)
-                    else:
-                        return expr.right
-
-                # if the second is a 0 we can just replace this with a comma operator
-                if isinstance(expr.right, ExprNumber) and expr.left.value == 0:
-                    return ExprComma().add(expr.left).add(ExprNumber(0))
-
-            elif expr.op == '||':
-                # We know both
-                if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
-                    return ExprNumber(1) if expr.left.value != 0 or expr.right.value != 0 else ExprNumber(0)
-
-                # Left is constant
-                if isinstance(expr.left, ExprNumber):
-                    # if the left is a 0, then we can simply remove it and
-                    # return the right expression
-                    if expr.left.value == 0:
-                        return expr.right
-
-                    # if left is 1, we can ommit the right expression
-                    else:
-                        return ExprNumber(1)
-
-                # Right is a const
-                if isinstance(expr.right, ExprNumber):
-                    # If the const is 0 then the left will be the one
-                    # who says what will happen
-                    if expr.right.value == 0:
-                        return expr.left
-
-                    # If the const is a 1, then it will always be 1
-                    # and we can always run the left
-                    else:
-                        return ExprComma().add(expr.left).add(ExprNumber(1))
+        # Only native integers wrap the same no matter where they are added
+        for const in (left_const, right_const):
+            if const is not None and const.typ.bits != NATIVE_INTEGER_SIZE:
+                return expr
+
+        if left_const is None:
+            const = right_const
+        elif right_const is None:
+            const = left_const
+        else:
+            const = fold_binary(ExprBinary(left_const, op, right_const), self.parser)
+
+        if left is None:
+            rest = right
+        elif right is None:
+            rest = left
+        else:
+            rest = ExprBinary(left, op, right)
+
+        if rest is None:
+            return const
+
+        identity = _REASSOCIATE[op]
+        if identity is None:
+            identity = const.typ.mask
+        if const.value == identity:
+            return rest
+
+        return ExprBinary(rest, op, const, expr.pos)
+
+    @_constant_fold.register(ExprDeref)
+    def _constant_fold_deref(self, expr, stmt):
+        expr.expr = self._fold(expr.expr, False)
+        expr.invalidate()
+
+        if isinstance(expr.expr, ExprComma):
+            return self._lift(expr.expr, lambda value: self._fold(ExprDeref(value, expr.pos), False))
+
+        # deref an addrof, also through a pointer cast which is how the first field of a struct
+        # variable is read
+        inner = expr.expr
+        if isinstance(inner, ExprCast) and isinstance(inner.expr, ExprAddrof):
+            inner = inner.expr
+        if isinstance(inner, ExprAddrof):
+            return inner.expr
 
+        return expr
+
+    @_constant_fold.register(ExprAddrof)
+    def _constant_fold_addrof(self, expr, stmt):
+        expr.expr = self._fold(expr.expr, False)
+        expr.invalidate()
+        if isinstance(expr.expr, ExprDeref):
+            return expr.expr.expr
+
+        return expr
+
+    @_constant_fold.register(ExprCopy)
+    def _constant_fold_copy(self, expr, stmt):
+        expr.source = self._fold(expr.source, False)
+        expr.destination = self._fold(expr.destination, False)
+        expr.invalidate()
+        # assignment equals to itself and has no side effects, only a variable can be pure so
+        # comparing them is a single check
+        if isinstance(expr.destination, ExprIdent) and expr.source == expr.destination:
+            return expr.destination
+
+        # The statements before the value run before the assignment either way
+        if isinstance(expr.source, ExprComma):
+            return self._lift(expr.source, lambda value: ExprCopy(value, expr.destination, expr.pos))
+
+        return expr
+
+    @_constant_fold.register(ExprLoop)
+    def _constant_fold_loop(self, expr, stmt):
+        expr.cond = self._fold(expr.cond, False)
+        expr.body = self._fold(expr.body, True)
+        expr.invalidate()
+
+        # The loop has a constant 0
+        if isinstance(expr.cond, ExprNumber) and expr.cond.value == 0:
+            return ExprNop()
+
+        return expr
+
+    @_constant_fold.register(ExprIf)
+    def _constant_fold_if(self, expr, stmt):
+        expr.cond = self._fold(expr.cond, False)
+        expr.then = self._fold(expr.then, True)
+        expr.otherwise = self._fold(expr.otherwise, True)
+        expr.invalidate()
+
+        # The condition is known, only one of the branches can run
+        if isinstance(expr.cond, ExprNumber):
+            if expr.cond.value != 0:
+                return expr.then
             else:
-                # The numbers are know and we can calculate them
-                if isinstance(expr.left, ExprNumber) and isinstance(expr.right, ExprNumber):
-                    return ExprNumber(int(eval(f'{expr.left} {expr.op} {expr.right}')))
-
-                # One of the sides is 0
-                elif (isinstance(expr.left, ExprNumber) and expr.left.value == 0) or (
-                        isinstance(expr.right, ExprNumber) and expr.right.value == 0):
-                    if expr.op == '*':
-                        return ExprNumber(0)
-                    elif expr.op == '+':
-                        return expr.right if isinstance(expr.left, ExprNumber) else expr.left
-
-                # Left is 0
-                if isinstance(expr.left, ExprNumber) and expr.left.value == 0:
-                    if expr.op == '/':
-                        return ExprNumber(0)
-
-                # right is 0
-                elif isinstance(expr.right, ExprNumber) and expr.right.value == 0:
-                    if expr.op == '-':
-                        return expr.left
-
-                # Left is 1
-                if isinstance(expr.left, ExprNumber) and expr.left.value == 1:
-                    if expr.op == '*':
-                        return expr.right
-
-                # Right is 1
-                if isinstance(expr.right, ExprNumber) and expr.right.value == 1:
-                    if expr.op == '*':
-                        return expr.left
-
-                    elif expr.op == '/':
-                        return expr.left
-
-                    elif expr.op == '%':
-                        return ExprNumber(0)
-
-        elif isinstance(expr, ExprDeref):
-            expr.expr = self._constant_fold(expr.expr, False)
-            # deref an addrof
-            if isinstance(expr.expr, ExprAddrof):
-                return expr.expr.expr
-
-        elif isinstance(expr, ExprAddrof):
-            expr.expr = self._constant_fold(expr.expr, False)
-            if isinstance(expr.expr, ExprDeref):
-                return expr.expr.expr
-
-        elif isinstance(expr, ExprCopy):
-            expr.source = self._constant_fold(expr.source, False)
-            expr.destination = self._constant_fold(expr.destination, False)
-            # assignment equals to itself and has no side effects
-            if expr.source == expr.destination and expr.source.is_pure(self):
-                return expr.destination
-
-        elif isinstance(expr, ExprLoop):
-            expr.cond = self._constant_fold(expr.cond, False)
-            expr.body = self._constant_fold(expr.body, True)
-
-            # The loop has a constant 0
-            if isinstance(expr.cond, ExprNumber) and expr.cond.value == 0:
-                return ExprNop()
-
-        elif isinstance(expr, ExprCast):
-            expr = self._constant_fold(expr.expr, False)
+                return expr.otherwise
 
         return expr
 
-    def optimize(self):
-        last = str(self)
+    @_constant_fold.register(ExprSwitch)
+    def _constant_fold_switch(self, expr, stmt):
+        expr.expr = self._fold(expr.expr, False)
+        expr.body = self._fold(expr.body, True)
+        expr.invalidate()
+
+        if isinstance(expr.expr, ExprComma):
+            return self._lift(expr.expr, lambda value: ExprSwitch(value, expr.body, expr.pos))
 
+        return expr
+
+    @_constant_fold.register(ExprCall)
+    def _constant_fold_call(self, expr, stmt):
+        expr.args = [self._fold(arg, False) for arg in expr.args]
+        expr.invalidate()
+
+        # A pure function called with known arguments can be run right now
+        if isinstance(expr.func, ExprIdent) and isinstance(expr.func.ident, FunctionIdentifier):
+            if all(isinstance(arg, ExprNumber) for arg in expr.args):
+                value = self.evaluator.call(expr.func.ident.index, expr.args)
+                if value is not None:
+                    return value
+
+        return expr
+
+    @_constant_fold.register(ExprCast)
+    def _constant_fold_cast(self, expr, stmt):
+        expr.expr = self._fold(expr.expr, False)
+        expr.invalidate()
+
+        if isinstance(expr.expr, ExprComma):
+            return self._lift(expr.expr, lambda value: self._fold(ExprCast(value, expr.typ, expr.pos), False))
+
+        # A number takes the width and signedness it is cast to right away
+        if isinstance(expr.expr, ExprNumber) and isinstance(expr.typ, CInteger):
+            return convert_number(expr.expr, expr.typ)
+
+        # Casting to the type it already has does nothing, any other cast is kept for its type
+        if expr.expr.resolve_type(self.parser) is expr.typ:
+            return expr.expr
+
+        return expr
+
+    def optimize(self):
         for f in self.parser.global_vars:
             if f.value is not None:
-                f.value = self._constant_fold(f.value, False).value
+                value = self._constant_fold(f.value, False)
+                # A pointer initialized with a number keeps the cast to the pointer type
+                while isinstance(value, ExprCast):
+                    value = value.expr
+                f.value = value.value
 
+        self.call_graph = CallGraph(self.parser)
         self._find_pure_functions()
+        self._fold_functions(range(len(self.parser.func_list)))
+
+        # Inlining is done on folded functions so their size is known, and the callers that got
+        # something inlined are folded again with the arguments in place of the parameters
+        if self.inline_limit > 0:
+            inlined = Inliner(self.parser, self.call_graph, self.inline_limit).inline()
+            self._fold_functions(inlined)
+
+        self._remove_unused()
+        self._eliminate_common_subexpressions()
+
+    def _remove_unused(self):
+        """
+        Mark the static functions and globals that nothing uses anymore so they are not emitted, the
+        functions are rescanned first since folding can drop calls without updating the call graph
+        """
+        func_list = self.parser.func_list
+        if all(f.storage_decl != StorageClass.STATIC for f in func_list):
+            if all(var.storage != StorageClass.STATIC for var in self.parser.global_vars):
+                return
+
+        for i in range(len(func_list)):
+            self.call_graph.update(i)
+        self.call_graph.find_used()
+
+    def _eliminate_common_subexpressions(self):
+        """
+        Done last since the temporaries it adds would only get in the way of folding and inlining
+        """
+        cse = CommonSubexpressions(self.parser)
         for f in self.parser.func_list:
-            f.code = self._constant_fold(f.code, True)
-
-        while str(self) != last:
-            last = str(self)
+            if f.code is not None and f.used:
+                cse.eliminate(f)
+
+    def _fold_functions(self, worklist):
+        """
+        Fold the given functions until nothing changes. Folding works bottom up so a single pass
+        over a function already folds everything it can, what may allow for more folding is a callee
+        becoming pure once its own side effects were folded away, so after the first pass only the
+        callers of those are folded again.
+        """
+        func_list = self.parser.func_list
+        while len(worklist) != 0:
+            lost_effects = False
+            for i in worklist:
+                if self._fold_function(func_list[i]):
+                    self.call_graph.update(i)
+                    lost_effects = True
+
+            if not lost_effects:
+                break
+
+            purity = [f.pure for f in func_list]
             self._find_pure_functions()
-            for f in self.parser.func_list:
-                f.code = self._constant_fold(f.code, True)
+            self.evaluator.forget_failures()
+
+            worklist = set()
+            for i, f in enumerate(func_list):
+                if purity[i] != f.pure:
+                    worklist.update(self.call_graph.callers(i))
+            worklist = sorted(worklist)
@@ -1,5 +1,34 @@
 from .tokenizer import *
 from .ast import *
+from .evaluator import Evaluator
+import itertools
+
+
+# The builtin integer types, the words may be written in any order
+_BUILTIN_TYPES = [
+    (['char'], CInteger(8, True)),
+    (['signed', 'char'], CInteger(8, True)),
+    (['unsigned', 'char'], CInteger(8, False)),
+    (['short'], CInteger(16, True)),
+    (['signed', 'short'], CInteger(16, True)),
+    (['unsigned', 'short'], CInteger(16, False)),
+    (['int'], CInteger(16, True)),
+    (['signed', 'int'], CInteger(16, True)),
+    (['signed'], CInteger(16, True)),
+    (['unsigned', 'int'], CInteger(16, False)),
+    (['unsigned'], CInteger(16, False)),
+    (['long'], CInteger(32, True)),
+    (['signed', 'long'], CInteger(32, True)),
+    (['unsigned', 'long'], CInteger(32, False)),
+]
+
+# Canonical keys for every spelling of the builtin types, so the common case does not need to sort
+_BUILTIN_TYPE_KEYS = {}
+for _words, _ in _BUILTIN_TYPES:
+    for _perm in itertools.permutations(_words):
+        _BUILTIN_TYPE_KEYS[_perm] = ' '.join(_words)
+
+_INTEGER_WORDS = frozenset(['unsigned', 'signed', 'int', 'short', 'char', 'long'])
 
 
 class Parser(Tokenizer):
@@ -7,8 +36,17 @@ class Parser(Tokenizer):
     class Scope:
 
         def __init__(self):
+            # What was defined in this scope, popped from the symbol table with the scope
             self.idents = {}  # type: Dict[str, Identifier]
-            self.type_defs = {}  # type: Dict[Tuple[str], CType]
+            self.type_defs = {}  # type: Dict[str, CType]
+
+    class Switch:
+
+        def __init__(self, typ: CInteger):
+            # The type the case values are converted to, and the values used so far
+            self.typ = typ
+            self.values = set()  # type: Set[int]
+            self.has_default = False
 
     def __init__(self, stream: str, filename: str = '<unknown>'):
         super().__init__(stream, filename)
@@ -17,25 +55,18 @@ class Parser(Tokenizer):
         self.global_vars: List[Variable] = []
         self.func: Function = None
 
+        # The symbol table, every name maps to a stack of its definitions with the innermost last
+        self._idents: Dict[str, List[Identifier]] = {}
+        self._type_defs: Dict[str, List[CType]] = {}
+
         # Setup the global scope with all the default types
         self._push_scope()
-        self._add_typedef(['char'], CInteger(8, True))
-        self._add_typedef(['signed', 'char'], CInteger(8, True))
-        self._add_typedef(['unsigned', 'char'], CInteger(8, False))
-        self._add_typedef(['short'], CInteger(16, True))
-        self._add_typedef(['signed', 'short'], CInteger(16, True))
-        self._add_typedef(['unsigned', 'short'], CInteger(16, False))
-        self._add_typedef(['int'], CInteger(16, True))
-        self._add_typedef(['signed', 'int'], CInteger(16, True))
-        self._add_typedef(['signed'], CInteger(16, True))
-        self._add_typedef(['unsigned', 'int'], CInteger(16, False))
-        self._add_typedef(['unsigned'], CInteger(16, False))
-        self._add_typedef(['long'], CInteger(32, True))
-        self._add_typedef(['signed', 'long'], CInteger(32, True))
-        self._add_typedef(['unsigned', 'long'], CInteger(32, False))
+        for words, typ in _BUILTIN_TYPES:
+            self._add_typedef(words, typ)
 
         self._temp_counter = 0
         self._loop_nesting = 0
+        self._switch_nesting = 0
         self.got_errors = False
 
         # Start the parsing
@@ -46,9 +77,10 @@ class Parser(Tokenizer):
     ####################################################################################################################
 
     def _define(self, name: str, ident: Identifier) -> ExprIdent:
-        if self._use(name) is not None:
+        if name in self._idents:
             return None
         self._scopes[-1].idents[name] = ident
+        self._idents.setdefault(name, []).append(ident)
         return ExprIdent(ident)
 
     def _def_var(self, name: str, typ: CType, storage: StorageClass) -> ExprIdent:
@@ -89,43 +121,32 @@ class Parser(Tokenizer):
         return ret
 
     def _use(self, name: str) -> ExprIdent:
-        for scope in reversed(self._scopes):
-            if name in scope.idents:
-                return ExprIdent(scope.idents[name])
-        return None
-
-    def _resolve_type(self, name: List[str] or str or Tuple[str]) -> CType:
-        # Turn to array if needed
-        if name is str:
-            name = [name]
-
-        # Normalize
-        n = list(name)
-        n.sort()
-        n = tuple(n)
+        stack = self._idents.get(name)
+        if stack is None:
+            return None
+        return ExprIdent(stack[-1])
 
-        # Search for it
-        for scope in reversed(self._scopes):
-            if n in scope.type_defs:
-                return scope.type_defs[n]
+    @staticmethod
+    def _type_key(name: List[str] or str or Tuple[str]) -> str:
+        # A typedef name is a single identifier and is its own key
+        if isinstance(name, str):
+            return name
+
+        # Multiple words, the order does not matter
+        name = tuple(name)
+        key = _BUILTIN_TYPE_KEYS.get(name)
+        if key is None:
+            key = ' '.join(sorted(name))
+        return key
 
-        return None
+    def _resolve_type(self, name: List[str] or str or Tuple[str]) -> CType:
+        stack = self._type_defs.get(self._type_key(name))
+        if stack is None:
+            return None
+        return stack[-1]
 
     def _type_in_scope(self, name: List[str] or str or Tuple[str]):
-        # Turn to array if needed
-        if name is str:
-            name = [name]
-
-        # Normalize
-        n = list(name)
-        n.sort()
-        n = tuple(n)
-
-        # search for it in the current scope
-        if n in self._scopes[-1].type_defs:
-            return self._scopes[-1].type_defs[n]
-
-        return None
+        return self._scopes[-1].type_defs.get(self._type_key(name))
 
     def _add_function(self, name: str, typ: CType):
         self.func = Function(name)
@@ -134,16 +155,33 @@ class Parser(Tokenizer):
         self.func.prototype = False
         self.func_list.append(self.func)
 
-    def _add_typedef(self, name: List[str], typ: CType):
-        nlst = list(name)
-        nlst.sort()
-        self._scopes[-1].type_defs[tuple(nlst)] = typ
+    def _add_typedef(self, name: List[str] or str, typ: CType):
+        key = self._type_key(name)
+        scope = self._scopes[-1]
+        if key in scope.type_defs:
+            # Replace the definition from this scope
+            self._type_defs[key][-1] = typ
+        else:
+            self._type_defs.setdefault(key, []).append(typ)
+        scope.type_defs[key] = typ
 
     def _push_scope(self):
         self._scopes.append(Parser.Scope())
 
     def _pop_scope(self):
-        self._scopes.pop()
+        scope = self._scopes.pop()
+
+        for name in scope.idents:
+            stack = self._idents[name]
+            stack.pop()
+            if len(stack) == 0:
+                del self._idents[name]
+
+        for key in scope.type_defs:
+            stack = self._type_defs[key]
+            stack.pop()
+            if len(stack) == 0:
+                del self._type_defs[key]
 
     @staticmethod
     def _combine_pos(pos1: CodePosition, pos2: CodePosition):
@@ -294,8 +332,9 @@ class Parser(Tokenizer):
         else:
             self.report_fatal_error(f'expected expression before {self.token}')
 
-    def _parse_postfix(self):
-        x = self._parse_literal()
+    def _parse_postfix(self, x: Expr = None):
+        if x is None:
+            x = self._parse_literal()
 
         while True:
 
@@ -419,8 +458,7 @@ class Parser(Tokenizer):
         if self.match_token('&'):
             e = self._parse_prefix()
             if not self._is_lvalue(e):
-                self.token.pos = pos
-                self.report_error('lvalue required asm unary `&` operand')
+                self.report_error('lvalue required asm unary `&` operand', pos)
             return ExprAddrof(e, self._combine_pos(pos, e.pos))
 
         elif self.match_token('*'):
@@ -446,7 +484,11 @@ class Parser(Tokenizer):
             pos = self._combine_pos(pos, e.pos)
             if not isinstance(typ, CInteger):
                 self.report_error(f'invalid type argument of unary `~` (have `{typ}`)', pos)
-            return ExprBinary(e, '^', ExprNumber(0xFFFF))
+                typ = CInteger(16, True)
+            elif typ.bits < NATIVE_INTEGER_SIZE:
+                # The operand is promoted to an int before its bits are flipped
+                typ = CInteger(NATIVE_INTEGER_SIZE, True)
+            return ExprBinary(e, '^', ExprNumber(typ.mask, typ))
 
         elif self.match_token('!'):
             e = self._parse_prefix()
@@ -476,7 +518,7 @@ class Parser(Tokenizer):
         # Size-of
         elif self.match_keyword('sizeof'):
             xtype = self._parse_prefix().resolve_type(self).sizeof()
-            return ExprNumber(xtype, self._combine_pos(pos, self.token.pos))
+            return ExprNumber(xtype, CInteger(16, False), self._combine_pos(pos, self.token.pos))
 
         # Type cast
         elif self.is_token('('):
@@ -485,131 +527,110 @@ class Parser(Tokenizer):
             typ = self._parse_type(False)
             if typ is not None:
                 self.discard()
-                typ = self._parse_type_prefix(typ)
-                self.expect_token(')')
-                # TODO: check the cast is actually doable
-                # TODO: Compound literal
-                return ExprCast(self._parse_prefix(), typ)
+                return self._parse_cast(typ, pos)
             else:
                 self.restore()
 
         return self._parse_postfix()
 
-    def _parse_multiplicative(self):
-        e1 = self._parse_prefix()
-        while self.is_token('*') or self.is_token('/') or self.is_token('%'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_prefix()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+    def _parse_cast(self, typ: CType, pos):
+        typ = self._parse_type_prefix(typ)
+        self.expect_token(')')
+        # TODO: check the cast is actually doable
+        # TODO: Compound literal
+        x = self._parse_prefix()
+        return ExprCast(x, typ, self._combine_pos(pos, x.pos))
+
+    # Precedence of the binary operators, higher binds tighter, all of them are left associative
+    BINARY_PRECEDENCE = {
+        '*': 10, '/': 10, '%': 10,
+        '+': 9, '-': 9,
+        '<<': 8, '>>': 8,
+        # TODO: relational operators
+        '==': 6, '!=': 6,
+        '&': 5,
+        '^': 4,
+        '|': 3,
+        '&&': 2,
+        '||': 1,
+    }
+
+    def _reduce_binary(self, operands: List[Expr], op: str, pos: CodePosition):
+        e2 = operands.pop()
+        e1 = operands.pop()
+        self._check_binary_op(op, pos, e1, e2)
+        if op == '!=':
+            operands.append(ExprBinary(ExprBinary(e1, '==', e2), '==', ExprNumber(0), self._combine_pos(e1.pos, e2.pos)))
+        else:
+            operands.append(ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos)))
 
-    def _parse_additive(self):
-        e1 = self._parse_multiplicative()
-        while self.is_token('+') or self.is_token('-'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_multiplicative()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+    def _parse_binary(self):
+        """
+        Precedence climbing over all the binary operators, using an explicit operand and operator stack.
 
-    def _parse_shift(self):
-        e1 = self._parse_additive()
-        while self.is_token('>>') or self.is_token('<<'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_additive()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+        Parenthesized sub expressions push a marker on the operator stack instead of recursing, so
+        deeply nested expressions do not use more python frames, anything other than a binary expression inside
+        the parens (conditional, assignment, comma) falls back to the recursive parser for that part.
+        """
+        operands = []
+        operators = []  # (op, pos, precedence), None marks an open paren
+        depth = 0
 
-    def _parse_relational(self):
-        # e1 = self._parse_shift()
-        # while self.is_token('<') or self.is_token('>') or self.is_token('>=') or self.is_token('<='):
-        #     op = self.token
-        #     self.next_token()
-        #     e2 = self._parse_shift()
-        #     self._check_binary_op(op, e1, e2)
-        #     e1 = ExprBinary(self._expand_pos(e1.pos, self.token.pos), e1, op.value, e2)
-        # return e1
-        return self._parse_shift()
-
-    def _parse_equality(self):
-        e1 = self._parse_relational()
-        while self.is_token('==') or self.is_token('!='):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_relational()
-            self._check_binary_op(op, pos, e1, e2)
-            if op == '==':
-                e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-            else:
-                e1 = ExprBinary(ExprBinary(e1, '==', e2), '==', ExprNumber(0), self._combine_pos(e1.pos, e2.pos))
-        return e1
+        while True:
+            # Open parens or a cast
+            x = None
+            while self.is_token('('):
+                pos = self.token.pos
+                self.save()
+                self.next_token()
+                typ = self._parse_type(False)
+                if typ is not None:
+                    self.discard()
+                    x = self._parse_cast(typ, pos)
+                    break
+                self.restore()
+                self.next_token()
+                operators.append(None)
+                depth += 1
 
-    def _parse_bitwise_and(self):
-        e1 = self._parse_equality()
-        while self.is_token('&'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_equality()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+            if x is None:
+                x = self._parse_prefix()
+            operands.append(x)
 
-    def _parse_bitwise_xor(self):
-        e1 = self._parse_equality()
-        while self.is_token('^'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_equality()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+            while True:
+                prec = None
+                if self.is_token(SymbolToken):
+                    prec = Parser.BINARY_PRECEDENCE.get(self.token.value)
+
+                if prec is not None:
+                    # Reduce everything that binds tighter or the same, then parse the right operand
+                    while len(operators) != 0 and operators[-1] is not None and operators[-1][2] >= prec:
+                        op, pos, _ = operators.pop()
+                        self._reduce_binary(operands, op, pos)
+                    operators.append((self.token.value, self.token.pos, prec))
+                    self.next_token()
+                    break
 
-    def _parse_bitwise_or(self):
-        e1 = self._parse_equality()
-        while self.is_token('|'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_equality()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+                # Reduce up to the innermost open paren (or everything)
+                while len(operators) != 0 and operators[-1] is not None:
+                    op, pos, _ = operators.pop()
+                    self._reduce_binary(operands, op, pos)
 
-    def _parse_logical_and(self):
-        e1 = self._parse_bitwise_or()
-        while self.is_token('&&'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_bitwise_or()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+                if depth == 0:
+                    return operands.pop()
 
-    def _parse_logical_or(self):
-        e1 = self._parse_logical_and()
-        while self.is_token('||'):
-            pos = self.token.pos
-            op = self.token.value
-            self.next_token()
-            e2 = self._parse_logical_and()
-            self._check_binary_op(op, pos, e1, e2)
-            e1 = ExprBinary(e1, op, e2, self._combine_pos(e1.pos, e2.pos))
-        return e1
+                # Close the paren
+                x = operands.pop()
+                if not self.is_token(')'):
+                    x = self._parse_expr(x)
+                self.expect_token(')')
+                operators.pop()
+                depth -= 1
+                operands.append(self._parse_postfix(x))
 
-    def _parse_conditional(self):
-        x = self._parse_logical_or()
+    def _parse_conditional(self, x: Expr = None):
+        if x is None:
+            x = self._parse_binary()
 
         if self.match_token('?'):
             y = self._parse_conditional()
@@ -630,8 +651,8 @@ class Parser(Tokenizer):
 
         return x
 
-    def _parse_assignment(self):
-        x = self._parse_conditional()
+    def _parse_assignment(self, x: Expr = None):
+        x = self._parse_conditional(x)
 
         if self.is_token('=') or self.is_token('+=') or self.is_token('-=') or self.is_token('*=') or \
                 self.is_token('/=') or self.is_token('%=') or self.is_token('>>=') or self.is_token('<<=') or \
@@ -659,8 +680,8 @@ class Parser(Tokenizer):
 
         return x
 
-    def _parse_comma(self):
-        e1 = self._parse_assignment()
+    def _parse_comma(self, e1: Expr = None):
+        e1 = self._parse_assignment(e1)
 
         # Turn into a comma if has stuff
         if self.is_token(','):
@@ -671,8 +692,8 @@ class Parser(Tokenizer):
 
         return e1
 
-    def _parse_expr(self):
-        return self._parse_comma()
+    def _parse_expr(self, x: Expr = None):
+        return self._parse_comma(x)
 
     ####################################################################################################################
     # Type parsing
@@ -699,13 +720,21 @@ class Parser(Tokenizer):
                 break
         return spec
 
+    def _parse_function_specs(self, spec, inline):
+        # On the top level `inline` can be mixed with the storage classes
+        while True:
+            spec = self._parse_storage_decl(spec)
+            if not self.match_keyword('inline'):
+                return spec, inline
+            inline = True
+
     def _parse_type(self, raise_error):
         typ = None
         pos = self.token.pos
 
         # See if any of these
         words = []
-        while self.is_keyword('unsigned') or self.is_keyword('signed') or self.is_keyword('int') or self.is_keyword('short') or self.is_keyword('char') or self.is_keyword('long'):
+        while self.is_token(KeywordToken) and self.token.value in _INTEGER_WORDS:
             words.append(self.token.value)
             self.next_token()
 
@@ -746,6 +775,8 @@ class Parser(Tokenizer):
                         # expect this
                         self.expect_token(',')
 
+                typ.freeze()
+
                 if not self._type_in_scope([name_prefix, name]):
                     # If type is not defined in the current scope add it to the current scope
                     self._add_typedef([name_prefix, name], typ)
@@ -777,8 +808,7 @@ class Parser(Tokenizer):
                 return self._resolve_type(name)
 
             if raise_error:
-                self.token.pos = pos
-                self.report_fatal_error(f'unknown type name `{name}`')
+                self.report_fatal_error(f'unknown type name `{name}`', pos)
             else:
                 return None
         else:
@@ -840,6 +870,41 @@ class Parser(Tokenizer):
             block.add(self._parse_stmt())
         return block
 
+    def _parse_switch_block(self, switch: Switch):
+        block = ExprComma()
+        while not self.match_token('}'):
+            while self.is_keyword('case') or self.is_keyword('default'):
+                block.add(self._parse_case(switch))
+            block.add(self._parse_stmt())
+        return block
+
+    def _parse_case(self, switch: Switch):
+        pos = self.token.pos
+
+        if self.match_keyword('default'):
+            self.expect_token(':')
+            if switch.has_default:
+                self.report_error('multiple default labels in one switch', pos)
+            switch.has_default = True
+            return ExprCase(None, pos)
+
+        self.expect_keyword('case')
+        x = self._parse_conditional()
+        self.expect_token(':')
+
+        value = Evaluator(self).constant(x)
+        if value is None:
+            self.report_error('case label does not reduce to an integer constant', x.pos)
+            return ExprNop()
+
+        value = switch.typ.value_of(value.value)
+        if value in switch.values:
+            self.report_error('duplicate case value', x.pos)
+            return ExprNop()
+        switch.values.add(value)
+
+        return ExprCase(value, self._combine_pos(pos, x.pos))
+
     def _parse_stmt(self):
         pos = self.token.pos
 
@@ -851,13 +916,12 @@ class Parser(Tokenizer):
 
             if self.match_keyword('else'):
                 z = self._parse_stmt()
-                return ExprComma(self._combine_pos(x.pos, z.pos))\
-                    .add(ExprBinary(ExprBinary(x, '&&', ExprComma().add(y).add(ExprNumber(1))), '||', z))
+                return ExprIf(x, y, z, self._combine_pos(x.pos, z.pos))
             else:
-                return ExprBinary(x, "&&", y)
+                return ExprIf(x, y, pos=pos)
 
         elif self.match_keyword('break'):
-            if self._loop_nesting == 0:
+            if self._loop_nesting == 0 and self._switch_nesting == 0:
                 self.report_error('break statement not within loop or switch', pos)
 
             e = ExprBreak(pos)
@@ -896,7 +960,32 @@ class Parser(Tokenizer):
             pass
 
         elif self.match_keyword('switch'):
-            assert False
+            self.expect_token('(')
+            x = self._parse_expr()
+            self.expect_token(')')
+
+            typ = x.resolve_type(self)
+            if not isinstance(typ, CInteger):
+                self.report_error('switch quantity not an integer', x.pos)
+                typ = CInteger(16, True)
+
+            self._switch_nesting += 1
+            if self.match_token('{'):
+                body = self._parse_switch_block(Parser.Switch(typ))
+            else:
+                body = self._parse_stmt()
+            self._switch_nesting -= 1
+            return ExprSwitch(x, body, self._combine_pos(pos, body.pos))
+
+        elif self.is_keyword('case') or self.is_keyword('default'):
+            # Jumping into the middle of another statement is not supported, the labels of a switch
+            # must be directly in its block
+            if self._switch_nesting == 0:
+                self.report_error(f'`{self.token.value}` label not within a switch statement', pos)
+            else:
+                self.report_error(f'`{self.token.value}` label inside a nested statement is not supported', pos)
+            self._parse_case(Parser.Switch(CInteger(16, True)))
+            return self._parse_stmt()
 
         elif self.match_keyword('return'):
             stmt = ExprReturn(ExprNop())
@@ -1056,12 +1145,47 @@ class Parser(Tokenizer):
 
         self._pop_scope()
 
-    def _parse_global_variable(self, typ: CType, storage: StorageClass):
-        storage = self._parse_storage_decl(storage)
+    def _parse_callconv(self):
+        if self.match_keyword('__stackcall'):
+            return CallConv.STACKCALL
+        elif self.match_keyword('__regcall'):
+            return CallConv.REGCALL
+        elif self.match_keyword('__interrupt'):
+            return CallConv.INTERRUPT
+        return None
 
-        def parse_one_variable(typ):
-            typ = self._parse_type_prefix(typ)
-            name, name_pos = self.expect_ident()
+    def _parse_function(self, ret_typ: CType, callconv: CallConv, name: str, name_pos: CodePosition, storage_class: StorageClass, inline: bool):
+        if storage_class == StorageClass.REGISTER:
+            self.report_error(f'function definition declared `register`', name_pos)
+
+        if isinstance(ret_typ, CArray):
+            self.report_error(f'`{name}` declared asm function returning an array', name_pos)
+
+        e = self._def_fun(name)
+        if e is not None:
+            self._add_function(name, ret_typ)
+            self.func = self.func_list[e.ident.index]
+        else:
+            if self.func is not None and self.func.type.ret_type != ret_typ:
+                self.report_fatal_error(f'conflicting types for `{self.func.name}`', name_pos, False)
+            self.func = self.func_list[self._use(name).ident.index]
+
+        # Handle setting the calling conv
+        if self.func.type.callconv is None:
+            self.func.type.callconv = callconv
+        elif callconv is not None:
+            assert callconv == self.func.type.callconv
+
+        self.func.storage_decl = storage_class
+        if inline:
+            self.func.inline = True
+
+        self._parse_func(name_pos, e is None)
+
+        self.func = None
+
+    def _parse_global_variable(self, typ: CType, decl_typ: CType, storage: StorageClass, name: str, name_pos: CodePosition):
+        def parse_one_variable(typ, name, name_pos):
             typ = self._parse_type_postfix(typ, name_pos)
 
             if self.match_token('='):
@@ -1079,9 +1203,12 @@ class Parser(Tokenizer):
                 self.report_error(f'redefinition of {name}', name_pos)
             self.global_vars[expr.ident.index].value = new_value
 
-        parse_one_variable(typ)
+        # The prefix and name of the first variable were already parsed
+        parse_one_variable(decl_typ, name, name_pos)
         while self.match_token(','):
-            parse_one_variable(typ)
+            cur_typ = self._parse_type_prefix(typ)
+            name, name_pos = self.expect_ident()
+            parse_one_variable(cur_typ, name, name_pos)
 
         self.expect_token(';')
 
@@ -1104,64 +1231,30 @@ class Parser(Tokenizer):
 
             # Either a global or a function
             else:
-                storage_class = self._parse_storage_decl(StorageClass.AUTO)
-
-                # We are gonna check if this is a variable or function
-                # if we get a `=` or `;` before a `(`, it is a variable
-                func = False
-                self.save()
-                while not self.is_token('=') and not self.is_token(';'):
-                    if self.is_token('('):
-                        func = True
-                        break
-                    self.next_token()
-                self.restore()
-
-                # Now that we know what this is we can parse it normally
-                if func:
-                    ret_typ = self._parse_type(True)
-                    ret_typ = self._parse_type_prefix(ret_typ)
-
-                    # Parse the calling convention
-                    callconv = CallConv.STACKCALL
-                    if self.match_keyword('__stackcall'):
-                        callconv = CallConv.STACKCALL
-                    elif self.match_keyword('__regcall'):
-                        callconv = CallConv.REGCALL
-                    elif self.match_keyword('__interrupt'):
-                        callconv = CallConv.INTERRUPT
-
-                    name, name_pos = self.expect_ident()
-
-                    if storage_class == StorageClass.REGISTER:
-                        self.report_error(f'function definition declared `register`', name_pos)
-
-                    if isinstance(ret_typ, CArray):
-                        self.report_error(f'`{name}` declared asm function returning an array', name_pos)
-
-                    e = self._def_fun(name)
-                    if e is not None:
-                        self._add_function(name, ret_typ)
-                        self.func = self.func_list[e.ident.index]
-                    else:
-                        if self.func is not None and self.func.type.ret_type != ret_typ:
-                            self.report_fatal_error(f'conflicting types for `{self.func.name}`', name_pos, False)
-                        self.func = self.func_list[self._use(name).ident.index]
+                storage_class, inline = self._parse_function_specs(StorageClass.AUTO, False)
+                typ = self._parse_type(True)
 
-                    # Handle setting the calling conv
-                    if self.func.type.callconv is None:
-                        self.func.type.callconv = callconv
-                    elif callconv is not None:
-                        assert callconv == self.func.type.callconv
+                # Only declared a type (`struct a { ... };`)
+                if self.match_token(';'):
+                    continue
 
-                    self.func.storage_decl = storage_class
+                storage_class, inline = self._parse_function_specs(storage_class, inline)
 
-                    self._parse_func(name_pos, e is None)
+                # Parse the declarator once, after the name a `(` means this
+                # is a function and anything else means it is a variable
+                decl_typ = self._parse_type_prefix(typ)
+                callconv_pos = self.token.pos
+                callconv = self._parse_callconv()
+                name, name_pos = self.expect_ident()
 
-                    self.func = None
+                if self.is_token('('):
+                    if callconv is None:
+                        callconv = CallConv.STACKCALL
+                    self._parse_function(decl_typ, callconv, name, name_pos, storage_class, inline)
 
                 else:
-                    typ = self._parse_type(True)
-
-                    if not self.match_token(';'):
-                        self._parse_global_variable(typ, storage_class)
\ No newline at end of file
+                    if callconv is not None:
+                        self.report_error(f'calling convention specified for variable `{name}`', callconv_pos)
+                    if inline:
+                        self.report_error(f'variable `{name}` declared `inline`', name_pos)
+                    self._parse_global_variable(typ, decl_typ, storage_class, name, name_pos)
@@ -1,7 +1,8 @@
 from enum import Enum
-from typing import Tuple
+from typing import Tuple, List
 import traceback
 import sys
+import re
 
 
 class UnknownCharacter(Exception):
@@ -10,6 +11,8 @@ class UnknownCharacter(Exception):
 
 class CodePosition:
 
+    __slots__ = ('start_line', 'end_line', 'start_column', 'end_column')
+
     def __init__(self, start_line, end_line, start_column, end_column):
         self.start_line = start_line
         self.end_line = end_line
@@ -19,6 +22,8 @@ class CodePosition:
 
 class Token:
 
+    __slots__ = ('pos',)
+
     def __init__(self, pos: CodePosition):
         self.pos = pos
 
@@ -28,6 +33,8 @@ class Token:
 
 class EofToken(Token):
 
+    __slots__ = ()
+
     def __init__(self, pos: CodePosition):
         super(EofToken, self).__init__(pos)
 
@@ -40,6 +47,8 @@ class EofToken(Token):
 
 class IntToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: int):
         super(IntToken, self).__init__(pos)
         self.value = value
@@ -53,6 +62,8 @@ class IntToken(Token):
 
 class FloatToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: float):
         super(FloatToken, self).__init__(pos)
         self.value = value
@@ -66,6 +77,8 @@ class FloatToken(Token):
 
 class IdentToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: str):
         super(IdentToken, self).__init__(pos)
         self.value = value
@@ -79,6 +92,8 @@ class IdentToken(Token):
 
 class KeywordToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: str):
         super(KeywordToken, self).__init__(pos)
         self.value = value
@@ -92,6 +107,8 @@ class KeywordToken(Token):
 
 class SymbolToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: str):
         super(SymbolToken, self).__init__(pos)
         self.value = value
@@ -105,6 +122,8 @@ class SymbolToken(Token):
 
 class StringToken(Token):
 
+    __slots__ = ('value',)
+
     def __init__(self, pos: CodePosition, value: str):
         super(StringToken, self).__init__(pos)
         self.value = value
@@ -116,16 +135,100 @@ class StringToken(Token):
         return f'<StringToken: value={repr(self.value)}>'
 
 
+_KEYWORDS = frozenset([
+    'if',
+    'else',
+    'do',
+    'while',
+    'for',
+    'return',
+    'goto',
+    'break',
+    'continue',
+    'switch',
+    'case',
+    'default',
+
+    'void',
+    'char',
+    'signed',
+    'unsigned',
+    'short',
+    'int',
+    'long',
+    'float',
+    'double',
+
+    'struct',
+    'enum',
+    'union',
+    'typedef',
+
+    'volatile',
+    'register',
+    'static',
+    'const',
+    'inline',
+    'extern',
+
+    'sizeof',
+    'asm',
+
+    '__regcall',
+    '__stackcall',
+    '__interrupt'
+])
+
+_ESCAPES = {
+    'a': '\a',
+    'b': '\b',
+    'e': '\x1b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+    '\\': '\\',
+    '\'': '\'',
+    '"': '"',
+    '?': '?',
+}
+
+# Runs of characters, all of these are matched at the current offset of the tokenizer
+_WHITESPACE = re.compile(r'\s+')
+_IDENT = re.compile(r'\w+')
+_DEC_DIGITS = re.compile(r'[0-9]*')
+_HEX_DIGITS = re.compile(r'[0-9a-fA-F]*')
+_OCT_DIGITS = re.compile(r'[0-7]*')
+_BIN_DIGITS = re.compile(r'[01]*')
+_STRING_CHARS = re.compile(r'[^"\\]+')
+
+# Symbols, longest first so the alternation always takes the longest match
+_SYMBOL = re.compile(
+    r'>>=|<<='
+    r'|<<|>>|&&|\|\||!=|==|<=|>=|\+=|-=|\*=|/=|%=|&=|\|=|\^=|\+\+|--|->'
+    r'|[()\[\]{};,.:/*\-+!%&<>=~^|?#]'
+)
+
+
 class Tokenizer:
 
     def __init__(self, stream: str, filename: str = "<unknown>"):
+        # The stream is never modified, we only move the offset forward
         self.stream = stream
+        self.offset = 0
         self.filename = filename
         self.lines = stream.splitlines()
         self.line = 0
         self.column = 0
         self.token = Token(None)
 
+        # Every token is lexed exactly once into these arrays, the parser walks
+        # them with an index so saving and restoring the state is just an int
+        self.tokens: List[Token] = []
+        self.token_files: List[str] = []
+        self.index = -1
+
         self.pushes = []
 
     def _syntax_error(self, msg):
@@ -155,33 +258,38 @@ class Tokenizer:
         traceback.print_stack(file=sys.stdout)
         exit(-1)
 
-    def _inc_stream(self, times=1):
-        # Increment the first thing
-        while times > 0:
-            was = self.stream[0]
-            self.stream = self.stream[1:]
-            if was == '\n':
-                self.line += 1
-                self.column = 0
-            else:
-                self.column += 1
-            times -= 1
+    def _advance(self, end):
+        """
+        Move the offset to the given end, updating the line and column on the way
+        """
+        newlines = self.stream.count('\n', self.offset, end)
+        if newlines != 0:
+            self.line += newlines
+            self.column = end - (self.stream.rfind('\n', self.offset, end) + 1)
+        else:
+            self.column += end - self.offset
+        self.offset = end
+
+    def _peek(self, i=0):
+        """
+        Returns the character at the given distance from the offset, or an empty string past the end
+        """
+        i += self.offset
+        return self.stream[i] if i < len(self.stream) else ''
 
     def save(self):
         """
         Will save the state so it can be restored later
         """
-        self.pushes.append((self.token, self.stream, self.line, self.column))
+        self.pushes.append(self.index)
 
     def restore(self):
         """
         Will restore the state to the saved state
         """
-        token, stream, line, col = self.pushes.pop()
-        self.token = token
-        self.stream = stream
-        self.line = line
-        self.column = col
+        self.index = self.pushes.pop()
+        self.token = self.tokens[self.index]
+        self.filename = self.token_files[self.index]
 
     def discard(self):
         """
@@ -246,38 +354,45 @@ class Tokenizer:
         return val, pos
 
     def next_token(self):
+        self.index += 1
+
+        # Only lex when going past the furthest token we have seen, after a
+        # restore we simply walk the already lexed tokens again
+        if self.index == len(self.tokens):
+            self.tokens.append(self._lex_token())
+            self.token_files.append(self.filename)
+
+        self.token = self.tokens[self.index]
+        self.filename = self.token_files[self.index]
+        return self.token
+
+    def _lex_token(self):
+        stream = self.stream
+        length = len(stream)
+
         # Clear unneeded stuff
         while True:
+            left = length - self.offset
+
             # Consume spaces
-            if len(self.stream) > 0 and self.stream[0].isspace():
-                self._inc_stream()
+            if self._peek().isspace():
+                self._advance(_WHITESPACE.match(stream, self.offset).end())
 
             # Consume multiline comment
-            elif len(self.stream) > 2 and self.stream[:2] == '/*':
-                self._inc_stream(2)
-                while len(self.stream) > 0:
-                    if len(self.stream) > 1 and self.stream[:2] == '*/':
-                        self._inc_stream(2)
-                        break
-                    self._inc_stream()
+            elif left > 2 and stream.startswith('/*', self.offset):
+                end = stream.find('*/', self.offset + 2)
+                self._advance(length if end == -1 else end + 2)
 
             # Consume one line comments
-            elif len(self.stream) > 2 and self.stream[:2] == '//':
-                self._inc_stream(2)
-                while len(self.stream) > 0:
-                    if self.stream[0] == '\n':
-                        self._inc_stream()
-                        break
-                    self._inc_stream()
-
-            elif len(self.stream) > 5 and self.stream.startswith('#line'):
-                self._inc_stream(len("#line "))
-                line = ''
-                while self.stream[0] != '\n':
-                    line += self.stream[0]
-                    self._inc_stream()
-                self._inc_stream()
-                line, file = line.split(' ', 1)
+            elif left > 2 and stream.startswith('//', self.offset):
+                end = stream.find('\n', self.offset + 2)
+                self._advance(length if end == -1 else end + 1)
+
+            elif left > 5 and stream.startswith('#line', self.offset):
+                start = self.offset + len("#line ")
+                end = stream.index('\n', start)
+                line, file = stream[start:end].split(' ', 1)
+                self._advance(end + 1)
                 file = file[1:-1]
                 self.filename = file
                 self.line = int(line)
@@ -287,17 +402,18 @@ class Tokenizer:
                 break
 
         pos = CodePosition(self.line, self.line, self.column, self.column)
+        c = self._peek()
 
         # End of file
-        if len(self.stream) == 0:
-            self.token = EofToken(pos)
+        if c == '':
+            token = EofToken(pos)
 
-        elif self.stream[0] == '\'':
-            self._inc_stream()
-            ch = self.stream[0]
-            self._inc_stream()
+        elif c == '\'':
+            i = self.offset + 1
+            ch = stream[i]
+            i += 1
             if ch == '\\':
-                ch = self.stream[0]
+                ch = stream[i]
                 if ch == 'n':
                     ch = '\n'
                 elif ch == 't':
@@ -306,182 +422,87 @@ class Tokenizer:
                     ch = '\0'
                 else:
                     self._syntax_error(f'invalid escape sequence `\\{ch}`')
-                self._inc_stream()
-            if self.stream[0] != '\'':
-                self._syntax_error(f'expected `\'`, got `{self.stream[0]}`')
-            self._inc_stream()
-            self.token = IntToken(pos, ord(ch))
+                i += 1
+            if stream[i] != '\'':
+                self._syntax_error(f'expected `\'`, got `{stream[i]}`')
+            self._advance(i + 1)
+            token = IntToken(pos, ord(ch))
 
         # Integers
-        elif self.stream[0].isdigit():
+        elif c.isdigit():
             # Figure the base
+            start = self.offset
             base = 10
-            chars = '0123456789'
-            if self.stream[0] == '0' and len(self.stream) > 3:
-                if self.stream[1].lower() == 'x':
+            digits = _DEC_DIGITS
+            if c == '0' and length - start > 3:
+                if stream[start + 1].lower() == 'x':
                     base = 16
-                    chars = '0123456789abcdefABCDEF'
-                    self._inc_stream(2)
-                elif self.stream[1].lower() == 'b':
+                    digits = _HEX_DIGITS
+                    start += 2
+                elif stream[start + 1].lower() == 'b':
                     base = 2
-                    chars = '01'
-                    self._inc_stream(2)
+                    digits = _BIN_DIGITS
+                    start += 2
                 else:
                     base = 8
-                    chars = '01234567'
+                    digits = _OCT_DIGITS
 
             # Get the value and parse it
-            value = ''
-            while len(self.stream) > 0 and self.stream[0] in chars:
-                value += self.stream[0]
-                self._inc_stream()
-
-            self.token = IntToken(pos, int(value, base))
+            end = digits.match(stream, start).end()
+            self._advance(end)
+            token = IntToken(pos, int(stream[start:end], base))
 
         # Identifier token or keywords
-        elif self.stream[0].isalpha() or self.stream[0] == '_':
-            value = ''
-            while len(self.stream) > 0 and (self.stream[0].isalnum() or self.stream[0] == '_'):
-                value += self.stream[0]
-                self._inc_stream()
+        elif c.isalpha() or c == '_':
+            end = _IDENT.match(stream, self.offset).end()
+            value = stream[self.offset:end]
+            self._advance(end)
 
             # Check if a keyword
-            if value in [
-                'if',
-                'else',
-                'do',
-                'while',
-                'for',
-                'return',
-                'goto',
-                'break',
-                'continue',
-                'switch',
-                'case',
-                'default',
-
-                'void',
-                'char',
-                'signed',
-                'unsigned',
-                'short',
-                'int',
-                'long',
-                'float',
-                'double',
-
-                'struct',
-                'enum',
-                'union',
-                'typedef',
-
-                'volatile',
-                'register',
-                'static',
-                'const',
-                'inline',
-                'extern',
-
-                'sizeof',
-                'asm',
-
-                '__regcall',
-                '__stackcall',
-                '__interrupt'
-            ]:
-                self.token = KeywordToken(pos, value)
+            if value in _KEYWORDS:
+                token = KeywordToken(pos, value)
             else:
-                self.token = IdentToken(pos, value)
+                token = IdentToken(pos, sys.intern(value))
 
         # String literal
-        elif self.stream[0] == '"':
-            self._inc_stream(1)
-
-            ESCAPES = {
-                'a': '\a',
-                'b': '\b',
-                'e': '\x1b',
-                'f': '\f',
-                'n': '\n',
-                'r': '\r',
-                't': '\t',
-                'v': '\v',
-                '\\': '\\',
-                '\'': '\'',
-                '"': '"',
-                '?': '?',
-            }
-
-            val = ""
-            while self.stream[0] != '"':
-                if self.stream[0] == '\\':
-                    self._inc_stream(1)
-                    if self.stream[0] in ESCAPES:
-                        val += ESCAPES[self.stream[0]]
-                        self._inc_stream(1)
+        elif c == '"':
+            i = self.offset + 1
+            val = []
+            while stream[i] != '"':
+                if stream[i] == '\\':
+                    i += 1
+                    if stream[i] in _ESCAPES:
+                        val.append(_ESCAPES[stream[i]])
+                        i += 1
 
                     # Hex constant
-                    elif self.stream[0] == 'x':
-                        val += chr(int(self.stream[0] + self.stream[1], 16))
-                        self._inc_stream(2)
+                    elif stream[i] == 'x':
+                        val.append(chr(int(stream[i + 1:i + 3], 16)))
+                        i += 3
 
                     else:
                         # TODO: show warning
-                        val += self.stream[0]
-                        self._inc_stream(1)
+                        val.append(stream[i])
+                        i += 1
                 else:
-                    val += self.stream[0]
-                    self._inc_stream(1)
-            self._inc_stream(1)
+                    end = _STRING_CHARS.match(stream, i).end()
+                    val.append(stream[i:end])
+                    i = end
+            self._advance(i + 1)
 
-            self.token = StringToken(pos, val)
+            token = StringToken(pos, ''.join(val))
 
         # Special characters
-        elif self.stream[0] in '()[]{};\',.:/*-+!%&<>=~^|?;#':
-
-            # Three character symbols
-            if len(self.stream) > 2 and self.stream[:3] in [
-                '>>=',
-                '<<='
-            ]:
-                self.token = SymbolToken(pos, self.stream[:3])
-                self._inc_stream(3)
-
-            # Two character symbols
-            elif len(self.stream) > 1 and self.stream[:2] in [
-                '<<',
-                '>>',
-                '&&',
-                '||',
-                '!=',
-                '==',
-                '<=',
-                '>=',
-                '+=',
-                '-=',
-                '*=',
-                '/=',
-                '%=',
-                '&=',
-                '|=',
-                '^=',
-                '++',
-                '--',
-                '->',
-            ]:
-                self.token = SymbolToken(pos, self.stream[:2])
-                self._inc_stream(2)
-
-            # Simple symbols
-            else:
-                self.token = SymbolToken(pos, self.stream[0])
-                self._inc_stream()
-
-        # Unknown
         else:
-            assert False, f'Unknown character {self.stream[0]}'
+            match = _SYMBOL.match(stream, self.offset)
+
+            # Unknown
+            assert match is not None, f'Unknown character {c}'
+
+            token = SymbolToken(pos, match.group())
+            self._advance(match.end())
 
         pos.end_column = self.column
         pos.end_line = self.line
 
-        return self.token
+        return token
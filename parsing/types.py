@@ -13,9 +13,14 @@ class StorageClass(Enum):
 
 
 class CType:
+    """
+    CInteger, CPointer, CArray and CVoid are interned, every structurally distinct type
+    exists exactly once, so types compare (and hash) by identity.
 
-    def __init__(self):
-        pass
+    CFunction and CStruct are filled in while parsing and are compared by identity too.
+    """
+
+    __slots__ = ()
 
     def __ne__(self, other):
         return not (self == other)
@@ -29,15 +34,35 @@ class CType:
 
 class CInteger(CType):
 
-    def __init__(self, bits: int, signed: bool):
-        super(CInteger, self).__init__()
-        self.bits = bits
-        self.signed = signed
-
-    def __eq__(self, other):
-        if isinstance(other, CInteger):
-            return self.signed == other.signed and self.bits == other.bits
-        return False
+    __slots__ = ('bits', 'signed', 'mask')
+
+    _interned = {}  # type: Dict[Tuple[int, bool], CInteger]
+
+    def __new__(cls, bits: int, signed: bool):
+        key = (bits, bool(signed))
+        typ = CInteger._interned.get(key)
+        if typ is None:
+            typ = super(CInteger, cls).__new__(cls)
+            typ.bits = bits
+            typ.signed = bool(signed)
+            typ.mask = (1 << bits) - 1
+            CInteger._interned[key] = typ
+        return typ
+
+    def wrap(self, value: int) -> int:
+        """
+        The bits stored for the value in an integer of this type, never negative
+        """
+        return value & self.mask
+
+    def value_of(self, value: int) -> int:
+        """
+        The value the bits of an integer of this type stand for, negative for signed types
+        """
+        value &= self.mask
+        if self.signed and value >> (self.bits - 1):
+            value -= 1 << self.bits
+        return value
 
     def sizeof(self):
         return self.bits // NATIVE_INTEGER_SIZE
@@ -68,18 +93,21 @@ class CInteger(CType):
 
 class CPointer(CType):
 
-    def __init__(self, typ: CType):
-        super(CPointer, self).__init__()
-        self.type = typ
+    __slots__ = ('type',)
+
+    _interned = {}  # type: Dict[CType, CPointer]
+
+    def __new__(cls, typ: CType):
+        ptr = CPointer._interned.get(typ)
+        if ptr is None:
+            ptr = super(CPointer, cls).__new__(cls)
+            ptr.type = typ
+            CPointer._interned[typ] = ptr
+        return ptr
 
     def sizeof(self):
         return 1
 
-    def __eq__(self, other):
-        if isinstance(other, CPointer):
-            return other.type == self.type
-        return False
-
     def __str__(self):
         # TODO: show the pointer type properly for functions
         return str(self.type) + '*'
@@ -90,11 +118,14 @@ class CPointer(CType):
 
 class CVoid(CType):
 
-    def __init__(self):
-        super(CVoid, self).__init__()
+    __slots__ = ()
 
-    def __eq__(self, other):
-        return isinstance(other, CVoid)
+    _instance = None  # type: CVoid
+
+    def __new__(cls):
+        if CVoid._instance is None:
+            CVoid._instance = super(CVoid, cls).__new__(cls)
+        return CVoid._instance
 
     def sizeof(self):
         assert False
@@ -114,8 +145,9 @@ class CallConv(Enum):
 
 class CFunction(CType):
 
+    __slots__ = ('callconv', 'ret_type', 'param_types')
+
     def __init__(self):
-        super(CFunction, self).__init__()
         self.callconv = None
         self.ret_type = CVoid()  # type: CType
         self.param_types = []  # type: List[CType]
@@ -133,10 +165,19 @@ class CFunction(CType):
 
 class CArray(CType):
 
-    def __init__(self, typ: CType, len: int or None):
-        super(CArray, self).__init__()
-        self.type = typ
-        self.len = len
+    __slots__ = ('type', 'len')
+
+    _interned = {}  # type: Dict[Tuple[CType, int], CArray]
+
+    def __new__(cls, typ: CType, len: int or None):
+        key = (typ, len)
+        arr = CArray._interned.get(key)
+        if arr is None:
+            arr = super(CArray, cls).__new__(cls)
+            arr.type = typ
+            arr.len = len
+            CArray._interned[key] = arr
+        return arr
 
     def sizeof(self):
         assert self.is_complete()
@@ -160,41 +201,62 @@ def _align(base, size):
 
 class CStruct(CType):
 
+    __slots__ = ('name', 'union', 'pos', 'items', '_fields', '_size')
+
     def __init__(self, name: str, name_pos):
-        super(CStruct, self).__init__()
         self.name = name
         self.union = False
         self.pos = name_pos
         self.items = []  # type: List[Tuple[str, CType]]
 
+        # The layout, field name to (offset, type), and the total size
+        self._fields = None  # type: Dict[str, Tuple[int, CType]]
+        self._size = None  # type: int
+
+    def freeze(self):
+        """
+        Compute the layout from the items, called once the struct definition is complete
+        """
+        fields = {}
+        size = 0
+        for name, typ in self.items:
+            if name not in fields:
+                fields[name] = (0 if self.union else size, typ)
+
+            # Anything after an incomplete member has no known offset and the struct has no size
+            if size is None or not typ.is_complete():
+                size = None
+            elif self.union:
+                # For union the size is the max size
+                size = max(typ.sizeof(), size)
+            else:
+                # For struct the size is the sum
+                size += typ.sizeof()
+
+        self._fields = fields
+        self._size = size
+
+    def _layout(self):
+        if self._fields is None:
+            self.freeze()
+        return self._fields
+
     def get_field(self, name):
-        for item, typ in self.items:
-            if item == name:
-                return typ
-        return None
+        field = self._layout().get(name)
+        if field is None:
+            return None
+        return field[1]
 
     def offsetof(self, name):
-        if self.union:
-            return 0
-        else:
-            offset = 0
-            for item, typ in self.items:
-                if item == name:
-                    return offset
-                offset += typ.sizeof()
-            return None
+        field = self._layout().get(name)
+        if field is None:
+            return 0 if self.union else None
+        return field[0]
 
     def sizeof(self):
-        s = 0
-        if self.union:
-            # For union the size is the max size
-            for name, typ in self.items:
-                s = max(typ.sizeof(), s)
-        else:
-            # For struct the size is the sum
-            for name, typ in self.items:
-                s += typ.sizeof()
-        return s
+        self._layout()
+        assert self._size is not None, f'`{self}` has an incomplete member'
+        return self._size
 
     def is_complete(self):
         return self.items is not None
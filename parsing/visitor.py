@@ -0,0 +1,64 @@
+class _DispatchTable(dict):
+    """
+    Node class to handler, filled on first use of every class
+    """
+
+    def __init__(self, visitor):
+        super(_DispatchTable, self).__init__()
+        self._visitor = visitor
+
+    def __missing__(self, cls):
+        handler = self[cls] = self._visitor.lookup(cls)
+        return handler
+
+
+class visitor:
+    """
+    Turns a method into one that dispatches on the class of the node it is given, in the spirit
+    of functools.singledispatchmethod:
+
+        @visitor
+        def _visit(self, expr, ...):
+            # default, for nodes without a handler
+            ...
+
+        @_visit.register(ExprBinary)
+        def _visit_binary(self, expr, ...):
+            ...
+
+    The handler for a class is looked up once (through the mro, so a handler for a base class
+    applies to its subclasses) and then kept in a table, so dispatching costs one dict lookup.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._handlers = {}
+        self._table = _DispatchTable(self)
+
+    def register(self, *classes):
+        def decorator(func):
+            for cls in classes:
+                self._handlers[cls] = func
+            self._table.clear()
+            return func
+        return decorator
+
+    def lookup(self, cls):
+        for base in cls.__mro__:
+            if base in self._handlers:
+                return self._handlers[base]
+        return self._default
+
+    def __set_name__(self, owner, name):
+        # Once the class is created replace ourselves with a plain function, that way
+        # calling it is a normal method call followed by a single table lookup
+        table = self._table
+
+        def dispatch(obj, node, *args):
+            return table[node.__class__](obj, node, *args)
+
+        dispatch.__name__ = name
+        dispatch.__qualname__ = f'{owner.__qualname__}.{name}'
+        dispatch.__doc__ = self._default.__doc__
+        dispatch.register = self.register
+        setattr(owner, name, dispatch)
@@ -0,0 +1,69 @@
+"""
+Constant folding throughput, run with `python -m tests.bench_fold`.
+
+Times fold_binary on random numbers of every integer type, and the optimizer on a function made of
+long constant expressions.
+"""
+import random
+import timeit
+
+from parsing.parser import Parser
+from parsing.optimizer import Optimizer
+from parsing.evaluator import fold_binary
+from parsing.ast import *
+
+
+NODES = 20000
+STATEMENTS = 500
+
+_TYPES = [CInteger(bits, signed) for bits in (8, 16, 32) for signed in (True, False)]
+_OPS = ['+', '-', '*', '/', '%', '&', '|', '^', '<<', '>>', '==', '!=', '<', '>', '<=', '>=']
+
+
+def _nodes(rand):
+    nodes = []
+    for _ in range(NODES):
+        ltyp = rand.choice(_TYPES)
+        rtyp = rand.choice(_TYPES)
+        op = rand.choice(_OPS)
+        right = rand.randrange(16) if op in ('<<', '>>') else rand.randrange(1, rtyp.mask + 1)
+        nodes.append(ExprBinary(ExprNumber(rand.randrange(ltyp.mask + 1), ltyp), op, ExprNumber(right, rtyp)))
+    return nodes
+
+
+def _source(rand):
+    ops = ['+', '-', '*', '&', '|', '^']
+    lines = []
+    for i in range(STATEMENTS):
+        expr = str(rand.randrange(1000))
+        for _ in range(15):
+            expr = f'({expr} {rand.choice(ops)} {rand.randrange(1000)})'
+        lines.append(f'x = x + {expr};')
+    body = '\n'.join(lines)
+    return f'int f(int x) {{ {body} return x; }}'
+
+
+def main():
+    rand = random.Random(0)
+
+    nodes = _nodes(rand)
+    best = min(timeit.repeat(lambda: [fold_binary(node, None) for node in nodes], number=1, repeat=5))
+    print(f'fold_binary: {best / NODES * 1e6:.2f}us per fold ({NODES} nodes)')
+
+    source = _source(rand)
+
+    def optimize():
+        parser = Parser(source)
+        parser.parse()
+        Optimizer(parser).optimize()
+
+    def parse():
+        Parser(source).parse()
+
+    total = min(timeit.repeat(optimize, number=1, repeat=3))
+    parsing = min(timeit.repeat(parse, number=1, repeat=3))
+    print(f'optimizer: {(total - parsing) * 1e3:.1f}ms for {STATEMENTS * 15} constant operations')
+
+
+if __name__ == '__main__':
+    main()
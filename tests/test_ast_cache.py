@@ -0,0 +1,85 @@
+from collections import Counter
+
+from parsing.parser import Parser
+from parsing.ast import *
+
+
+def _expr_classes(cls=Expr):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _expr_classes(sub)
+
+
+def _count_resolves(monkeypatch):
+    """
+    Count the calls to _resolve_type per node, the nodes are kept alive so ids are not reused
+    """
+    counts = Counter()
+    nodes = []
+
+    for cls in _expr_classes():
+        if '_resolve_type' not in cls.__dict__:
+            continue
+
+        def counted(self, ast, _resolve=cls.__dict__['_resolve_type']):
+            counts[id(self)] += 1
+            nodes.append(self)
+            return _resolve(self, ast)
+
+        monkeypatch.setattr(cls, '_resolve_type', counted)
+
+    return counts
+
+
+def test_types_are_resolved_once_per_node(monkeypatch):
+    counts = _count_resolves(monkeypatch)
+
+    # Every level of the expression used to resolve the types of everything below it again
+    expr = ' + '.join(f'(a * {i} - b[{i}] / (c + {i}))' for i in range(50))
+    parser = Parser(f'''
+        int b[50];
+        int f(int a, int c) {{
+            int x;
+            x = {expr};
+            x += {expr};
+            return x == {expr};
+        }}
+    ''')
+    parser.parse()
+    assert not parser.got_errors
+
+    assert len(counts) > 1000
+    assert max(counts.values()) == 1
+
+
+def test_invalidate_drops_the_cached_type():
+    expr = ExprBinary(ExprNumber(1, CInteger(8, True)), '+', ExprNumber(2))
+    assert expr.resolve_type(None) == CInteger(8, True)
+
+    expr.left = ExprNumber(1)
+    assert expr.resolve_type(None) == CInteger(8, True)
+    expr.invalidate()
+    assert expr.resolve_type(None) == CInteger(NATIVE_INTEGER_SIZE, True)
+
+
+def test_purity_epoch_invalidates_cached_purity():
+    parser = Parser('''
+        int g();
+        int f() { return g(); }
+    ''')
+    parser.parse()
+    assert not parser.got_errors
+
+    g = parser.func_list[0]
+    assert g.name == 'g'
+    g.pure_known = True
+    g.pure = False
+
+    call = ExprCall(ExprIdent(FunctionIdentifier('g', 0)), [])
+    assert not call.is_pure(parser)
+
+    # The cached result is kept until purity is invalidated
+    g.pure = True
+    assert not call.is_pure(parser)
+    Expr.invalidate_purity()
+    assert call.is_pure(parser)
@@ -0,0 +1,81 @@
+from parsing.parser import Parser
+from parsing.optimizer import Optimizer
+from parsing.ast import *
+
+
+def _optimize(code):
+    parser = Parser(code)
+    parser.parse()
+    assert not parser.got_errors
+    Optimizer(parser).optimize()
+    return {func.name: func for func in parser.func_list}
+
+
+def _statements(func):
+    if isinstance(func.code, ExprComma):
+        return func.code.exprs
+    return [func.code]
+
+
+def test_guarded_repeats_stay_behind_the_guard():
+    funcs = _optimize('''
+        int f(int *p, int d) {
+            if (p && *p + 1 == *p + 1) return 1;
+            if (d && 100 / d == 100 / d) return 2;
+            return 0;
+        }
+    ''')
+
+    # Nothing is computed before the null and zero checks
+    statements = _statements(funcs['f'])
+    assert not any(isinstance(s, ExprCopy) for s in statements)
+
+
+def test_unconditional_repeats_are_hoisted():
+    funcs = _optimize('''
+        int f(int a, int b, int d) {
+            return (a / d + a / d) || (d && a / d);
+        }
+    ''')
+
+    statements = _statements(funcs['f'])
+    assert len(statements) == 2
+    copy, ret = statements
+    assert isinstance(copy, ExprCopy) and isinstance(ret, ExprReturn)
+    assert isinstance(copy.source, ExprBinary) and copy.source.op == '/'
+
+
+def test_intern_does_not_change_the_expression():
+    table = ExprTable()
+    a = VariableIdentifier('a', 0)
+    b = VariableIdentifier('b', 1)
+
+    first = table.intern(ExprBinary(ExprIdent(a), '+', ExprIdent(b)))
+
+    # An equal subtree under a call is not replaced, the call can't be interned
+    inner = ExprBinary(ExprIdent(a), '+', ExprIdent(b))
+    left = ExprBinary(inner, '*', ExprNumber(2))
+    expr = ExprBinary(left, '+', ExprCall(ExprIdent(a), []))
+    assert table.intern(expr) is expr
+    assert expr.left is left and left.left is inner
+
+    # When the whole tree can be interned a copy points at the shared nodes
+    left = ExprBinary(ExprBinary(ExprIdent(a), '+', ExprIdent(b)), '*', ExprNumber(2))
+    interned = table.intern(left)
+    assert interned is not left and interned.left is first
+    assert left.left is not first
+
+
+def test_temporaries_have_the_type_of_the_repeat():
+    parser = Parser('''
+        struct pair { int a; unsigned b; };
+        int f(struct pair *p) { return p->b * p->b + p->b; }
+    ''')
+    parser.parse()
+    assert not parser.got_errors
+    Optimizer(parser).optimize()
+
+    func = parser.func_list[0]
+    copy, _ = _statements(func)
+    assert isinstance(copy, ExprCopy) and isinstance(copy.source, ExprDeref)
+    assert func.vars[copy.destination.ident.index].typ == CInteger(16, False)
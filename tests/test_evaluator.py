@@ -0,0 +1,86 @@
+from parsing.parser import Parser
+from parsing.optimizer import Optimizer
+from parsing.evaluator import Evaluator, fold_binary
+from parsing.ast import *
+
+
+def _optimize(code):
+    parser = Parser(code)
+    parser.parse()
+    assert not parser.got_errors
+    Optimizer(parser).optimize()
+    return {func.name: func for func in parser.func_list}
+
+
+def _fold(left, op, right):
+    return fold_binary(ExprBinary(left, op, right), None)
+
+
+def test_narrow_operands_are_promoted():
+    char = CInteger(8, True)
+    uchar = CInteger(8, False)
+
+    result = _fold(ExprNumber(100, char), '+', ExprNumber(200))
+    assert result.value == 300 and result.typ == CInteger(NATIVE_INTEGER_SIZE, True)
+
+    # -1 as a signed char stays -1 once promoted
+    result = _fold(ExprNumber(char.wrap(-1), char), '*', ExprNumber(3))
+    assert result.typ.value_of(result.value) == -3
+
+    result = _fold(ExprNumber(100, uchar), '<<', ExprNumber(4))
+    assert result.value == 1600
+
+
+def test_folded_calls_match_the_runtime():
+    funcs = _optimize('''
+        int f(char c) { return c + 200; }
+        char g(char c) { return c + 200; }
+        int a;
+        char b;
+        void h() { a = f(100); b = g(100); }
+    ''')
+
+    (a, b, _) = funcs['h'].code.exprs
+    assert a.source.value == 300
+
+    # Only the return narrows the value
+    assert b.source.value == 44
+
+
+def test_negative_narrow_values_are_sign_extended():
+    # No inlining, so every call goes through the evaluator
+    parser = Parser('''
+        char g() { return 0 - 1; }
+        int id(int x) { return x; }
+        int h(char c) { int y; y = c; return y; }
+        int a;
+        int b;
+        int c;
+        void m() { a = id(g()); b = h(0 - 1); c = g() + 0; }
+    ''')
+    parser.parse()
+    assert not parser.got_errors
+    Optimizer(parser, 0).optimize()
+    funcs = {func.name: func for func in parser.func_list}
+
+    # The returned char, the char parameter copied to an int and the char in an addition
+    (a, b, c, _) = funcs['m'].code.exprs
+    assert a.source.value == 0xFFFF
+    assert b.source.value == 0xFFFF
+    assert c.source.value == 0xFFFF
+
+
+def test_negative_narrow_values_are_sign_extended_by_casts():
+    char = CInteger(8, True)
+    evaluator = Evaluator(None)
+
+    result = evaluator.constant(ExprCast(ExprNumber(char.wrap(-1), char), CInteger(16, True)))
+    assert result.value == 0xFFFF
+
+    result = evaluator.constant(ExprCast(ExprNumber(char.wrap(-1), char), CInteger(16, False)))
+    assert result.value == 0xFFFF
+
+    # An unsigned char is zero extended
+    uchar = CInteger(8, False)
+    result = evaluator.constant(ExprCast(ExprNumber(0xFF, uchar), CInteger(16, True)))
+    assert result.value == 0xFF
@@ -0,0 +1,196 @@
+import random
+from fractions import Fraction
+
+from parsing.parser import Parser
+from parsing.optimizer import Optimizer
+from parsing.evaluator import fold_binary
+from parsing.ast import *
+
+
+def _optimize(code):
+    parser = Parser(code)
+    parser.parse()
+    assert not parser.got_errors
+    Optimizer(parser).optimize()
+    return parser
+
+
+def _returned(func):
+    code = func.code
+    if isinstance(code, ExprComma):
+        code = code.exprs[-1]
+    assert isinstance(code, ExprReturn)
+    return code.expr
+
+
+def test_casts_of_numbers_are_folded():
+    parser = _optimize('''
+        int g = (char)300;
+        int *p = (int*)0;
+        int narrow() { return (char)300; }
+        int extend() { return (int)(char)255; }
+        unsigned half() { return (unsigned)(0 - 1) / 2; }
+        int signed_half() { return (int)(0 - 1) / 2; }
+    ''')
+    funcs = {func.name: func for func in parser.func_list}
+
+    assert [var.value for var in parser.global_vars] == [44, 0]
+
+    value = _returned(funcs['narrow'])
+    assert value.value == 44 and value.typ == CInteger(8, True)
+
+    # 255 as a char is -1
+    assert _returned(funcs['extend']).value == 0xFFFF
+
+    # The cast decides if the division is signed
+    assert _returned(funcs['half']).value == 0x7FFF
+    assert _returned(funcs['signed_half']).value == 0
+
+
+def test_casts_of_variables_are_kept():
+    parser = _optimize('''
+        int f(int a) { return (unsigned)a; }
+        int g(int a) { return (int)a; }
+    ''')
+    funcs = {func.name: func for func in parser.func_list}
+
+    value = _returned(funcs['f'])
+    assert isinstance(value, ExprCast) and value.typ == CInteger(16, False)
+
+    # Casting to the type it already has does nothing
+    assert isinstance(_returned(funcs['g']), ExprIdent)
+
+
+########################################################################################################################
+# fold_binary against a model of the target
+########################################################################################################################
+
+_TYPES = [CInteger(bits, signed) for bits in (8, 16, 32) for signed in (True, False)]
+
+_OPS = ['+', '-', '*', '/', '%', '&', '|', '^', '<<', '>>', '==', '!=', '<', '>', '<=', '>=']
+
+
+def _model(a, atyp, op, b, btyp):
+    """
+    What the target computes, written out the long way: the value the bits stand for, promotion
+    to int, the common type, then the operation, None if it is undefined
+    """
+    def value(bits, typ):
+        bits %= 1 << typ.bits
+        if typ.signed and bits >= 1 << (typ.bits - 1):
+            bits -= 1 << typ.bits
+        return bits
+
+    def promote(typ):
+        return (16, True) if typ.bits < 16 else (typ.bits, typ.signed)
+
+    a = value(a, atyp)
+    b = value(b, btyp)
+    abits, asigned = promote(atyp)
+    bbits, bsigned = promote(btyp)
+
+    if op in ('<<', '>>'):
+        bits, signed = abits, asigned
+        a = value(a, CInteger(bits, signed))
+        if b < 0 or b >= bits:
+            return None
+    else:
+        bits, signed = max(abits, bbits), asigned and bsigned
+        a = value(a, CInteger(bits, signed))
+        b = value(b, CInteger(bits, signed))
+
+    if op in ('/', '%'):
+        if b == 0:
+            return None
+        quotient = int(Fraction(a, b))
+        result = quotient if op == '/' else a - quotient * b
+    elif op in ('==', '!=', '<', '>', '<=', '>='):
+        return int(eval(f'{a} {op} {b}')), 16
+    else:
+        result = eval(f'({a}) {op} ({b})')
+
+    return result % (1 << bits), bits
+
+
+def _random_number(rand, typ):
+    # Mostly edge values, they are where the width and the sign matter
+    edges = [0, 1, 2, typ.mask, typ.mask - 1, typ.mask >> 1, (typ.mask >> 1) + 1]
+    if rand.random() < 0.5:
+        return rand.choice(edges)
+    return rand.randrange(typ.mask + 1)
+
+
+def test_fold_binary_matches_the_model():
+    rand = random.Random(1234)
+    for _ in range(20000):
+        op = rand.choice(_OPS)
+        atyp = rand.choice(_TYPES)
+        btyp = rand.choice(_TYPES)
+        a = _random_number(rand, atyp)
+        if op in ('<<', '>>'):
+            b = rand.randrange(40)
+            b = btyp.wrap(b)
+        else:
+            b = _random_number(rand, btyp)
+
+        folded = fold_binary(ExprBinary(ExprNumber(a, atyp), op, ExprNumber(b, btyp)), None)
+        expected = _model(a, atyp, op, b, btyp)
+
+        context = f'{a} ({atyp.bits}, {atyp.signed}) {op} {b} ({btyp.bits}, {btyp.signed})'
+        if expected is None:
+            assert folded is None, context
+        else:
+            value, bits = expected
+            assert folded is not None, context
+            assert (folded.value, folded.typ.bits) == (value, bits), context
+
+
+def test_division_truncates_towards_zero():
+    int16 = CInteger(16, True)
+    for a, b, quotient, remainder in ((7, 2, 3, 1), (-7, 2, -3, -1), (7, -2, -3, 1), (-7, -2, 3, -1)):
+        a = ExprNumber(int16.wrap(a), int16)
+        b = ExprNumber(int16.wrap(b), int16)
+        assert int16.value_of(fold_binary(ExprBinary(a, '/', b), None).value) == quotient
+        assert int16.value_of(fold_binary(ExprBinary(a, '%', b), None).value) == remainder
+
+
+def test_undefined_operations_are_not_folded():
+    for typ in _TYPES:
+        number = ExprNumber(5, typ)
+        assert fold_binary(ExprBinary(number, '/', ExprNumber(0, typ)), None) is None
+        assert fold_binary(ExprBinary(number, '%', ExprNumber(0, typ)), None) is None
+
+        # Narrow types are shifted as ints
+        width = max(typ.bits, NATIVE_INTEGER_SIZE)
+        assert fold_binary(ExprBinary(number, '<<', ExprNumber(width)), None) is None
+        assert fold_binary(ExprBinary(number, '>>', ExprNumber(width + 3)), None) is None
+        assert fold_binary(ExprBinary(number, '<<', ExprNumber(width - 1)), None) is not None
+
+
+def test_unary_operators_fold():
+    names = {
+        'char': CInteger(8, True),
+        'unsigned char': CInteger(8, False),
+        'int': CInteger(16, True),
+        'unsigned': CInteger(16, False),
+        'long': CInteger(32, True),
+        'unsigned long': CInteger(32, False),
+    }
+
+    rand = random.Random(4321)
+    for name, typ in names.items():
+        for _ in range(20):
+            value = _random_number(rand, typ)
+            parser = _optimize(f'''
+                long flip() {{ return ~({name}){value}ul; }}
+                int negate() {{ return !({name}){value}ul; }}
+            ''')
+            funcs = {func.name: func for func in parser.func_list}
+
+            # ~ flips every bit of the promoted value
+            width = max(typ.bits, NATIVE_INTEGER_SIZE)
+            flipped = _returned(funcs['flip'])
+            assert flipped.typ.bits == width
+            assert flipped.value == (~typ.value_of(value)) % (1 << width), (name, value)
+
+            assert _returned(funcs['negate']).value == int(value == 0), (name, value)
@@ -0,0 +1,82 @@
+from parsing.parser import Parser
+from parsing.ir_translator import IrTranslator
+from ir.control_flow import make_cfg
+from ir.ssa import SsaBuilder
+from ir.ir import *
+
+
+# Enough statements for well over 100k temporaries and SSA names
+_STATEMENTS = 35000
+
+
+def _translate(code):
+    parser = Parser(code)
+    parser.parse()
+    assert not parser.got_errors
+
+    trans = IrTranslator(parser)
+    trans.translate()
+    return trans.proc_list
+
+
+def test_table_round_trips_past_16_bits():
+    xvars = IrVarTable()
+    xvars.add_bases(100000)
+    assert len(xvars) == 100000
+
+    made = {}
+    for base in (0, 1, 65535, 65536, 99999):
+        for subscript in (1, 2, 65535, 65536, 70000):
+            for special in (0, 1, 65536):
+                xid = xvars.make_var(base, subscript, special)
+                assert xvars.get_base(xid) == base
+                assert xvars.get_subscript(xid) == subscript
+                assert xvars.get_special(xid) == special
+                made[(base, subscript, special)] = xid
+
+    # Every variable has its own id and asking again gives the same one
+    assert len(set(made.values())) == len(made)
+    for key, xid in made.items():
+        assert xvars.make_var(*key) == xid
+
+    # Ids stay dense
+    assert len(xvars) == 100000 + len(made)
+    assert xvars.make_var(65536) == 65536
+
+
+def test_ssa_of_a_huge_function():
+    body = '\n'.join('y = y + x * i; x = x ^ y;' for _ in range(_STATEMENTS))
+    proc, = _translate(f'''
+        int f(int x, int i) {{
+            int y;
+            y = 0;
+            if (x) y = i;
+            {body}
+            return y;
+        }}
+    ''')
+
+    xvars = proc.get_vars()
+    bases = len(xvars)
+    assert bases > 100000
+
+    cfg = make_cfg(proc.get_body(), xvars)
+    SsaBuilder().transform(cfg)
+
+    defined = []
+    for blk in cfg.get_blocks():
+        for inst in blk.get_instructions():
+            if inst.op.is_opcode_assign() and isinstance(inst.oprs[0], IrVar):
+                defined.append(inst.oprs[0].get_id())
+
+    # Every definition got its own name, well past what fits in 16 bits
+    assert len(defined) > 100000
+    assert len(set(defined)) == len(defined)
+    assert max(defined) > 65535
+
+    for xid in defined:
+        base = xvars.get_base(xid)
+        assert base < bases
+        assert xvars.get_special(xid) == 0
+        assert xvars.get_subscript(xid) != 0
+        assert xvars.make_var(base, xvars.get_subscript(xid)) == xid
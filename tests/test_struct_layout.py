@@ -0,0 +1,71 @@
+import pytest
+
+from parsing.parser import Parser
+from parsing.types import *
+
+
+def _globals(code):
+    parser = Parser(code)
+    parser.parse()
+    assert not parser.got_errors
+    return {var.ident.name: var.typ for var in parser.global_vars}
+
+
+def test_nested_struct_layout():
+    types = _globals('''
+        struct point { int x; int y; };
+        struct rect { int id; struct point from; struct point to; int tags[3]; int *next; };
+        struct rect r;
+    ''')
+
+    rect = types['r']
+    point = rect.get_field('from')
+    assert isinstance(point, CStruct) and point.name == 'point'
+    assert rect.get_field('to') is point
+    assert point.sizeof() == 2
+
+    assert [rect.offsetof(name) for name in ('id', 'from', 'to', 'tags', 'next')] == [0, 1, 3, 5, 8]
+    assert rect.get_field('tags') == CArray(CInteger(16, True), 3)
+    assert rect.sizeof() == 9
+
+    # Unknown fields
+    assert rect.get_field('z') is None
+    assert rect.offsetof('z') is None
+
+
+def test_union_layout():
+    types = _globals('''
+        struct pair { int a; int b; };
+        union value { int word; struct pair pair; int words[4]; int *ptr; int word; };
+        union value v;
+    ''')
+
+    value = types['v']
+    assert value.union
+    for name in ('word', 'pair', 'words', 'ptr'):
+        assert value.offsetof(name) == 0
+    assert value.sizeof() == 4
+
+    # The first member with a name is the one that is found
+    assert value.get_field('word') == CInteger(16, True)
+    assert value.get_field('words') == CArray(CInteger(16, True), 4)
+
+    assert value.get_field('missing') is None
+    assert value.offsetof('missing') == 0
+
+
+def test_struct_with_incomplete_member():
+    tail = CArray(CInteger(16, True), None)
+
+    struct = CStruct('packet', None)
+    struct.items = [('len', CInteger(16, True)), ('kind', CInteger(16, False)), ('data', tail)]
+    struct.freeze()
+
+    # The incomplete member still has a type and an offset
+    assert struct.get_field('data') is tail
+    assert struct.offsetof('data') == 2
+    assert struct.offsetof('kind') == 1
+
+    # But the struct has no size
+    with pytest.raises(AssertionError):
+        struct.sizeof()